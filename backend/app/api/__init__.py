@@ -6,6 +6,8 @@ from . import reports
 from . import dashboard
 from . import ml
 from . import bot
+from . import cache
+from . import events
 
 api_router = APIRouter()
 api_router.include_router(csv.router, prefix="/csv", tags=["csv"])
@@ -15,3 +17,5 @@ api_router.include_router(reports.router, prefix="/reports", tags=["reports"])
 api_router.include_router(dashboard.router, prefix="/dashboard", tags=["dashboard"])
 api_router.include_router(ml.router, prefix="/ml", tags=["ml"])
 api_router.include_router(bot.router, prefix="/bot", tags=["bot"])
+api_router.include_router(cache.router, prefix="/cache", tags=["cache"])
+api_router.include_router(events.router, prefix="/events", tags=["events"])
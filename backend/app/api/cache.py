@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+
+from app.core.cache import response_cache
+from app.services.report_cache import report_cache
+
+router = APIRouter()
+
+
+@router.get("/stats", response_model=dict)
+def get_cache_stats():
+    """Response cache hit/miss counters (per process) and backend info"""
+    return {**response_cache.stats(), "reports": report_cache.stats()}
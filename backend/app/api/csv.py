@@ -1,9 +1,14 @@
+from uuid import uuid4
+
 import pandas as pd
 from fastapi import APIRouter, Depends, HTTPException, UploadFile
 from sqlmodel import Session, select
 
 from app.api.deps import get_db
+from app.core.cache import cached
+from app.core.events import event_bus
 from app.models.file_import import FileImport
+from app.services.data_version import IMPORTS_TAG, bump_data_versions
 from app.services.import_helpers import detect_file_type, read_file_to_df
 from app.services.objects_importer import import_objects
 from app.services.diagnostics_importer import import_diagnostics
@@ -12,9 +17,14 @@ router = APIRouter()
 
 
 @router.post("/import/")
-async def import_file(file: UploadFile, db: Session = Depends(get_db)):
-    """Parse uploaded CSV/XLSX, detect file type, preview, and ingest data."""
-    content = await file.read()
+def import_file(file: UploadFile, db: Session = Depends(get_db)):
+    """
+    Parse uploaded CSV/XLSX, detect file type, preview, and ingest data.
+
+    Runs in the threadpool, so the event stream keeps delivering
+    `import.*` progress events while the file is ingested.
+    """
+    content = file.file.read()
     file_size = len(content)
     max_size = 5 * 1024 * 1024  # 5MB
     if file_size > max_size:
@@ -33,15 +43,35 @@ async def import_file(file: UploadFile, db: Session = Depends(get_db)):
     updated = 0
     defects_created = 0
 
-    if file_type == "objects":
-        created = import_objects(df, db, errors)
-    elif file_type == "diagnostics":
-        required_diag = {"object_id", "method", "date", "defect_found"}
-        cols_lower = {c.lower() for c in columns}
-        missing = [col for col in required_diag if col not in cols_lower]
-        if missing:
-            raise HTTPException(status_code=400, detail=f"Missing required diagnostic columns: {', '.join(missing)}")
-        created, defects_created = import_diagnostics(df, db, errors)
+    upload_id = uuid4().hex
+    event_bus.publish("import.started", {
+        "upload_id": upload_id,
+        "filename": file.filename,
+        "file_type": file_type,
+        "rows": len(df),
+    })
+
+    def report_progress(stage: str, processed: int, total: int):
+        event_bus.publish("import.progress", {
+            "upload_id": upload_id,
+            "stage": stage,
+            "processed": processed,
+            "total": total,
+        })
+
+    try:
+        if file_type == "objects":
+            created = import_objects(df, db, errors)
+        elif file_type == "diagnostics":
+            required_diag = {"object_id", "method", "date", "defect_found"}
+            cols_lower = {c.lower() for c in columns}
+            missing = [col for col in required_diag if col not in cols_lower]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"Missing required diagnostic columns: {', '.join(missing)}")
+            created, defects_created = import_diagnostics(df, db, errors, progress=report_progress)
+    except HTTPException as exc:
+        event_bus.publish("import.failed", {"upload_id": upload_id, "detail": exc.detail})
+        raise
 
     # Save import history
     file_import = FileImport(
@@ -54,8 +84,17 @@ async def import_file(file: UploadFile, db: Session = Depends(get_db)):
         error_count=len(errors),
     )
     db.add(file_import)
+    bump_data_versions(db, tags=[IMPORTS_TAG])
     db.commit()
     db.refresh(file_import)
+    event_bus.publish("import.finished", {
+        "upload_id": upload_id,
+        "import_id": file_import.import_id,
+        "file_type": file_type,
+        "created": created,
+        "defects_created": defects_created,
+        "error_count": len(errors),
+    })
 
     head_df = df.head(5)
     preview_df = head_df.where(pd.notnull(head_df), None)
@@ -79,6 +118,7 @@ async def import_file(file: UploadFile, db: Session = Depends(get_db)):
 
 
 @router.get("/imports/", response_model=list[dict])
+@cached("csv.imports", tags=[IMPORTS_TAG])
 def get_import_history(
     limit: int = 50,
     offset: int = 0,
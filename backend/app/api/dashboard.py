@@ -1,19 +1,37 @@
-from datetime import datetime
-from typing import List, Optional
-from sqlalchemy import func
+import math
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import case, extract, func
 from sqlmodel import Session, select
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 
 from app.api.deps import get_db
-from app.models.inspection import Inspection
+from app.core.cache import response_cache
+from app.core.database import engine
+from app.models.dashboard_rollup import InspectionRollup
 from app.models.defect import Defect
-from app.models.object import Object
 from app.models.diagnostic import DiagnosticMethod, MLLabel
+from app.models.inspection import Inspection
+from app.models.object import Object
+from app.services.dashboard_rollups import criticality_of
+from app.services.data_version import INSPECTIONS_TAG, LABELS_TAG, OBJECTS_TAG
+from app.services.risk_ranking import RiskEntry, RiskWeights, rank_risks
+from app.services.time_buckets import bucket_index, bucket_start, bucket_start_expr, to_date
 
 
 router = APIRouter()
 
+TOP_RISKS_LIMIT = 5
+
+DASHBOARD_TAGS = [OBJECTS_TAG, INSPECTIONS_TAG, LABELS_TAG]
+
+# Widgets run concurrently, each on its own pooled connection
+_widget_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="dashboard-widget")
+
 
 class DefectByMethod(BaseModel):
     method: str
@@ -34,6 +52,13 @@ class TopRisk(BaseModel):
     max_depth: Optional[float]
 
 
+class RiskPage(BaseModel):
+    total: int
+    page: int
+    size: int
+    items: List[RiskEntry]
+
+
 class InspectionsByYear(BaseModel):
     year: int
     count: int
@@ -44,117 +69,375 @@ class DashboardStats(BaseModel):
     defects_by_criticality: List[DefectByCriticality]
     top_risks: List[TopRisk]
     inspections_by_year: List[InspectionsByYear]
+    timings_ms: Optional[Dict[str, float]] = None
 
 
-@router.get("/stats", response_model=DashboardStats)
-def get_dashboard_stats(db: Session = Depends(get_db)):
-    """Get dashboard statistics"""
-    
-    # 1. Распределение дефектов по методам
-    # Получаем все дефекты и их инспекции
-    all_defects = db.exec(select(Defect)).all()
-    inspection_ids = [d.inspection_id for d in all_defects]
-    
-    method_counts = {}
-    if inspection_ids:
-        inspections = db.exec(
-            select(Inspection).where(Inspection.inspection_id.in_(inspection_ids))
+class TrendPoint(BaseModel):
+    period_start: date
+    period_end: date  # exclusive
+    inspections: int
+    defects: int
+    high_criticality: int
+    avg_depth: Optional[float]
+    max_depth: Optional[float]
+
+
+class TrendSeries(BaseModel):
+    group: Optional[str]
+    points: List[TrendPoint]
+
+
+class DashboardTrends(BaseModel):
+    bucket: str
+    group_by: Optional[str]
+    buckets_per_point: int
+    series: List[TrendSeries]
+
+
+class DashboardFilters(BaseModel):
+    pipeline_id: Optional[str] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    method: Optional[DiagnosticMethod] = None
+
+    def month_bounds(self) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        """
+        Date range as inclusive (year * 12 + month) bounds when it covers
+        whole months, so the monthly rollups can answer it; None otherwise.
+        """
+        if self.date_from and self.date_from.day != 1:
+            return None
+        if self.date_to and (self.date_to + timedelta(days=1)).day != 1:
+            return None
+        from_ym = self.date_from.year * 12 + self.date_from.month if self.date_from else None
+        to_ym = self.date_to.year * 12 + self.date_to.month if self.date_to else None
+        return from_ym, to_ym
+
+
+def _filter_rollups(stmt, filters: DashboardFilters, bounds: Tuple[Optional[int], Optional[int]]):
+    if filters.pipeline_id:
+        stmt = stmt.where(InspectionRollup.pipeline_id == filters.pipeline_id)
+    if filters.method:
+        stmt = stmt.where(InspectionRollup.method == filters.method.value)
+    from_ym, to_ym = bounds
+    year_month = InspectionRollup.year * 12 + InspectionRollup.month
+    if from_ym is not None:
+        stmt = stmt.where(year_month >= from_ym)
+    if to_ym is not None:
+        stmt = stmt.where(year_month <= to_ym)
+    return stmt
+
+
+def _filter_inspections(stmt, filters: DashboardFilters):
+    if filters.pipeline_id:
+        stmt = stmt.where(
+            Inspection.object_id.in_(select(Object.object_id).where(Object.pipeline_id == filters.pipeline_id))
+        )
+    if filters.method:
+        stmt = stmt.where(Inspection.method == filters.method)
+    if filters.date_from:
+        stmt = stmt.where(Inspection.date >= datetime.combine(filters.date_from, datetime.min.time()))
+    if filters.date_to:
+        # date_to is inclusive: everything before the start of the next day
+        stmt = stmt.where(
+            Inspection.date < datetime.combine(filters.date_to + timedelta(days=1), datetime.min.time())
+        )
+    return stmt
+
+
+def _defects_by_method(db: Session, filters: DashboardFilters) -> List[DefectByMethod]:
+    bounds = filters.month_bounds()
+    if bounds is not None:
+        defect_count = func.sum(InspectionRollup.defect_count)
+        stmt = select(InspectionRollup.method, defect_count)
+        rows = db.exec(
+            _filter_rollups(stmt, filters, bounds)
+            .group_by(InspectionRollup.method)
+            .having(defect_count > 0)
+            .order_by(defect_count.desc(), InspectionRollup.method)
         ).all()
-        
-        for insp in inspections:
-            method = insp.method.value if insp.method else "unknown"
-            # Считаем количество дефектов для каждой инспекции этого метода
-            defect_count = sum(1 for d in all_defects if d.inspection_id == insp.inspection_id)
-            method_counts[method] = method_counts.get(method, 0) + defect_count
-    
-    defects_by_method = [
-        DefectByMethod(method=method, count=count)
-        for method, count in sorted(method_counts.items(), key=lambda x: x[1], reverse=True)
-    ]
-    
-    # 2. Распределение по критичности
-    # Используем ml_label из Inspection
-    criticality_counts = {}
-    inspections = db.exec(select(Inspection)).all()
-    
-    for insp in inspections:
-        criticality = insp.ml_label.value if insp.ml_label else "unknown"
-        criticality_counts[criticality] = criticality_counts.get(criticality, 0) + 1
-    
-    defects_by_criticality = [
-        DefectByCriticality(criticality=criticality, count=count)
-        for criticality, count in sorted(criticality_counts.items())
-    ]
+        return [DefectByMethod(method=method, count=int(count)) for method, count in rows]
 
+    defect_count = func.count(Defect.defect_id)
+    stmt = select(Inspection.method, defect_count).join(Defect, Defect.inspection_id == Inspection.inspection_id)
     rows = db.exec(
-        select(
-            Defect,
-            Inspection,
-            Object
-        )
-        .join(Inspection, Inspection.inspection_id == Defect.inspection_id)
-        .join(Object, Object.object_id == Inspection.object_id)
+        _filter_inspections(stmt, filters)
+        .group_by(Inspection.method)
+        .order_by(defect_count.desc(), Inspection.method)
     ).all()
+    return [DefectByMethod(method=method.value, count=count) for method, count in rows]
 
-    risk_map = {}
-
-    for defect, inspection, obj in rows:
-        if obj.object_id not in risk_map:
-            risk_map[obj.object_id] = {
-                "object_id": obj.object_id,
-                "object_name": obj.object_name,
-                "pipeline_id": obj.pipeline_id,
-                "criticality": inspection.ml_label.value if inspection.ml_label else None,
-                "defect_count": 0,
-                "max_depth": None,
-            }
-
-        entry = risk_map[obj.object_id]
-        entry["defect_count"] += 1
-
-        if defect.depth is not None:
-            entry["max_depth"] = (
-                defect.depth if entry["max_depth"] is None 
-                else max(entry["max_depth"], defect.depth)
-            )
 
-    objects_with_risks = list(risk_map.values())
-    
-    # Сортируем по критичности (high > medium > normal) и количеству дефектов
-    def risk_score(risk):
-        crit_score = {"high": 3, "medium": 2, "normal": 1, None: 0}.get(risk["criticality"], 0)
-        return (crit_score, risk["defect_count"], risk["max_depth"] or 0)
-    
-    sorted_risks = sorted(objects_with_risks, key=risk_score, reverse=True)[:5]
-    
-    top_risks = [
-        TopRisk(
-            object_id=r["object_id"],
-            object_name=r["object_name"],
-            pipeline_id=r["pipeline_id"],
-            criticality=r["criticality"],
-            defect_count=r["defect_count"],
-            max_depth=r["max_depth"],
-        )
-        for r in sorted_risks
-    ]
-    
-    # 4. Количество обследований по годам
-    all_inspections = db.exec(select(Inspection)).all()
-    year_counts = {}
-    for insp in all_inspections:
-        year = insp.date.year
-        year_counts[year] = year_counts.get(year, 0) + 1
-    
-    inspections_by_year = [
-        InspectionsByYear(year=year, count=count)
-        for year, count in sorted(year_counts.items())
+def _defects_by_criticality(db: Session, filters: DashboardFilters) -> List[DefectByCriticality]:
+    bounds = filters.month_bounds()
+    if bounds is not None:
+        inspection_count = func.sum(InspectionRollup.inspection_count)
+        stmt = select(InspectionRollup.criticality, inspection_count)
+        rows = db.exec(
+            _filter_rollups(stmt, filters, bounds)
+            .group_by(InspectionRollup.criticality)
+            .having(inspection_count > 0)
+            .order_by(InspectionRollup.criticality)
+        ).all()
+        return [DefectByCriticality(criticality=criticality, count=int(count)) for criticality, count in rows]
+
+    stmt = select(Inspection.ml_label, func.count(Inspection.inspection_id))
+    rows = db.exec(_filter_inspections(stmt, filters).group_by(Inspection.ml_label)).all()
+    counts = {criticality_of(label): count for label, count in rows}
+    return [
+        DefectByCriticality(criticality=criticality, count=count)
+        for criticality, count in sorted(counts.items())
     ]
-    
+
+
+def _top_risks(db: Session, filters: DashboardFilters, limit: int = TOP_RISKS_LIMIT) -> List[TopRisk]:
+    entries, _ = rank_risks(
+        db,
+        size=limit,
+        pipeline_id=filters.pipeline_id,
+        method=filters.method,
+        date_from=datetime.combine(filters.date_from, datetime.min.time()) if filters.date_from else None,
+        date_to=datetime.combine(filters.date_to, datetime.max.time()) if filters.date_to else None,
+        with_total=False,
+    )
+    return [TopRisk(**entry.model_dump(exclude={"rank", "score"})) for entry in entries]
+
+
+def _inspections_by_year(db: Session, filters: DashboardFilters) -> List[InspectionsByYear]:
+    bounds = filters.month_bounds()
+    if bounds is not None:
+        inspection_count = func.sum(InspectionRollup.inspection_count)
+        stmt = select(InspectionRollup.year, inspection_count)
+        rows = db.exec(
+            _filter_rollups(stmt, filters, bounds)
+            .group_by(InspectionRollup.year)
+            .having(inspection_count > 0)
+            .order_by(InspectionRollup.year)
+        ).all()
+        return [InspectionsByYear(year=year, count=int(count)) for year, count in rows]
+
+    year = extract("year", Inspection.date).label("year")
+    stmt = select(year, func.count(Inspection.inspection_id))
+    rows = db.exec(_filter_inspections(stmt, filters).group_by(year).order_by(year)).all()
+    return [InspectionsByYear(year=int(y), count=count) for y, count in rows]
+
+
+WIDGETS: Dict[str, Callable[[Session, DashboardFilters], list]] = {
+    "defects_by_method": _defects_by_method,
+    "defects_by_criticality": _defects_by_criticality,
+    "top_risks": _top_risks,
+    "inspections_by_year": _inspections_by_year,
+}
+
+
+def _run_widget(widget: Callable[[Session, DashboardFilters], list], filters: DashboardFilters):
+    started = time.perf_counter()
+    with Session(engine) as session:
+        result = widget(session, filters)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def _compute_stats(filters: DashboardFilters, with_timings: bool = False) -> DashboardStats:
+    """Run all widgets in parallel: latency is the slowest widget, not the sum"""
+    started = time.perf_counter()
+    futures = {name: _widget_executor.submit(_run_widget, widget, filters) for name, widget in WIDGETS.items()}
+    results = {}
+    timings = {}
+    for name, future in futures.items():
+        results[name], timings[name] = future.result()
+    timings["total"] = (time.perf_counter() - started) * 1000
+
     return DashboardStats(
-        defects_by_method=defects_by_method,
-        defects_by_criticality=defects_by_criticality,
-        top_risks=top_risks,
-        inspections_by_year=inspections_by_year,
+        **results,
+        timings_ms={name: round(ms, 2) for name, ms in timings.items()} if with_timings else None,
     )
 
+
+@router.get("/stats", response_model=DashboardStats)
+def get_dashboard_stats(
+    pipeline_id: Optional[str] = Query(None, description="Filter by pipeline ID"),
+    date_from: Optional[date] = Query(None, description="Inspections from this date (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Inspections up to this date, inclusive (YYYY-MM-DD)"),
+    method: Optional[DiagnosticMethod] = Query(None, description="Filter by inspection method"),
+    debug: bool = Query(False, description="Add per-widget timings in ms (bypasses the cache)"),
+    db: Session = Depends(get_db),
+):
+    """
+    Get dashboard statistics. Whole-month ranges are served from the rollup
+    tables; other date ranges are aggregated from the inspections.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+
+    filters = DashboardFilters(pipeline_id=pipeline_id, date_from=date_from, date_to=date_to, method=method)
+    if debug:
+        return _compute_stats(filters, with_timings=True)
+
+    return response_cache.get_or_compute(
+        "dashboard.stats",
+        filters.model_dump(),
+        DASHBOARD_TAGS,
+        db,
+        lambda: _compute_stats(filters),
+    )
+
+
+@router.get("/risks", response_model=RiskPage)
+def get_risks(
+    page: int = Query(1, ge=1),
+    size: int = Query(50, ge=1, le=500),
+    pipeline_id: Optional[str] = Query(None, description="Filter by pipeline ID"),
+    w_criticality: float = Query(1.0, ge=0, description="Weight of the latest inspection's criticality (0-3)"),
+    w_defects: float = Query(0.0, ge=0, description="Weight of the defect count"),
+    w_depth: float = Query(0.0, ge=0, description="Weight of the deepest defect"),
+    db: Session = Depends(get_db),
+):
+    """
+    All objects with defects ranked by risk, highest first. With the default
+    weights the order is criticality, then defect count, then depth.
+    """
+    weights = RiskWeights(criticality=w_criticality, defect_count=w_defects, max_depth=w_depth)
+
+    def compute():
+        items, total = rank_risks(db, page=page, size=size, pipeline_id=pipeline_id, weights=weights)
+        return RiskPage(total=total, page=page, size=size, items=items)
+
+    return response_cache.get_or_compute(
+        "dashboard.risks",
+        {"page": page, "size": size, "pipeline_id": pipeline_id, **weights.model_dump()},
+        DASHBOARD_TAGS,
+        db,
+        compute,
+    )
+
+
+TREND_GROUPS = {
+    "method": Inspection.method,
+    "pipeline": Object.pipeline_id,
+    "criticality": Inspection.ml_label,
+}
+
+
+def _trend_group_label(group_by: Optional[str], value) -> Optional[str]:
+    if group_by == "criticality":
+        return criticality_of(value)
+    if group_by == "method":
+        return value.value
+    return value
+
+
+def _compute_trends(
+    db: Session,
+    filters: DashboardFilters,
+    bucket: str,
+    group_by: Optional[str],
+    max_points: int,
+) -> DashboardTrends:
+    # Defects are pre-aggregated per inspection so the join stays one row per inspection
+    defects = (
+        select(
+            Defect.inspection_id,
+            func.count(Defect.defect_id).label("defect_count"),
+            func.sum(Defect.depth).label("depth_sum"),
+            func.count(Defect.depth).label("depth_count"),
+            func.max(Defect.depth).label("max_depth"),
+        )
+        .group_by(Defect.inspection_id)
+        .subquery()
+    )
+    period = bucket_start_expr(Inspection.date, bucket, db.get_bind().dialect.name).label("period")
+    group = TREND_GROUPS[group_by].label("grp") if group_by else None
+    columns = [
+        period,
+        func.count(Inspection.inspection_id),
+        func.coalesce(func.sum(defects.c.defect_count), 0),
+        func.sum(case((Inspection.ml_label == MLLabel.HIGH, 1), else_=0)),
+        func.sum(defects.c.depth_sum),
+        func.coalesce(func.sum(defects.c.depth_count), 0),
+        func.max(defects.c.max_depth),
+    ]
+    stmt = select(*columns, *([group] if group is not None else [])).outerjoin(
+        defects, defects.c.inspection_id == Inspection.inspection_id
+    )
+    if group_by == "pipeline":
+        stmt = stmt.join(Object, Object.object_id == Inspection.object_id)
+    group_columns = [period] + ([group] if group is not None else [])
+    rows = db.exec(_filter_inspections(stmt, filters).group_by(*group_columns)).all()
+
+    if not rows:
+        return DashboardTrends(bucket=bucket, group_by=group_by, buckets_per_point=1, series=[])
+
+    indexed = [(bucket_index(to_date(row[0]), bucket), row) for row in rows]
+    first = min(i for i, _ in indexed)
+    last = max(i for i, _ in indexed)
+    # Merge runs of adjacent buckets so that no series has more than max_points
+    per_point = max(1, math.ceil((last - first + 1) / max_points))
+    n_points = (last - first) // per_point + 1
+
+    # group -> point -> [inspections, defects, high, depth_sum, depth_count, max_depth]
+    acc = defaultdict(lambda: defaultdict(lambda: [0, 0, 0, 0.0, 0, None]))
+    for index, row in indexed:
+        _, inspections, defect_count, high, depth_sum, depth_count, max_depth = row[:7]
+        label = _trend_group_label(group_by, row[7]) if group_by else None
+        cell = acc[label][(index - first) // per_point]
+        cell[0] += inspections
+        cell[1] += int(defect_count)
+        cell[2] += int(high or 0)
+        cell[3] += float(depth_sum or 0)
+        cell[4] += int(depth_count)
+        if max_depth is not None and (cell[5] is None or max_depth > cell[5]):
+            cell[5] = max_depth
+
+    series = []
+    for label in sorted(acc, key=lambda g: (g is None, g or "")):
+        cells = acc[label]
+        points = []
+        for point in range(n_points):
+            start_index = first + point * per_point
+            inspections, defect_count, high, depth_sum, depth_count, max_depth = cells.get(
+                point, (0, 0, 0, 0.0, 0, None)
+            )
+            points.append(
+                TrendPoint(
+                    period_start=bucket_start(start_index, bucket),
+                    period_end=bucket_start(min(start_index + per_point, last + 1), bucket),
+                    inspections=inspections,
+                    defects=defect_count,
+                    high_criticality=high,
+                    avg_depth=round(depth_sum / depth_count, 3) if depth_count else None,
+                    max_depth=max_depth,
+                )
+            )
+        series.append(TrendSeries(group=label, points=points))
+
+    return DashboardTrends(bucket=bucket, group_by=group_by, buckets_per_point=per_point, series=series)
+
+
+@router.get("/trends", response_model=DashboardTrends)
+def get_dashboard_trends(
+    bucket: str = Query("month", regex="^(day|week|month|year)$"),
+    group_by: Optional[str] = Query(None, regex="^(method|pipeline|criticality)$"),
+    max_points: int = Query(120, ge=2, le=2000, description="Adjacent buckets are merged beyond this"),
+    pipeline_id: Optional[str] = Query(None, description="Filter by pipeline ID"),
+    date_from: Optional[date] = Query(None, description="Inspections from this date (YYYY-MM-DD)"),
+    date_to: Optional[date] = Query(None, description="Inspections up to this date, inclusive (YYYY-MM-DD)"),
+    method: Optional[DiagnosticMethod] = Query(None, description="Filter by inspection method"),
+    db: Session = Depends(get_db),
+):
+    """
+    Inspection and defect counts with severity statistics per time bucket,
+    optionally one series per method, pipeline or criticality. Buckets are
+    grouped in SQL. Long ranges are merged into at most `max_points` points
+    per series, and merged points keep exact counts.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+
+    filters = DashboardFilters(pipeline_id=pipeline_id, date_from=date_from, date_to=date_to, method=method)
+    return response_cache.get_or_compute(
+        "dashboard.trends",
+        {**filters.model_dump(), "bucket": bucket, "group_by": group_by, "max_points": max_points},
+        DASHBOARD_TAGS,
+        db,
+        lambda: _compute_trends(db, filters, bucket, group_by, max_points),
+    )
@@ -0,0 +1,50 @@
+from typing import Optional
+
+from fastapi import APIRouter, Header, Query, Request
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
+from app.core.events import event_bus, format_sse
+
+router = APIRouter()
+
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    types: Optional[str] = Query(
+        None, description="Comma-separated event types or prefixes, e.g. import,data.changed"
+    ),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """
+    Server-Sent Events stream of import, ML and data-change events.
+
+    Browsers reconnect with Last-Event-ID and get the buffered events they
+    missed. A comment line is sent every EVENTS_HEARTBEAT_SECONDS to keep
+    proxies from closing an idle connection.
+    """
+    type_filter = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    resume_from = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    subscription = event_bus.subscribe(types=type_filter, last_event_id=resume_from)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=settings.EVENTS_HEARTBEAT_SECONDS)
+                yield format_sse(event) if event else ": keep-alive\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/stats", response_model=dict)
+def get_event_stats():
+    """Connected SSE clients and the replay buffer (per process)"""
+    return event_bus.stats()
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime, date
 
 from fastapi import APIRouter, Depends, Query
@@ -7,10 +7,19 @@ from sqlmodel import Session, select, and_, or_
 from sqlalchemy import func
 
 from app.api.deps import get_db
+from app.core.cache import cached
+from app.core.database import stream_rows
 from app.models.object import Object
 from app.models.inspection import Inspection
 from app.models.defect import Defect
 from app.models.diagnostic import DiagnosticMethod, MLLabel, QualityGrade
+from app.services.data_version import INSPECTIONS_TAG, LABELS_TAG, OBJECTS_TAG
+from app.services.object_queries import (
+    iter_object_summaries,
+    latest_inspections_subquery,
+    object_summary_stmt,
+)
+from app.services.tabular_export import tabular_response
 
 router = APIRouter()
 
@@ -59,7 +68,36 @@ def get_criticality_color(ml_label: Optional[MLLabel], quality_grade: Optional[Q
     return "normal"
 
 
+def parse_inspection_filters(
+    method: Optional[str], date_from: Optional[str], date_to: Optional[str]
+) -> Tuple[Optional[DiagnosticMethod], Optional[datetime], Optional[datetime]]:
+    """Parse map filters; unknown methods and malformed dates are ignored"""
+    method_enum = None
+    if method:
+        try:
+            method_enum = DiagnosticMethod(method.upper())
+        except ValueError:
+            pass
+
+    date_from_obj = None
+    if date_from:
+        try:
+            date_from_obj = datetime.fromisoformat(date_from)
+        except ValueError:
+            pass
+
+    date_to_obj = None
+    if date_to:
+        try:
+            date_to_obj = datetime.fromisoformat(date_to)
+        except ValueError:
+            pass
+
+    return method_enum, date_from_obj, date_to_obj
+
+
 @router.get("/map-objects", response_model=List[MapObjectResponse])
+@cached("map.objects", tags=[OBJECTS_TAG, INSPECTIONS_TAG, LABELS_TAG])
 def get_map_objects(
     pipeline_id: Optional[str] = Query(None, description="Filter by pipeline ID (MT-01, MT-02, MT-03)"),
     method: Optional[str] = Query(None, description="Filter by inspection method"),
@@ -82,28 +120,15 @@ def get_map_objects(
 
     # Get inspections with filters
     inspection_stmt = select(Inspection).where(Inspection.object_id.in_(object_ids))
-    
-    if method:
-        try:
-            method_enum = DiagnosticMethod(method.upper())
-            inspection_stmt = inspection_stmt.where(Inspection.method == method_enum)
-        except ValueError:
-            pass
-    
-    if date_from:
-        try:
-            date_from_obj = datetime.fromisoformat(date_from)
-            inspection_stmt = inspection_stmt.where(Inspection.date >= date_from_obj)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            date_to_obj = datetime.fromisoformat(date_to)
-            inspection_stmt = inspection_stmt.where(Inspection.date <= date_to_obj)
-        except ValueError:
-            pass
-    
+    method_enum, date_from_obj, date_to_obj = parse_inspection_filters(method, date_from, date_to)
+
+    if method_enum:
+        inspection_stmt = inspection_stmt.where(Inspection.method == method_enum)
+    if date_from_obj:
+        inspection_stmt = inspection_stmt.where(Inspection.date >= date_from_obj)
+    if date_to_obj:
+        inspection_stmt = inspection_stmt.where(Inspection.date <= date_to_obj)
+
     inspection_stmt = inspection_stmt.order_by(Inspection.object_id, Inspection.date.desc())
     inspections = db.exec(inspection_stmt).all()
 
@@ -188,3 +213,92 @@ def get_map_objects(
         )
 
     return results
+
+
+EXPORT_COLUMNS = [
+    "id",
+    "lat",
+    "lon",
+    "pipeline_id",
+    "status",
+    "criticality",
+    "object_name",
+    "object_type",
+    "year",
+    "material",
+    "last_check_date",
+    "method",
+    "quality_grade",
+    "ml_label",
+    "max_depth",
+    "defect_count",
+]
+
+
+def _export_rows(
+    pipeline_id: Optional[str],
+    method: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    param_min: Optional[float],
+    param_max: Optional[float],
+):
+    method_enum, date_from_obj, date_to_obj = parse_inspection_filters(method, date_from, date_to)
+    stmt = object_summary_stmt(
+        pipeline_id=pipeline_id,
+        latest=latest_inspections_subquery(method_enum, date_from_obj, date_to_obj),
+        depth_min=param_min,
+        depth_max=param_max,
+    )
+
+    for summary in iter_object_summaries(stream_rows(stmt)):
+        defects = summary["defects"]
+        if summary["inspection_id"] is None:
+            status = "unknown"
+            criticality = "normal"
+        else:
+            status = "defect" if defects else "clean"
+            criticality = get_criticality_color(
+                MLLabel(summary["ml_label"]) if summary["ml_label"] else None,
+                QualityGrade(summary["quality_grade"]) if summary["quality_grade"] else None,
+                bool(defects),
+            )
+
+        yield [
+            summary["object_id"],
+            summary["lat"],
+            summary["lon"],
+            summary["pipeline_id"],
+            status,
+            criticality,
+            summary["object_name"],
+            summary["object_type"].value,
+            summary["year"],
+            summary["material"],
+            summary["date"].date().isoformat() if summary["date"] else None,
+            summary["method"],
+            summary["quality_grade"],
+            summary["ml_label"],
+            max((d["depth"] or 0.0) for d in defects) if defects else None,
+            len(defects),
+        ]
+
+
+@router.get("/map-objects/export")
+def export_map_objects(
+    pipeline_id: Optional[str] = Query(None, description="Filter by pipeline ID (MT-01, MT-02, MT-03)"),
+    method: Optional[str] = Query(None, description="Filter by inspection method"),
+    date_from: Optional[str] = Query(None, description="Filter by date from (YYYY-MM-DD)"),
+    date_to: Optional[str] = Query(None, description="Filter by date to (YYYY-MM-DD)"),
+    param_min: Optional[float] = Query(None, description="Minimum parameter value (depth)"),
+    param_max: Optional[float] = Query(None, description="Maximum parameter value (depth)"),
+    file_format: str = Query("csv", alias="format", regex="^(csv|xlsx)$"),
+):
+    """Export map objects with the `/map-objects` filters, streamed from a server-side cursor"""
+    return tabular_response(
+        file_format,
+        "map_objects",
+        EXPORT_COLUMNS,
+        _export_rows(pipeline_id, method, date_from, date_to, param_min, param_max),
+        sheet_title="Map objects",
+    )
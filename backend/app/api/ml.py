@@ -1,14 +1,27 @@
 from typing import List
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from sqlmodel import Session, select, desc
 
 from app.api.deps import get_db
+from app.core.cache import cached
 from app.models.ml_metrics import MLMetrics, MLMetricsRead
+from app.services.data_version import ML_METRICS_TAG
+from app.services.ml_service import ml_service
+from app.services.model_registry import ModelVersion, model_registry
+from app.services.online_prediction import (
+    PredictionStats,
+    PredictRequest,
+    PredictResponse,
+    prediction_batcher,
+    records_from_inputs,
+)
+from app.services.training_scheduler import TrainingState, training_scheduler
 
 router = APIRouter()
 
 
 @router.get("/metrics", response_model=List[dict])
+@cached("ml.metrics", tags=[ML_METRICS_TAG])
 def get_ml_metrics(
     limit: int = 10,
     db: Session = Depends(get_db),
@@ -19,6 +32,7 @@ def get_ml_metrics(
         .order_by(desc(MLMetrics.created_at))
         .limit(limit)
     ).all()
+    model_versions = model_registry.metric_versions()
     
     return [
         {
@@ -32,12 +46,14 @@ def get_ml_metrics(
             "label_distribution": m.label_distribution,
             "predicted_count": m.predicted_count,
             "created_at": m.created_at.isoformat(),
+            "model_version": model_versions.get(m.metric_id),
         }
         for m in metrics
     ]
 
 
 @router.get("/metrics/latest", response_model=dict)
+@cached("ml.metrics_latest", tags=[ML_METRICS_TAG])
 def get_latest_ml_metrics(db: Session = Depends(get_db)):
     """Get the latest ML training metrics"""
     latest = db.exec(
@@ -66,5 +82,60 @@ def get_latest_ml_metrics(db: Session = Depends(get_db)):
         "label_distribution": latest.label_distribution,
         "predicted_count": latest.predicted_count,
         "created_at": latest.created_at.isoformat(),
+        "model_version": model_registry.metric_versions().get(latest.metric_id),
     }
 
+
+@router.get("/training", response_model=TrainingState)
+def get_training_state():
+    """
+    Background training queue: imports and rows waiting to be trained on,
+    when the next training is due, and how the last one ended (per process)
+    """
+    return training_scheduler.state()
+
+
+@router.get("/models", response_model=List[ModelVersion])
+def list_model_versions():
+    """Saved model versions, newest first; `active` marks the one being served"""
+    return model_registry.list()
+
+
+@router.post("/models/{version}/activate", response_model=ModelVersion)
+def activate_model_version(version: int):
+    """
+    Serve a saved model version (e.g. roll back after a bad training).
+    Other API processes switch to it on their next training or prediction.
+    Inspections it labelled are re-scored in the background.
+    """
+    entry = ml_service.activate_version(version)
+    training_scheduler.request_scoring()
+    return entry
+
+
+@router.post("/score", response_model=TrainingState, status_code=202)
+def score_unlabeled_inspections():
+    """
+    Queue a background scoring run: every inspection without an imported
+    label that the active model version has not scored yet
+    """
+    training_scheduler.request_scoring()
+    return training_scheduler.state()
+
+
+@router.post("/predict", response_model=PredictResponse)
+async def predict(request: PredictRequest, response: Response):
+    """
+    Predict the ML label of feature records (e.g. a measurement just taken
+    in the field) with the active model, without importing them.
+    Concurrent requests are batched; 503 until a model is trained.
+    """
+    result, elapsed = await prediction_batcher.predict(records_from_inputs(request.records))
+    response.headers["X-Prediction-Ms"] = f"{elapsed * 1000:.2f}"
+    return result
+
+
+@router.get("/predict/stats", response_model=PredictionStats)
+def get_prediction_stats():
+    """Online prediction counts, batch sizes and p50/p99 latency (per process)"""
+    return prediction_batcher.stats()
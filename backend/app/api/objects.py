@@ -1,16 +1,32 @@
+import base64
+from collections import Counter
 from typing import List, Optional
-from datetime import date
+from datetime import date, datetime
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from sqlmodel import Session, select
-from sqlalchemy import func
+from sqlalchemy import and_, func, or_
 from app.api.deps import get_db
+from app.core.cache import cached
+from app.core.database import stream_rows
 from app.models.object import Object, ObjectCreate, ObjectUpdate, ObjectRead, ObjectType
 from app.models.inspection import Inspection
 from app.models.defect import Defect
+from app.models.diagnostic import DiagnosticMethod
+from app.services.data_version import INSPECTIONS_TAG, LABELS_TAG, OBJECTS_TAG
+from app.services.downsampling import lttb
+from app.services.tabular_export import tabular_response
+from app.services.object_queries import (
+    iter_object_summaries,
+    match_defect_type,
+    object_status,
+    object_summary_stmt,
+)
 
 router = APIRouter()
 
+TIMESERIES_METRICS = ("depth", "length", "width")
+
 
 class ObjectTableRow(BaseModel):
     id: int
@@ -24,7 +40,21 @@ class ObjectTableRow(BaseModel):
     max_depth: float
 
 
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+
+class ObjectFacets(BaseModel):
+    total: int
+    pipelines: List[FacetCount]
+    methods: List[FacetCount]
+    statuses: List[FacetCount]
+    defect_types: List[FacetCount]
+
+
 @router.get("/search", response_model=List[ObjectTableRow])
+@cached("objects.search", tags=[OBJECTS_TAG, INSPECTIONS_TAG])
 def search_objects(
     search: Optional[str] = Query(None, description="Partial match on object name"),
     pipeline_id: Optional[str] = Query(None, description="Filter by pipeline ID"),
@@ -125,3 +155,310 @@ def search_objects(
     return rows[start:end]
 
 
+def _facet_list(counter: Counter) -> List[FacetCount]:
+    return [
+        FacetCount(value=value, count=count)
+        for value, count in sorted(counter.items(), key=lambda x: (-x[1], x[0]))
+    ]
+
+
+@router.get("/facets", response_model=ObjectFacets)
+@cached("objects.facets", tags=[OBJECTS_TAG, INSPECTIONS_TAG])
+def object_facets(
+    search: Optional[str] = Query(None, description="Partial match on object name"),
+    pipeline_id: Optional[str] = Query(None, description="Filter by pipeline ID"),
+    method: Optional[str] = Query(None, description="Filter by latest inspection method"),
+    defect_type: Optional[str] = Query(None, description="Filter by defect type (latest inspection, ILIKE)"),
+    db: Session = Depends(get_db),
+):
+    """
+    Facet counts for the objects table, computed in one pass over the
+    latest-inspection summary. Filters mean the same as in `/search`; each
+    facet applies every filter except its own, so the counts show what
+    picking another value would return.
+    """
+    search = search.strip().lower() if search and search.strip() else None
+    pipelines: Counter = Counter()
+    methods: Counter = Counter()
+    statuses: Counter = Counter()
+    defect_types: Counter = Counter()
+    total = 0
+
+    rows = db.exec(object_summary_stmt(search=search).execution_options(yield_per=2000))
+    for summary in iter_object_summaries(rows):
+        matched_defects = match_defect_type(summary["defects"], defect_type)
+
+        pipeline_ok = not pipeline_id or summary["pipeline_id"] == pipeline_id
+        method_ok = not method or summary["method"] is None or summary["method"] == method
+        defect_ok = not defect_type or bool(matched_defects)
+
+        if method_ok and defect_ok and summary["pipeline_id"]:
+            pipelines[summary["pipeline_id"]] += 1
+        if pipeline_ok and defect_ok and summary["method"]:
+            methods[summary["method"]] += 1
+        if pipeline_ok and method_ok:
+            for type_val in {d["defect_type"] for d in summary["defects"] if d["defect_type"]}:
+                defect_types[type_val] += 1
+        if pipeline_ok and method_ok and defect_ok:
+            statuses[object_status(summary, matched_defects)] += 1
+            total += 1
+
+    return ObjectFacets(
+        total=total,
+        pipelines=_facet_list(pipelines),
+        methods=_facet_list(methods),
+        statuses=_facet_list(statuses),
+        defect_types=_facet_list(defect_types),
+    )
+
+
+EXPORT_COLUMNS = [
+    "id",
+    "object_name",
+    "pipeline_id",
+    "object_type",
+    "last_check_date",
+    "method",
+    "status",
+    "defect_type",
+    "max_depth",
+]
+
+
+def _export_rows(
+    search: Optional[str],
+    pipeline_id: Optional[str],
+    method: Optional[str],
+    defect_type: Optional[str],
+):
+    rows = stream_rows(object_summary_stmt(search=search, pipeline_id=pipeline_id))
+    for summary in iter_object_summaries(rows):
+        if method and summary["method"] is not None and summary["method"] != method:
+            continue
+        matched_defects = match_defect_type(summary["defects"], defect_type)
+        if defect_type and not matched_defects:
+            continue
+
+        deepest = max(matched_defects, key=lambda d: d["depth"] or 0) if matched_defects else None
+        yield [
+            summary["object_id"],
+            summary["object_name"],
+            summary["pipeline_id"],
+            summary["object_type"].value,
+            summary["date"].date().isoformat() if summary["date"] else None,
+            summary["method"],
+            object_status(summary, matched_defects),
+            deepest["defect_type"] if deepest else None,
+            max((d["depth"] or 0.0) for d in matched_defects) if matched_defects else 0.0,
+        ]
+
+
+@router.get("/export")
+def export_objects(
+    search: Optional[str] = Query(None, description="Partial match on object name"),
+    pipeline_id: Optional[str] = Query(None, description="Filter by pipeline ID"),
+    method: Optional[str] = Query(None, description="Filter by latest inspection method"),
+    defect_type: Optional[str] = Query(None, description="Filter by defect type (latest inspection, ILIKE)"),
+    file_format: str = Query("csv", alias="format", regex="^(csv|xlsx)$"),
+):
+    """
+    Export the objects table with the `/search` filters, unpaged, ordered by
+    object ID. Rows are streamed from a server-side cursor.
+    """
+    return tabular_response(
+        file_format,
+        "objects",
+        EXPORT_COLUMNS,
+        _export_rows(search, pipeline_id, method, defect_type),
+        sheet_title="Objects",
+    )
+
+
+class DefectItem(BaseModel):
+    defect_id: int
+    defect_type: Optional[str]
+    depth: Optional[float]
+    length: Optional[float]
+    width: Optional[float]
+
+
+class InspectionHistoryItem(BaseModel):
+    inspection_id: int
+    date: datetime
+    method: str
+    temperature: Optional[float]
+    humidity: Optional[float]
+    illumination: Optional[float]
+    quality_grade: Optional[str]
+    ml_label: Optional[str]
+    defects: List[DefectItem]
+
+
+class ObjectDetail(BaseModel):
+    object: ObjectRead
+    inspections: List[InspectionHistoryItem]
+    next_cursor: Optional[str]
+
+
+class TimeSeriesPoint(BaseModel):
+    date: datetime
+    value: float
+
+
+class TimeSeries(BaseModel):
+    method: str
+    metric: str
+    total_points: int
+    points: List[TimeSeriesPoint]
+
+
+class ObjectTimeSeries(BaseModel):
+    object_id: int
+    series: List[TimeSeries]
+
+
+def _encode_cursor(insp: Inspection) -> str:
+    raw = f"{insp.date.isoformat()}|{insp.inspection_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date_part, id_part = raw.rsplit("|", 1)
+        return datetime.fromisoformat(date_part), int(id_part)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _get_object_or_404(object_id: int, db: Session) -> Object:
+    obj = db.get(Object, object_id)
+    if not obj:
+        raise HTTPException(status_code=404, detail=f"Object {object_id} not found")
+    return obj
+
+
+@router.get("/{object_id}", response_model=ObjectDetail)
+@cached("objects.detail", tags=[OBJECTS_TAG, INSPECTIONS_TAG, LABELS_TAG])
+def get_object_detail(
+    object_id: int,
+    cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """Object metadata with its inspections (newest first) and their defects, cursor-paged"""
+    obj = _get_object_or_404(object_id, db)
+
+    stmt = select(Inspection).where(Inspection.object_id == object_id)
+    if cursor:
+        cursor_date, cursor_id = _decode_cursor(cursor)
+        stmt = stmt.where(
+            or_(
+                Inspection.date < cursor_date,
+                and_(Inspection.date == cursor_date, Inspection.inspection_id < cursor_id),
+            )
+        )
+    inspections = db.exec(
+        stmt.order_by(Inspection.date.desc(), Inspection.inspection_id.desc()).limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(inspections) > limit:
+        inspections = inspections[:limit]
+        next_cursor = _encode_cursor(inspections[-1])
+
+    defects_by_insp = {}
+    inspection_ids = [insp.inspection_id for insp in inspections]
+    if inspection_ids:
+        defects = db.exec(
+            select(Defect).where(Defect.inspection_id.in_(inspection_ids)).order_by(Defect.defect_id)
+        ).all()
+        for defect in defects:
+            defects_by_insp.setdefault(defect.inspection_id, []).append(defect)
+
+    return ObjectDetail(
+        object=ObjectRead.model_validate(obj),
+        inspections=[
+            InspectionHistoryItem(
+                inspection_id=insp.inspection_id,
+                date=insp.date,
+                method=insp.method.value,
+                temperature=insp.temperature,
+                humidity=insp.humidity,
+                illumination=insp.illumination,
+                quality_grade=insp.quality_grade.value if insp.quality_grade else None,
+                ml_label=insp.ml_label.value if insp.ml_label else None,
+                defects=[
+                    DefectItem(
+                        defect_id=d.defect_id,
+                        defect_type=d.defect_type,
+                        depth=d.depth,
+                        length=d.length,
+                        width=d.width,
+                    )
+                    for d in defects_by_insp.get(insp.inspection_id, [])
+                ],
+            )
+            for insp in inspections
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+@router.get("/{object_id}/timeseries", response_model=ObjectTimeSeries)
+@cached("objects.timeseries", tags=[INSPECTIONS_TAG])
+def get_object_timeseries(
+    object_id: int,
+    points: int = Query(500, ge=10, le=5000, description="Maximum points per series"),
+    method: Optional[str] = Query(None, description="Only this inspection method"),
+    db: Session = Depends(get_db),
+):
+    """
+    Per-method depth/length/width series of the object (largest defect per
+    inspection), each downsampled with LTTB to at most `points` points.
+    """
+    _get_object_or_404(object_id, db)
+
+    stmt = (
+        select(
+            Inspection.method,
+            Inspection.date,
+            func.max(Defect.depth).label("depth"),
+            func.max(Defect.length).label("length"),
+            func.max(Defect.width).label("width"),
+        )
+        .join(Defect, Defect.inspection_id == Inspection.inspection_id)
+        .where(Inspection.object_id == object_id)
+    )
+    if method:
+        try:
+            stmt = stmt.where(Inspection.method == DiagnosticMethod(method.upper()))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Unknown method '{method}'")
+    rows = db.exec(
+        stmt.group_by(Inspection.inspection_id, Inspection.method, Inspection.date)
+        .order_by(Inspection.method, Inspection.date)
+    ).all()
+
+    raw_series = {}
+    for row in rows:
+        method_val = row.method.value
+        x = row.date.timestamp()
+        for metric in TIMESERIES_METRICS:
+            value = getattr(row, metric)
+            if value is not None:
+                raw_series.setdefault((method_val, metric), []).append((x, float(value)))
+
+    series = [
+        TimeSeries(
+            method=method_val,
+            metric=metric,
+            total_points=len(values),
+            points=[
+                TimeSeriesPoint(date=datetime.fromtimestamp(x), value=y)
+                for x, y in lttb(values, points)
+            ],
+        )
+        for (method_val, metric), values in raw_series.items()
+    ]
+    return ObjectTimeSeries(object_id=object_id, series=series)
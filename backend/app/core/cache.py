@@ -0,0 +1,260 @@
+"""
+Response cache for read endpoints.
+
+Entries live in a pluggable backend: an in-process LRU with TTL by default,
+or Redis when CACHE_BACKEND=redis so workers share them. Keys are built from
+the endpoint namespace, the normalized query parameters and the current
+versions of the endpoint's tags. Tags are `data_versions` scopes that
+importers and ML labelling bump inside their transactions. Invalidation is
+therefore a version bump rather than a delete, and it is visible to every
+worker as soon as the data commits.
+"""
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from enum import Enum
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.services.data_version import get_data_versions
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Small thread-safe LRU cache with a per-entry time-to-live."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class CacheBackend:
+    """Storage for cached responses. Values are JSON-compatible."""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU bounded by entry count and TTL"""
+
+    name = "memory"
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._cache.set(key, value, ttl)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self._cache)
+
+
+class RedisBackend(CacheBackend):
+    """Redis-backed cache shared by all workers (needs the `redis` package)"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "promtech:cache:"):
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package") from exc
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._client.get(self._prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._client.setex(self._prefix + key, int(ttl), json.dumps(value))
+
+    def clear(self) -> None:
+        for key in self._client.scan_iter(f"{self._prefix}*"):
+            self._client.delete(key)
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple, set)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def normalize_params(params: Dict[str, Any]) -> str:
+    """Stable representation of query parameters: None and empty strings dropped, keys sorted"""
+    cleaned = {}
+    for name, value in params.items():
+        value = _normalize(value)
+        if value is None or value == "":
+            continue
+        cleaned[name] = value
+    return json.dumps(cleaned, sort_keys=True, default=str)
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, default_ttl: float = 300.0):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+
+    def use_backend(self, backend: CacheBackend) -> None:
+        """Swap the storage backend, e.g. a MemoryBackend stand-in for Redis in tests"""
+        self.backend = backend
+        self.reset_stats()
+
+    def _count(self, namespace: str, field: str) -> None:
+        with self._stats_lock:
+            entry = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "errors": 0})
+            entry[field] += 1
+
+    def make_key(self, namespace: str, params: Dict[str, Any], tag_versions: Dict[str, int]) -> str:
+        versions = ",".join(f"{tag}={tag_versions[tag]}" for tag in sorted(tag_versions))
+        digest = hashlib.sha1(f"{versions}|{normalize_params(params)}".encode()).hexdigest()
+        return f"{namespace}:{digest}"
+
+    def get_or_compute(
+        self,
+        namespace: str,
+        params: Dict[str, Any],
+        tags: Iterable[str],
+        db: Session,
+        compute: Callable[[], Any],
+        ttl: Optional[float] = None,
+    ) -> Any:
+        """Cached JSON-compatible result of `compute()`; backend failures fall back to computing"""
+        tags = list(tags)
+        key = self.make_key(namespace, params, get_data_versions(db, tags) if tags else {})
+
+        try:
+            cached = self.backend.get(key)
+        except Exception as exc:
+            logger.warning(f"Cache backend read failed: {exc}")
+            self._count(namespace, "errors")
+            cached = None
+        if cached is not None:
+            self._count(namespace, "hits")
+            return cached
+
+        self._count(namespace, "misses")
+        value = jsonable_encoder(compute())
+        try:
+            self.backend.set(key, value, ttl or self.default_ttl)
+        except Exception as exc:
+            logger.warning(f"Cache backend write failed: {exc}")
+            self._count(namespace, "errors")
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            namespaces = {ns: dict(counts) for ns, counts in self._stats.items()}
+        hits = sum(c["hits"] for c in namespaces.values())
+        misses = sum(c["misses"] for c in namespaces.values())
+        return {
+            "backend": self.backend.name,
+            "entries": self.backend.size(),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            "namespaces": namespaces,
+        }
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self._stats.clear()
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+
+def cached(namespace: str, tags: Iterable[str] = (), ttl: Optional[float] = None):
+    """
+    Cache a sync FastAPI endpoint.
+
+    The endpoint must take a `db: Session` parameter; every other argument is
+    part of the key. FastAPI reads the original signature through
+    `functools.wraps`, so query parameters and dependencies are unchanged.
+    """
+    tags = list(tags)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            db = kwargs.get("db")
+            if not isinstance(db, Session):
+                return func(*args, **kwargs)
+            params = {k: v for k, v in kwargs.items() if not isinstance(v, Session)}
+            return response_cache.get_or_compute(
+                namespace, params, tags, db, lambda: func(*args, **kwargs), ttl
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def _backend_from_settings() -> CacheBackend:
+    if settings.CACHE_BACKEND == "redis" and settings.CACHE_REDIS_URL:
+        return RedisBackend(settings.CACHE_REDIS_URL)
+    return MemoryBackend(maxsize=settings.CACHE_MAX_ENTRIES, ttl=settings.CACHE_TTL_SECONDS)
+
+
+response_cache = ResponseCache(_backend_from_settings(), default_ttl=settings.CACHE_TTL_SECONDS)
@@ -6,6 +6,48 @@ class Settings(BaseSettings):
     DATABASE_URL: str = ""
     API_V1_PREFIX: str = "/api/v1"
     GEMINI_API_KEY: Optional[str] = None
+
+    # Response cache: "memory" (per process) or "redis" (shared, needs CACHE_REDIS_URL)
+    CACHE_BACKEND: str = "memory"
+    CACHE_REDIS_URL: Optional[str] = None
+    CACHE_MAX_ENTRIES: int = 1024
+    CACHE_TTL_SECONDS: int = 300
+
+    # Server-Sent Events: replay buffer for reconnecting clients and keep-alive interval
+    EVENTS_HISTORY_SIZE: int = 256
+    EVENTS_HEARTBEAT_SECONDS: int = 15
+
+    # PDF reports: registries longer than this are "capped" or reduced to a "summary" table
+    # ("full" always lists every defect)
+    REPORT_REGISTRY_MODE: str = "capped"
+    REPORT_MAX_REGISTRY_ROWS: int = 20000
+    # Generated PDFs are cached on disk (default: <tmp>/promtech-reports); 0 bytes disables the cache
+    REPORT_CACHE_DIR: Optional[str] = None
+    REPORT_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    # Uploaded map screenshots, downscaled and stored by content hash in <report cache dir>/maps
+    REPORT_MAP_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    # Reports render in a process pool: worker count (default: all cores), queue limit, job retention
+    REPORT_WORKERS: Optional[int] = None
+    REPORT_MAX_PENDING_JOBS: int = 32
+    REPORT_JOB_TTL_SECONDS: int = 3600
+
+    # Trained ML models are kept as numbered versions in ML_MODEL_DIR (next to the feature store); the active
+    # one loads at startup.
+    # ML_MODEL_VERSION pins a version instead; versions beyond the newest ML_MODEL_KEEP_VERSIONS are deleted
+    ML_MODEL_DIR: str = "ml_models"
+    ML_MODEL_VERSION: Optional[int] = None
+    ML_MODEL_KEEP_VERSIONS: int = 20
+    # Training runs in the background after imports: ML_TRAIN_DEBOUNCE_SECONDS after the last import (at most
+    # ML_TRAIN_MAX_DELAY_SECONDS after the first), or as soon as ML_TRAIN_MIN_NEW_SAMPLES labeled rows are pending
+    ML_TRAIN_DEBOUNCE_SECONDS: float = 10.0
+    ML_TRAIN_MAX_DELAY_SECONDS: float = 120.0
+    ML_TRAIN_MIN_NEW_SAMPLES: int = 5000
+    # Unlabeled inspections are scored after each training (and on activation) this many per transaction
+    ML_SCORING_CHUNK: int = 5000
+    # POST /ml/predict: concurrent requests arriving within ML_PREDICT_BATCH_WINDOW_MS are predicted together,
+    # up to ML_PREDICT_MAX_BATCH records per batch
+    ML_PREDICT_BATCH_WINDOW_MS: float = 2.0
+    ML_PREDICT_MAX_BATCH: int = 512
     
     class Config:
         env_file = ".env"
@@ -1,3 +1,4 @@
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlmodel import SQLModel, create_engine, Session
 from app.core.config import settings
 
@@ -26,3 +27,20 @@ def get_session():
     with Session(engine) as session:
         yield session
 
+
+def dialect_insert(db: Session):
+    """`insert` of the session's dialect, which has on_conflict_do_update (PostgreSQL and SQLite)"""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def stream_rows(stmt, chunk_size: int = 1000):
+    """
+    Yield rows of `stmt` from a server-side cursor on a dedicated session.
+
+    Meant for StreamingResponse bodies, which keep running after the request
+    session from `get_session` has been closed.
+    """
+    with Session(engine) as session:
+        yield from session.exec(stmt.execution_options(yield_per=chunk_size))
@@ -0,0 +1,129 @@
+"""
+In-process event bus behind the Server-Sent Events stream.
+
+Importers, ML training and labelling publish events here; every connected
+SSE client gets the ones it subscribed to. Event types:
+
+- `import.started`, `import.progress`, `import.finished`, `import.failed`
+- `data.changed`, published after a commit that bumped data versions. Its
+  `tags` name the cache tags that changed (objects, inspections, labels,
+  ml_metrics, imports), so clients refetch only the views that read them.
+- `ml.training.started`, `ml.training.finished` (background training after
+  imports), `ml.trained`, `ml.metrics_saved`, `ml.model_saved`,
+  `ml.model_activated`, `labels.changed` (after a scoring run: how many
+  inspections were predicted and changed, and by which model version)
+
+`publish` is thread-safe and never blocks: it can be called from request
+threads, the threadpool or background workers. Each subscriber has a bounded
+queue, and a client too slow to drain it loses its oldest events. Events are
+numbered, and the last EVENTS_HISTORY_SIZE are kept so a reconnecting client
+can resume from `Last-Event-ID`. The bus is per process: with several
+workers, each one only streams the events it published.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Queue of events for one SSE client, owned by the event loop serving it"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, types: Optional[Iterable[str]], maxsize: int):
+        self.loop = loop
+        self.types = set(types) if types else None
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def matches(self, event: dict) -> bool:
+        """`types` entries match exactly or as a prefix: "import" matches "import.progress" """
+        if self.types is None:
+            return True
+        event_type = event["type"]
+        return any(event_type == t or event_type.startswith(f"{t}.") for t in self.types)
+
+    def _put(self, event: dict) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def deliver(self, event: dict) -> None:
+        if not self.matches(event):
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Loop already closed; the subscription is about to be removed
+            pass
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event, or None when nothing arrived within `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    def __init__(self, history_size: int = 256, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._history: "deque[dict]" = deque(maxlen=history_size)
+        self._subscribers: set[Subscription] = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, event_type: str, data: Optional[Dict[str, Any]] = None) -> dict:
+        event = {"type": event_type, "data": jsonable_encoder(data or {}), "ts": time.time()}
+        with self._lock:
+            event["id"] = next(self._ids)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    def subscribe(self, types: Optional[Iterable[str]] = None, last_event_id: Optional[int] = None) -> Subscription:
+        """
+        Register a subscriber for the running event loop. With `last_event_id`,
+        buffered events after it are queued first.
+        """
+        subscription = Subscription(asyncio.get_running_loop(), types, self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event["id"] > last_event_id and subscription.matches(event):
+                        subscription._put(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+        if subscription.dropped:
+            logger.info(f"SSE subscriber dropped {subscription.dropped} events")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "buffered": len(self._history),
+                "last_event_id": self._history[-1]["id"] if self._history else 0,
+            }
+
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+event_bus = EventBus(history_size=settings.EVENTS_HISTORY_SIZE)
@@ -1,9 +1,12 @@
 from app.models.object import Object, ObjectCreate, ObjectUpdate, ObjectRead, ObjectType
 from app.models.pipeline import Pipeline
 from app.models.inspection import Inspection
+from app.models.inspection_prediction import InspectionPrediction
 from app.models.defect import Defect
 from app.models.file_import import FileImport, FileImportRead
 from app.models.ml_metrics import MLMetrics, MLMetricsRead
+from app.models.data_version import DataVersion
+from app.models.dashboard_rollup import InspectionRollup, ObjectRiskRollup
 from app.models.diagnostic import (
     Diagnostic,
     DiagnosticCreate,
@@ -23,11 +26,15 @@ __all__ = [
     "ObjectType",
     "Pipeline",
     "Inspection",
+    "InspectionPrediction",
     "Defect",
     "FileImport",
     "FileImportRead",
     "MLMetrics",
     "MLMetricsRead",
+    "DataVersion",
+    "InspectionRollup",
+    "ObjectRiskRollup",
     "Diagnostic",
     "DiagnosticCreate",
     "DiagnosticUpdate",
@@ -0,0 +1,28 @@
+from datetime import datetime
+from typing import Optional
+from sqlmodel import Field, SQLModel
+
+
+class InspectionRollup(SQLModel, table=True):
+    """Inspection and defect counts per month, pipeline, method and criticality"""
+    __tablename__ = "inspection_rollups"
+
+    year: int = Field(primary_key=True)
+    month: int = Field(primary_key=True)
+    pipeline_id: str = Field(primary_key=True, description="Pipeline ID, empty string for objects without one")
+    method: str = Field(primary_key=True, description="Inspection method")
+    criticality: str = Field(primary_key=True, description="ml_label value or 'unknown'")
+    inspection_count: int = Field(default=0)
+    defect_count: int = Field(default=0)
+
+
+class ObjectRiskRollup(SQLModel, table=True):
+    """Per-object risk entry, one row for every object with at least one defect"""
+    __tablename__ = "object_risk_rollups"
+
+    object_id: int = Field(primary_key=True, foreign_key="objects.object_id")
+    pipeline_id: Optional[str] = Field(default=None, index=True)
+    crit_score: int = Field(default=0, description="Criticality of the latest inspection (0-3)")
+    defect_count: int = Field(default=0)
+    max_depth: Optional[float] = Field(default=None)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
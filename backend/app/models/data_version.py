@@ -0,0 +1,10 @@
+from datetime import datetime
+from sqlmodel import Field, SQLModel
+
+
+class DataVersion(SQLModel, table=True):
+    __tablename__ = "data_versions"
+
+    scope: str = Field(primary_key=True, description="Version scope: 'global' or 'pipeline:<pipeline_id>'")
+    version: int = Field(default=0, description="Monotonic counter bumped on every data change in the scope")
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -11,7 +11,9 @@ class Defect(SQLModel, table=True):
     __tablename__ = "defects"
 
     defect_id: Optional[int] = Field(default=None, primary_key=True)
-    inspection_id: int = Field(foreign_key="inspections.inspection_id", description="Parent inspection")
+    inspection_id: int = Field(
+        foreign_key="inspections.inspection_id", index=True, description="Parent inspection"
+    )
     defect_type: Optional[str] = Field(default=None, description="Type of defect")
     depth: Optional[float] = Field(default=None, description="Defect depth")
     length: Optional[float] = Field(default=None, description="Defect length")
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import List, Optional, TYPE_CHECKING
-from sqlalchemy import Enum as SQLEnum
+from sqlalchemy import Enum as SQLEnum, Index
 from sqlmodel import Column, Field, Relationship, SQLModel
 from app.models.diagnostic import DiagnosticMethod, MLLabel, QualityGrade
 
@@ -11,6 +11,7 @@ if TYPE_CHECKING:
 
 class Inspection(SQLModel, table=True):
     __tablename__ = "inspections"
+    __table_args__ = (Index("ix_inspections_object_id_date", "object_id", "date"),)
 
     inspection_id: Optional[int] = Field(default=None, primary_key=True)
     object_id: int = Field(foreign_key="objects.object_id", description="Inspected object")
@@ -0,0 +1,25 @@
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import JSON as SQLJSON, Enum as SQLEnum
+from sqlmodel import Column, Field, SQLModel
+
+from app.models.diagnostic import MLLabel
+
+
+class InspectionPrediction(SQLModel, table=True):
+    """ML label predicted for an inspection that had none; the label itself is also set on the inspection"""
+    __tablename__ = "inspection_predictions"
+
+    inspection_id: int = Field(primary_key=True, foreign_key="inspections.inspection_id")
+    label: MLLabel = Field(sa_column=Column(SQLEnum(MLLabel)))
+    confidence: float = Field(description="Probability of the predicted label")
+    probabilities: Dict[str, float] = Field(
+        sa_column=Column(SQLJSON),
+        default={},
+        description="Probability of every label",
+    )
+    model_version: Optional[int] = Field(
+        default=None, index=True, description="Model registry version that scored it (None if unsaved)"
+    )
+    scored_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,203 @@
+"""
+Batch scoring of inspections that have no known ML label.
+
+Inspections are walked by id, SCORING_CHUNK at a time (keyset pagination, so
+each chunk is an indexed range scan however far the walk has got). A chunk
+holds inspections without a label, and inspections whose label an earlier
+model version predicted. Labels that came with an import are never touched.
+Features come from the feature store, or from the database for inspections
+missing from it, and the whole chunk is predicted at once with class
+probabilities. Predicted labels are not written to the feature store, so
+training only ever learns from imported labels.
+
+Each chunk is one transaction:
+- its inspections are locked with SELECT ... FOR UPDATE SKIP LOCKED, so
+  scoring runs of several API processes share the work instead of scoring
+  (and moving the rollups of) the same inspections twice, and their labels
+  are re-read under the lock;
+- labels are set with one bulk UPDATE by primary key (a single executemany);
+- predictions are replaced in inspection_predictions;
+- rollups follow through apply_relabels, and the labels version is bumped.
+Running it again after a new model version re-scores only what that version
+has not scored yet.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import and_, delete, or_, update
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.core.events import event_bus
+from app.models.diagnostic import MLLabel
+from app.models.inspection import Inspection
+from app.models.inspection_prediction import InspectionPrediction
+from app.services.dashboard_rollups import apply_relabels
+from app.services.data_version import LABELS_TAG, bump_data_versions
+from app.services.feature_store import database_records, feature_store
+from app.services.ml_service import MLService
+
+logger = logging.getLogger(__name__)
+
+# progress(stage, processed, total)
+ProgressCallback = Callable[[str, int, int], None]
+
+
+class _StoreIndex:
+    """Positions of inspection ids in the feature store"""
+
+    def __init__(self, records: np.ndarray):
+        self.records = records
+        ids = np.asarray(records['inspection_id'])
+        self._order = np.argsort(ids, kind='stable')
+        self._sorted = ids[self._order]
+
+    def positions(self, inspection_ids: np.ndarray) -> np.ndarray:
+        """Position of each id, -1 for ids the store does not have"""
+        if not len(self._sorted):
+            return np.full(len(inspection_ids), -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self._sorted, inspection_ids), len(self._sorted) - 1)
+        return np.where(self._sorted[found] == inspection_ids, self._order[found], -1)
+
+
+def _scoring_chunk(after_id: int, model_version: Optional[int], size: int):
+    """Ids of the next `size` inspections to score after `after_id`, locked; those locked elsewhere are skipped"""
+    return (
+        select(Inspection.inspection_id)
+        .outerjoin(InspectionPrediction, InspectionPrediction.inspection_id == Inspection.inspection_id)
+        .where(Inspection.inspection_id > after_id)
+        .where(or_(
+            and_(Inspection.ml_label.is_(None), InspectionPrediction.inspection_id.is_(None)),
+            and_(
+                InspectionPrediction.inspection_id.is_not(None),
+                InspectionPrediction.model_version.is_distinct_from(model_version),
+            ),
+        ))
+        .order_by(Inspection.inspection_id)
+        .limit(size)
+        .with_for_update(skip_locked=True, of=Inspection)
+    )
+
+
+def _chunk_records(db: Session, index: _StoreIndex, inspection_ids: np.ndarray) -> np.ndarray:
+    """
+    Feature records of the chunk (ids ascending), from the store or else the
+    database. Inspections deleted meanwhile are left out.
+    """
+    positions = index.positions(inspection_ids)
+    in_store = positions >= 0
+    records = np.empty(len(inspection_ids), dtype=index.records.dtype)
+    records[in_store] = index.records[positions[in_store]]
+    keep = in_store.copy()
+    if not in_store.all():
+        # Both in id order, so the fallback rows line up with the ids they were found for
+        fallback = database_records(db, inspection_ids[~in_store].tolist())
+        found = ~in_store & np.isin(inspection_ids, fallback['inspection_id'])
+        records[found] = fallback
+        keep |= found
+    return records[keep]
+
+
+def _write_chunk(db: Session, model_version: Optional[int], inspection_ids: List[int],
+                 old_labels: List[Optional[MLLabel]], labels: List[MLLabel],
+                 probabilities: np.ndarray, classes: List[str]) -> int:
+    now = datetime.utcnow()
+    db.execute(update(Inspection), [
+        {'inspection_id': inspection_id, 'ml_label': label, 'updated_at': now}
+        for inspection_id, label in zip(inspection_ids, labels)
+    ])
+
+    db.execute(delete(InspectionPrediction).where(InspectionPrediction.inspection_id.in_(inspection_ids)))
+    db.add_all([
+        InspectionPrediction(
+            inspection_id=inspection_id,
+            label=label,
+            confidence=float(row.max()),
+            probabilities={name: round(float(p), 6) for name, p in zip(classes, row)},
+            model_version=model_version,
+            scored_at=now,
+        )
+        for inspection_id, label, row in zip(inspection_ids, labels, probabilities)
+    ])
+
+    changes = list(zip(inspection_ids, old_labels, labels))
+    apply_relabels(db, changes)
+    bump_data_versions(db, tags=[LABELS_TAG])
+    db.commit()
+    return sum(1 for old, new in zip(old_labels, labels) if old != new)
+
+
+def score_unlabeled(
+    db: Session,
+    service: MLService,
+    progress: Optional[ProgressCallback] = None,
+    chunk_size: Optional[int] = None,
+) -> dict:
+    """
+    Predict labels for every inspection without an imported label that the
+    service's model version has not scored yet, and save them. Returns the
+    same statistics predictions always reported ('predicted',
+    'label_distribution'), plus how many labels changed.
+    """
+    report = progress or (lambda stage, processed, total: None)
+    # One model for the whole run, even if a training swaps in another meanwhile
+    bundle = service.bundle
+    if bundle is None:
+        return {'predicted': 0, 'error': 'Model not trained'}
+
+    chunk_size = chunk_size or settings.ML_SCORING_CHUNK
+    model_version = bundle.version
+    index = _StoreIndex(feature_store.read())
+    started = time.monotonic()
+    label_counts: Dict[str, int] = {}
+    predicted = changed = chunks = 0
+    after_id = 0
+
+    while True:
+        locked = db.exec(_scoring_chunk(after_id, model_version, chunk_size)).all()
+        if not locked:
+            db.rollback()
+            break
+        after_id = locked[-1]
+        # Current labels: another process may have scored some of these right before the lock
+        old_by_id = dict(db.exec(
+            select(Inspection.inspection_id, Inspection.ml_label).where(Inspection.inspection_id.in_(locked))
+        ).all())
+        inspection_ids = np.array(locked, dtype=np.int64)
+
+        records = _chunk_records(db, index, inspection_ids)
+        ids = records['inspection_id'].tolist()
+        if not ids:
+            db.rollback()
+            continue
+        names, probabilities, classes = bundle.predict_records(records)
+        labels = [MLLabel(name) for name in names]
+        changed += _write_chunk(
+            db, model_version, ids, [old_by_id[i] for i in ids], labels, probabilities, classes
+        )
+        for name in names:
+            label_counts[name] = label_counts.get(name, 0) + 1
+        predicted += len(ids)
+        chunks += 1
+        report("scoring", predicted, predicted)
+
+    seconds = time.monotonic() - started
+    if predicted:
+        logger.info(f"Scored {predicted} inspections with model version {model_version} in {seconds:.1f}s")
+        event_bus.publish("labels.changed", {
+            'predicted': predicted,
+            'changed': changed,
+            'model_version': model_version,
+            'label_distribution': label_counts,
+        })
+    return {
+        'predicted': predicted,
+        'changed': changed,
+        'chunks': chunks,
+        'model_version': model_version,
+        'label_distribution': label_counts,
+        'seconds': round(seconds, 3),
+    }
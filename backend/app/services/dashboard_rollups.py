@@ -0,0 +1,296 @@
+"""
+Dashboard rollup tables.
+
+`inspection_rollups` holds inspection and defect counts per
+(year, month, pipeline, method, criticality); defects by method, the
+criticality histogram and inspections by year are sums over it.
+`object_risk_rollups` holds one risk entry per object with defects.
+
+Importers and ML labelling update both inside their own transaction, so the
+dashboard never reads rollups that disagree with the committed rows.
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, delete, extract, func, tuple_
+from sqlmodel import Session, select
+
+from app.core.database import dialect_insert
+from app.models.dashboard_rollup import InspectionRollup, ObjectRiskRollup
+from app.models.defect import Defect
+from app.models.diagnostic import MLLabel
+from app.models.inspection import Inspection
+from app.models.object import Object
+from app.services.object_queries import latest_inspections_subquery
+
+CRITICALITY_SCORE = {"high": 3, "medium": 2, "normal": 1}
+UNKNOWN_CRITICALITY = "unknown"
+
+RollupKey = Tuple[int, int, str, str, str]
+ROLLUP_KEY_COLUMNS = ("year", "month", "pipeline_id", "method", "criticality")
+UPSERT_CHUNK = 1000
+
+
+def criticality_of(ml_label: Optional[MLLabel]) -> str:
+    return ml_label.value if ml_label else UNKNOWN_CRITICALITY
+
+
+def criticality_score_expr(label_column):
+    """SQL CASE mapping an ml_label column to CRITICALITY_SCORE (0 when unlabeled)"""
+    return case(
+        *[(label_column == MLLabel(label), score) for label, score in CRITICALITY_SCORE.items()],
+        else_=0,
+    )
+
+
+def _rollup_key(date: datetime, pipeline_id: Optional[str], method, criticality: str) -> RollupKey:
+    return (date.year, date.month, pipeline_id or "", method.value, criticality)
+
+
+def _apply_deltas(db: Session, deltas: Dict[RollupKey, List[int]]) -> None:
+    """
+    Add the deltas with INSERT ... ON CONFLICT DO UPDATE, so transactions
+    creating the same bucket at once both succeed, then drop emptied buckets
+    """
+    changed = sorted(key for key, (inspections, defects) in deltas.items() if inspections or defects)
+    if not changed:
+        return
+    insert = dialect_insert(db)
+    table = InspectionRollup.__table__
+    for start in range(0, len(changed), UPSERT_CHUNK):
+        keys = changed[start:start + UPSERT_CHUNK]
+        stmt = insert(table).values([
+            dict(zip(ROLLUP_KEY_COLUMNS, key), inspection_count=deltas[key][0], defect_count=deltas[key][1])
+            for key in keys
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY_COLUMNS),
+            set_={
+                "inspection_count": table.c.inspection_count + stmt.excluded.inspection_count,
+                "defect_count": table.c.defect_count + stmt.excluded.defect_count,
+            },
+        ))
+        db.execute(
+            delete(table)
+            .where(tuple_(*[table.c[name] for name in ROLLUP_KEY_COLUMNS]).in_(keys))
+            .where(table.c.inspection_count <= 0, table.c.defect_count <= 0)
+        )
+
+
+def apply_new_inspections(
+    db: Session,
+    inspections: Iterable[Tuple[Inspection, int]],
+    pipeline_by_object: Dict[int, Optional[str]],
+) -> None:
+    """
+    Add freshly flushed inspections to the rollups.
+
+    `inspections` are (inspection, number of defects) pairs. Does not commit.
+    """
+    deltas: Dict[RollupKey, List[int]] = defaultdict(lambda: [0, 0])
+    touched_objects = set()
+    for inspection, defect_count in inspections:
+        key = _rollup_key(
+            inspection.date,
+            pipeline_by_object.get(inspection.object_id),
+            inspection.method,
+            criticality_of(inspection.ml_label),
+        )
+        deltas[key][0] += 1
+        deltas[key][1] += defect_count
+        touched_objects.add(inspection.object_id)
+
+    _apply_deltas(db, deltas)
+    # A new inspection can change the object's latest criticality even without defects
+    refresh_object_risks(db, touched_objects)
+
+
+def apply_relabels(db: Session, changes: Iterable[Tuple[int, Optional[MLLabel], Optional[MLLabel]]]) -> None:
+    """
+    Move relabelled inspections between criticality buckets.
+
+    `changes` are (inspection_id, old label, new label) triples for flushed
+    updates. Does not commit.
+    """
+    changes = [c for c in changes if c[1] != c[2]]
+    if not changes:
+        return
+
+    inspection_ids = [inspection_id for inspection_id, _, _ in changes]
+    rows = db.exec(
+        select(
+            Inspection.inspection_id,
+            Inspection.object_id,
+            Inspection.date,
+            Inspection.method,
+            Object.pipeline_id,
+            func.count(Defect.defect_id),
+        )
+        .join(Object, Object.object_id == Inspection.object_id)
+        .outerjoin(Defect, Defect.inspection_id == Inspection.inspection_id)
+        .where(Inspection.inspection_id.in_(inspection_ids))
+        .group_by(
+            Inspection.inspection_id,
+            Inspection.object_id,
+            Inspection.date,
+            Inspection.method,
+            Object.pipeline_id,
+        )
+    ).all()
+    info = {row[0]: row for row in rows}
+
+    deltas: Dict[RollupKey, List[int]] = defaultdict(lambda: [0, 0])
+    touched_objects = set()
+    for inspection_id, old_label, new_label in changes:
+        if inspection_id not in info:
+            continue
+        _, object_id, date, method, pipeline_id, defect_count = info[inspection_id]
+        old_key = _rollup_key(date, pipeline_id, method, criticality_of(old_label))
+        new_key = _rollup_key(date, pipeline_id, method, criticality_of(new_label))
+        deltas[old_key][0] -= 1
+        deltas[old_key][1] -= defect_count
+        deltas[new_key][0] += 1
+        deltas[new_key][1] += defect_count
+        touched_objects.add(object_id)
+
+    _apply_deltas(db, deltas)
+    refresh_object_risks(db, touched_objects)
+
+
+def refresh_object_risks(db: Session, object_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Recompute risk entries of the given objects (all objects when None).
+
+    Only the touched objects are aggregated, so the cost follows the size of
+    the change rather than the history. The objects are locked first, so a
+    concurrent transaction touching them waits and then aggregates with
+    this one's defects included; entries are upserted. Does not commit.
+    """
+    if object_ids is not None:
+        object_ids = sorted(set(object_ids))
+        if not object_ids:
+            return 0
+        db.exec(
+            select(Object.object_id)
+            .where(Object.object_id.in_(object_ids))
+            .order_by(Object.object_id)
+            .with_for_update()
+        ).all()
+
+    defects = (
+        select(
+            Inspection.object_id,
+            func.count(Defect.defect_id).label("defect_count"),
+            func.max(Defect.depth).label("max_depth"),
+        )
+        .join(Defect, Defect.inspection_id == Inspection.inspection_id)
+        .group_by(Inspection.object_id)
+    )
+    if object_ids is not None:
+        defects = defects.where(Inspection.object_id.in_(object_ids))
+    defects = defects.subquery("object_defects")
+    latest = latest_inspections_subquery(object_ids=object_ids)
+
+    stmt = (
+        select(
+            defects.c.object_id,
+            Object.pipeline_id,
+            criticality_score_expr(latest.c.ml_label),
+            defects.c.defect_count,
+            defects.c.max_depth,
+        )
+        .join(Object, Object.object_id == defects.c.object_id)
+        .join(latest, latest.c.object_id == defects.c.object_id)
+    )
+
+    rows = db.exec(stmt.order_by(defects.c.object_id)).all()
+    now = datetime.utcnow()
+    table = ObjectRiskRollup.__table__
+    insert = dialect_insert(db)
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        upsert = insert(table).values([
+            {
+                "object_id": object_id,
+                "pipeline_id": pipeline_id,
+                "crit_score": crit_score or 0,
+                "defect_count": defect_count,
+                "max_depth": max_depth,
+                "updated_at": now,
+            }
+            for object_id, pipeline_id, crit_score, defect_count, max_depth in rows[start:start + UPSERT_CHUNK]
+        ])
+        db.execute(upsert.on_conflict_do_update(
+            index_elements=["object_id"],
+            set_={
+                name: upsert.excluded[name]
+                for name in ("pipeline_id", "crit_score", "defect_count", "max_depth", "updated_at")
+            },
+        ))
+
+    # Objects left without defects lose their entry
+    stale = delete(table).where(table.c.object_id.not_in(select(defects.c.object_id)))
+    if object_ids is not None:
+        stale = stale.where(table.c.object_id.in_(object_ids))
+    db.execute(stale)
+    return len(rows)
+
+
+def rebuild_rollups(db: Session) -> dict:
+    """Recompute every rollup table from inspections and defects and commit"""
+    defects_per_inspection = (
+        select(Defect.inspection_id, func.count(Defect.defect_id).label("defect_count"))
+        .group_by(Defect.inspection_id)
+        .subquery()
+    )
+    year = extract("year", Inspection.date)
+    month = extract("month", Inspection.date)
+    rows = db.exec(
+        select(
+            year,
+            month,
+            Object.pipeline_id,
+            Inspection.method,
+            Inspection.ml_label,
+            func.count(Inspection.inspection_id),
+            func.coalesce(func.sum(defects_per_inspection.c.defect_count), 0),
+        )
+        .join(Object, Object.object_id == Inspection.object_id)
+        .outerjoin(
+            defects_per_inspection, defects_per_inspection.c.inspection_id == Inspection.inspection_id
+        )
+        .group_by(year, month, Object.pipeline_id, Inspection.method, Inspection.ml_label)
+    ).all()
+
+    db.execute(delete(InspectionRollup))
+    cells: Dict[RollupKey, List[int]] = defaultdict(lambda: [0, 0])
+    for y, m, pipeline_id, method, ml_label, inspection_count, defect_count in rows:
+        key = (int(y), int(m), pipeline_id or "", method.value, criticality_of(ml_label))
+        cells[key][0] += inspection_count
+        cells[key][1] += int(defect_count)
+    db.add_all(
+        [
+            InspectionRollup(
+                year=y,
+                month=m,
+                pipeline_id=pipeline_id,
+                method=method,
+                criticality=criticality,
+                inspection_count=inspection_count,
+                defect_count=defect_count,
+            )
+            for (y, m, pipeline_id, method, criticality), (inspection_count, defect_count) in cells.items()
+        ]
+    )
+    risk_entries = refresh_object_risks(db)
+    db.commit()
+    return {"rollup_cells": len(cells), "risk_entries": risk_entries}
+
+
+def rebuild_rollups_if_empty(db: Session) -> Optional[dict]:
+    """Backfill rollups for databases that have inspections but were never rolled up"""
+    has_rollups = db.exec(select(InspectionRollup.year).limit(1)).first() is not None
+    has_inspections = db.exec(select(Inspection.inspection_id).limit(1)).first() is not None
+    if has_rollups or not has_inspections:
+        return None
+    return rebuild_rollups(db)
@@ -0,0 +1,110 @@
+import secrets
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, select
+
+from app.core.database import dialect_insert
+from app.core.events import event_bus
+from app.models.data_version import DataVersion
+
+GLOBAL_SCOPE = "global"
+
+# Cache tags: one scope per kind of data, bumped by whoever changes it
+OBJECTS_TAG = "objects"
+INSPECTIONS_TAG = "inspections"
+LABELS_TAG = "labels"
+ML_METRICS_TAG = "ml_metrics"
+IMPORTS_TAG = "imports"
+
+# Not a version: holds a random id of the database, set once and never bumped
+DATABASE_ID_SCOPE = "database_id"
+
+# Scopes bumped in the session's open transaction, published once it commits
+_PENDING_CHANGES = "pending_data_changes"
+
+
+def pipeline_scope(pipeline_id: str) -> str:
+    return f"pipeline:{pipeline_id}"
+
+
+def get_data_version(db: Session, scope: str = GLOBAL_SCOPE) -> int:
+    """Current version of the scope, 0 when nothing was imported yet."""
+    return get_data_versions(db, [scope])[scope]
+
+
+def get_data_versions(db: Session, scopes: Iterable[str]) -> Dict[str, int]:
+    """Versions of several scopes in one query; missing scopes are 0."""
+    scopes = list(scopes)
+    rows = db.exec(
+        select(DataVersion.scope, DataVersion.version).where(DataVersion.scope.in_(scopes))
+    ).all()
+    versions = {scope: 0 for scope in scopes}
+    versions.update({scope: version for scope, version in rows})
+    return versions
+
+
+def get_database_id(db: Session) -> int:
+    """
+    Random id of this database, e.g. to tell whether files on disk were built
+    from it. Created and committed on first use.
+    """
+    database_id = get_data_version(db, DATABASE_ID_SCOPE)
+    if database_id:
+        return database_id
+    # Positive int32 (0 reads as missing); a concurrent first call may have set it, so re-read
+    stmt = dialect_insert(db)(DataVersion.__table__).values(
+        scope=DATABASE_ID_SCOPE, version=secrets.randbelow(2**31 - 1) + 1, updated_at=datetime.utcnow()
+    )
+    db.execute(stmt.on_conflict_do_nothing(index_elements=["scope"]))
+    db.commit()
+    return get_data_version(db, DATABASE_ID_SCOPE)
+
+
+def bump_data_versions(
+    db: Session,
+    pipeline_ids: Optional[Iterable[str]] = None,
+    tags: Iterable[str] = (),
+) -> None:
+    """
+    Bump the global version, the given tags and the touched pipelines.
+
+    Does not commit: callers bump inside the transaction that changes the data,
+    so caches keyed on the version never see the new version with old rows.
+    A `data.changed` event follows once that transaction commits.
+    """
+    tags = set(tags)
+    pipeline_ids = {p for p in (pipeline_ids or []) if p}
+    pending = db.info.setdefault(_PENDING_CHANGES, {"tags": set(), "pipeline_ids": set()})
+    pending["tags"] |= tags
+    pending["pipeline_ids"] |= pipeline_ids
+
+    scopes = [GLOBAL_SCOPE]
+    scopes += sorted(tags)
+    scopes += sorted(pipeline_scope(p) for p in pipeline_ids)
+
+    # One upsert: the first bumps of a new scope in concurrent transactions must not both INSERT it
+    now = datetime.utcnow()
+    table = DataVersion.__table__
+    stmt = dialect_insert(db)(table).values([{"scope": scope, "version": 1, "updated_at": now} for scope in scopes])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["scope"],
+        set_={"version": table.c.version + 1, "updated_at": stmt.excluded.updated_at},
+    ))
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _publish_data_changes(session: OrmSession) -> None:
+    pending = session.info.pop(_PENDING_CHANGES, None)
+    if pending:
+        event_bus.publish(
+            "data.changed",
+            {"tags": sorted(pending["tags"]), "pipeline_ids": sorted(pending["pipeline_ids"])},
+        )
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_data_changes(session: OrmSession) -> None:
+    session.info.pop(_PENDING_CHANGES, None)
@@ -1,6 +1,8 @@
 from datetime import datetime
 import logging
+from typing import Callable, Optional
 
+import numpy as np
 import pandas as pd
 from fastapi import HTTPException
 from sqlmodel import Session, select
@@ -8,20 +10,65 @@ from sqlmodel import Session, select
 from app.models.object import Object
 from app.models.inspection import Inspection
 from app.models.defect import Defect
+from app.services.dashboard_rollups import apply_new_inspections
+from app.services.data_version import INSPECTIONS_TAG, bump_data_versions
+from app.services.feature_store import (
+    LABELS,
+    METHODS,
+    NUMERIC_FIELDS,
+    QUALITY_GRADES,
+    empty_records,
+    encode_values,
+    feature_store,
+)
 from app.services.import_helpers import (
     normalize_diagnostic_method,
     normalize_ml_label,
     normalize_quality_grade,
     to_bool,
 )
-from app.services.ml_service import ml_service
+from app.services.training_scheduler import training_scheduler
 
 logger = logging.getLogger(__name__)
 
-
-def import_diagnostics(df: pd.DataFrame, db: Session, errors: list) -> tuple[int, int]:
+PROGRESS_EVERY = 500
+
+# progress(stage, processed, total)
+ProgressCallback = Callable[[str, int, int], None]
+
+
+def _feature_records(
+    df: pd.DataFrame,
+    inspections: list[tuple[Inspection, dict | None]],
+    source_rows: list,
+) -> np.ndarray:
+    """Feature store records of flushed inspections, with param1-3 as uploaded"""
+    records = empty_records(len(inspections))
+    records['inspection_id'] = [inspection.inspection_id for inspection, _ in inspections]
+    records['method'] = encode_values([i.method.value for i, _ in inspections], METHODS)
+    records['quality_grade'] = encode_values(
+        [i.quality_grade.value if i.quality_grade else None for i, _ in inspections], QUALITY_GRADES
+    )
+    records['label'] = encode_values([i.ml_label.value if i.ml_label else None for i, _ in inspections], LABELS)
+    records['defect_found'] = [defect_data is not None for _, defect_data in inspections]
+    source = df.loc[source_rows].reindex(columns=NUMERIC_FIELDS)
+    for name in NUMERIC_FIELDS:
+        records[name] = pd.to_numeric(source[name], errors="coerce").to_numpy(dtype=np.float32, na_value=np.nan)
+    return records
+
+
+def import_diagnostics(
+    df: pd.DataFrame,
+    db: Session,
+    errors: list,
+    progress: Optional[ProgressCallback] = None,
+) -> tuple[int, int]:
+    report = progress or (lambda stage, processed, total: None)
+    total_rows = len(df)
     created_count = 0
     inspections_to_add: list[tuple[Inspection, dict | None]] = []
+    # df index of each inspection, for the raw params of its row
+    source_rows: list = []
 
     object_ids: set[int] = set()
     for val in df.get("object_id", []):
@@ -33,11 +80,17 @@ def import_diagnostics(df: pd.DataFrame, db: Session, errors: list) -> tuple[int
             continue
 
     existing_object_ids: set[int] = set()
+    pipeline_by_object: dict[int, str | None] = {}
     if object_ids:
-        found = db.exec(select(Object.object_id).where(Object.object_id.in_(object_ids))).all()
-        existing_object_ids = {row[0] if isinstance(row, tuple) else row for row in found}
-
-    for idx, row in df.iterrows():
+        found = db.exec(
+            select(Object.object_id, Object.pipeline_id).where(Object.object_id.in_(object_ids))
+        ).all()
+        pipeline_by_object = {row[0]: row[1] for row in found}
+        existing_object_ids = set(pipeline_by_object)
+
+    for processed, (idx, row) in enumerate(df.iterrows()):
+        if processed % PROGRESS_EVERY == 0:
+            report("parsing", processed, total_rows)
         try:
             obj_id = int(row.get("object_id")) if pd.notna(row.get("object_id")) else None
             if obj_id is None:
@@ -82,14 +135,17 @@ def import_diagnostics(df: pd.DataFrame, db: Session, errors: list) -> tuple[int
                 }
 
             inspections_to_add.append((inspection, defect_data))
+            source_rows.append(idx)
             created_count += 1
         except Exception as exc:
             errors.append({"row": idx + 2, "error": str(exc)})
 
+    report("parsing", total_rows, total_rows)
     if not inspections_to_add:
         return 0, 0
 
     try:
+        report("saving", 0, len(inspections_to_add))
         db.add_all([pair[0] for pair in inspections_to_add])
         db.flush()
 
@@ -111,39 +167,29 @@ def import_diagnostics(df: pd.DataFrame, db: Session, errors: list) -> tuple[int
 
         if defects_to_add:
             db.add_all(defects_to_add)
+        db.flush()
 
+        apply_new_inspections(
+            db,
+            [(inspection, 1 if defect_data else 0) for inspection, defect_data in inspections_to_add],
+            pipeline_by_object,
+        )
+        bump_data_versions(
+            db,
+            {pipeline_by_object.get(inspection.object_id) for inspection, _ in inspections_to_add},
+            tags=[INSPECTIONS_TAG],
+        )
+        # Read before the commit expires the instances
+        features = _feature_records(df, inspections_to_add, source_rows)
         db.commit()
+        report("saving", len(inspections_to_add), len(inspections_to_add))
         defects_created = len([d for _, d in inspections_to_add if d is not None])
         
-        # Prepare data for ML training
+        # Training runs later in the background, coalesced with other imports
         try:
-            # Build DataFrame from imported inspections with defect data
-            ml_df = df[['method', 'temperature', 'humidity', 'illumination', 'param1', 'param2', 'param3', 'defect_found', 'quality_grade', 'date', 'ml_label']]
-            labeled_df = ml_df[ml_df['ml_label'].notna()].copy()
-            prediction_results = None
-            
-            if len(labeled_df) > 0:
-                print(f"Training ML model on {len(labeled_df)} labeled samples...")
-                train_metrics, test_metrics = ml_service.train(labeled_df, db)
-                
-                if train_metrics:
-                    print(f"Model training completed. Train accuracy: {train_metrics.get('accuracy', 0):.4f}, "
-                                f"Test accuracy: {test_metrics.get('accuracy', 0):.4f}")
-                    
-                    # Predict for unlabeled data
-                    unlabeled_df = ml_df[ml_df['ml_label'].isna()].copy()
-                    if len(unlabeled_df) > 0:
-                        print(f"Predicting labels for {len(unlabeled_df)} unlabeled samples...")
-                        prediction_results = ml_service.predict_unlabeled(unlabeled_df, db)
-                        
-                        if prediction_results.get('predicted', 0) > 0:
-                            print(f"Predicted labels for {prediction_results['predicted']} unlabeled diagnostics. "
-                                        f"Distribution: {prediction_results.get('label_distribution', {})}")
-                    
-                    # Save metrics to database
-                    ml_service.save_metrics(db, train_metrics, test_metrics, prediction_results)
+            training_scheduler.notify(*feature_store.append(features))
         except Exception as ml_exc:
-            logger.error(f"ML service error: {ml_exc}", exc_info=True)
+            logger.error(f"Could not schedule ML training: {ml_exc}", exc_info=True)
         
         return created_count, defects_created
     except Exception as exc:
@@ -0,0 +1,309 @@
+"""
+On-disk store of ML feature rows, one fixed-size record per inspection.
+
+Diagnostics imports append the records of the inspections they created, with
+the raw param1-3 of the uploaded file, so training reads one memory-mapped
+file instead of loading every labeled inspection and its defects through the
+ORM. Categorical fields are stored as indexes into the enum values
+(METHODS, QUALITY_GRADES, LABELS; -1 when missing), so the file does not
+depend on the category lists of any trained model. Labels are the imported
+ones only; predicted labels (see batch_scoring) are not training data.
+
+Appends and rebuilds hold an exclusive flock on features.lock (a sidecar,
+since a rebuild replaces features.bin), so API processes neither interleave
+records nor append to a file that is being replaced; a torn record left by
+a crash is cut off before the next append.
+
+At startup the store is rebuilt from the database (with the defects' max
+depth, length and width standing in for param1-3, which the database does
+not keep, and without the labels recorded in inspection_predictions) when
+it is missing, was written with another layout or for another database
+(the header keeps the database id, see data_version), or holds duplicate
+inspections or ones the database does not. Otherwise only inspections
+missing from it, e.g. after a crash between an import's commit and its
+append, are added that way, so the raw params of every other record are
+kept.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, null
+from sqlmodel import Session, select
+
+try:
+    import fcntl
+except ImportError:  # Windows: the thread lock only covers this process
+    fcntl = None
+
+from app.core.config import settings
+from app.core.database import engine
+from app.models.defect import Defect
+from app.models.diagnostic import DiagnosticMethod, MLLabel, QualityGrade
+from app.models.inspection import Inspection
+from app.models.inspection_prediction import InspectionPrediction
+from app.services.data_version import get_database_id
+
+logger = logging.getLogger(__name__)
+
+# 2: predicted labels are left out
+FEATURE_STORE_VERSION = 2
+METHODS = [m.value for m in DiagnosticMethod]
+QUALITY_GRADES = [g.value for g in QualityGrade]
+LABELS = [label.value for label in MLLabel]
+NUMERIC_FIELDS = ['temperature', 'humidity', 'illumination', 'param1', 'param2', 'param3']
+
+RECORD = np.dtype([
+    ('inspection_id', '<i8'),
+    ('method', 'i1'),
+    ('quality_grade', 'i1'),
+    ('defect_found', 'i1'),
+    ('label', 'i1'),
+] + [(name, '<f4') for name in NUMERIC_FIELDS])
+
+REBUILD_CHUNK = 5000
+
+
+def encode_values(values: Iterable[Optional[str]], vocabulary: Sequence[str]) -> np.ndarray:
+    """int8 index of each value in `vocabulary`; None and unknown values get -1"""
+    as_str = pd.Series(list(values), dtype=object)
+    return pd.Categorical(as_str.where(as_str.notna()), categories=list(vocabulary)).codes.astype(np.int8)
+
+
+def empty_records(n: int) -> np.ndarray:
+    records = np.zeros(n, dtype=RECORD)
+    for name in ('method', 'quality_grade', 'label'):
+        records[name] = -1
+    for name in NUMERIC_FIELDS:
+        records[name] = np.nan
+    return records
+
+
+def records_from_frame(df: pd.DataFrame) -> np.ndarray:
+    """
+    Records from a DataFrame of enum values (method, quality_grade,
+    ml_label), defect_found and the numeric fields. Missing columns stay
+    empty; inspection_id is 0 unless given.
+    """
+    records = empty_records(len(df))
+    if 'inspection_id' in df:
+        records['inspection_id'] = df['inspection_id'].to_numpy(dtype=np.int64)
+    for field, column, vocabulary in (
+        ('method', 'method', METHODS),
+        ('quality_grade', 'quality_grade', QUALITY_GRADES),
+        ('label', 'ml_label', LABELS),
+    ):
+        if column in df:
+            records[field] = encode_values(df[column].map(_enum_value), vocabulary)
+    if 'defect_found' in df:
+        records['defect_found'] = df['defect_found'].fillna(False).to_numpy(dtype=bool)
+    for name in NUMERIC_FIELDS:
+        if name in df:
+            records[name] = pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
+    return records
+
+
+def _enum_value(value):
+    return getattr(value, 'value', value)
+
+
+def _database_features():
+    """
+    Feature columns of inspections as far as the database has them: defect
+    sizes for param1-3, and no label where it was predicted
+    """
+    imported_label = case(
+        (InspectionPrediction.inspection_id.is_(None), Inspection.ml_label),
+        else_=null(),
+    )
+    return (
+        select(
+            Inspection.inspection_id,
+            Inspection.method,
+            Inspection.quality_grade,
+            imported_label,
+            Inspection.temperature,
+            Inspection.humidity,
+            Inspection.illumination,
+            func.count(Defect.defect_id),
+            func.max(Defect.depth),
+            func.max(Defect.length),
+            func.max(Defect.width),
+        )
+        .outerjoin(Defect, Defect.inspection_id == Inspection.inspection_id)
+        .outerjoin(InspectionPrediction, InspectionPrediction.inspection_id == Inspection.inspection_id)
+        .group_by(Inspection.inspection_id, InspectionPrediction.inspection_id)
+    )
+
+
+def _records_from_rows(rows: List[tuple]) -> np.ndarray:
+    columns = list(zip(*rows))
+    records = empty_records(len(rows))
+    records['inspection_id'] = columns[0]
+    records['method'] = encode_values(map(_enum_value, columns[1]), METHODS)
+    records['quality_grade'] = encode_values(map(_enum_value, columns[2]), QUALITY_GRADES)
+    records['label'] = encode_values(map(_enum_value, columns[3]), LABELS)
+    records['defect_found'] = np.array(columns[7]) > 0
+    for name, values in zip(NUMERIC_FIELDS, columns[4:7] + columns[8:11]):
+        records[name] = np.array(values, dtype=np.float64)
+    return records
+
+
+def database_records(db: Session, inspection_ids: Sequence[int]) -> np.ndarray:
+    """Records built from the database, for inspections missing from the store"""
+    if not inspection_ids:
+        return empty_records(0)
+    rows = db.exec(
+        _database_features().where(Inspection.inspection_id.in_(inspection_ids)).order_by(Inspection.inspection_id)
+    ).all()
+    return _records_from_rows([tuple(row) for row in rows]) if rows else empty_records(0)
+
+
+class FeatureStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, "features.bin")
+        self.header_path = os.path.join(directory, "features.json")
+        self.lock_path = os.path.join(directory, "features.lock")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def header() -> Dict:
+        return {
+            'version': FEATURE_STORE_VERSION,
+            'record': [list(field) for field in RECORD.descr],
+            'methods': METHODS,
+            'quality_grades': QUALITY_GRADES,
+            'labels': LABELS,
+        }
+
+    def _stored_header(self) -> Dict:
+        try:
+            with open(self.header_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _layout_matches(self, stored: Dict) -> bool:
+        layout = {key: value for key, value in stored.items() if key != 'database_id'}
+        return layout == json.loads(json.dumps(self.header()))
+
+    def __len__(self) -> int:
+        try:
+            return os.path.getsize(self.path) // RECORD.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Records [start, stop) as a read-only memory map (all of them by default)"""
+        count = len(self)
+        stop = count if stop is None else min(stop, count)
+        if start >= stop:
+            return empty_records(0)
+        return np.memmap(self.path, dtype=RECORD, mode='r', offset=start * RECORD.itemsize, shape=(stop - start,))
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock on the store, across threads and processes"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def append(self, records: np.ndarray) -> Tuple[int, int]:
+        """Append records; return their (start, stop) positions"""
+        if len(records) == 0:
+            count = len(self)
+            return count, count
+        with self._locked():
+            return self._append(records)
+
+    def _append(self, records: np.ndarray) -> Tuple[int, int]:
+        data = np.ascontiguousarray(records, dtype=RECORD).tobytes()
+        if not self._layout_matches(self._stored_header()):
+            with Session(engine) as db:
+                self._write_header(get_database_id(db))
+        with open(self.path, 'ab') as f:
+            size = f.tell()
+            if size % RECORD.itemsize:
+                # Torn record from an interrupted write
+                f.truncate(size - size % RECORD.itemsize)
+            f.write(data)
+            stop = f.tell() // RECORD.itemsize
+        return stop - len(records), stop
+
+    def _write_header(self, database_id: int) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump({**self.header(), 'database_id': database_id}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.header_path)
+
+    def rebuild(self, db: Session) -> int:
+        """Rewrite the store from the database; return the number of records"""
+        with self._locked():
+            return self._rebuild(db, get_database_id(db))
+
+    def _rebuild(self, db: Session, database_id: int) -> int:
+        stmt = _database_features().order_by(Inspection.inspection_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        total = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                chunk: List[tuple] = []
+                for row in db.exec(stmt.execution_options(yield_per=REBUILD_CHUNK)):
+                    chunk.append(tuple(row))
+                    if len(chunk) == REBUILD_CHUNK:
+                        out.write(_records_from_rows(chunk).tobytes())
+                        total += len(chunk)
+                        chunk = []
+                if chunk:
+                    out.write(_records_from_rows(chunk).tobytes())
+                    total += len(chunk)
+            os.replace(tmp_path, self.path)
+            self._write_header(database_id)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        logger.info(f"Rebuilt ML feature store with {total} records")
+        return total
+
+    def sync_with_database(self, db: Session) -> Optional[int]:
+        """
+        Make the store hold one record per inspection of the database.
+        Returns the number of records written, None when it was up to date.
+        """
+        with self._locked():
+            database_id = get_database_id(db)
+            inspection_ids = np.array(db.exec(select(Inspection.inspection_id)).all(), dtype=np.int64)
+            header = self._stored_header()
+            if not self._layout_matches(header) or header.get('database_id') != database_id:
+                if not len(inspection_ids) and not os.path.exists(self.path):
+                    return None
+                return self._rebuild(db, database_id)
+
+            stored = np.asarray(self.read()['inspection_id'])
+            if len(np.unique(stored)) < len(stored) or not np.isin(stored, inspection_ids).all():
+                logger.warning("ML feature store holds duplicate inspections or ones the database does not")
+                return self._rebuild(db, database_id)
+
+            missing = np.setdiff1d(inspection_ids, stored)
+            if not len(missing):
+                return None
+            for start in range(0, len(missing), REBUILD_CHUNK):
+                self._append(database_records(db, missing[start:start + REBUILD_CHUNK].tolist()))
+            logger.info(f"Added {len(missing)} missing inspections to the ML feature store")
+            return len(missing)
+
+    def stats(self) -> Dict[str, int]:
+        return {'records': len(self), 'bytes': len(self) * RECORD.itemsize}
+
+
+feature_store = FeatureStore(settings.ML_MODEL_DIR)
@@ -1,231 +1,268 @@
 import logging
-from typing import Optional, Tuple
-import pandas as pd
+import threading
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+from fastapi import HTTPException
 import numpy as np
-from sqlmodel import Session, select
+from sqlmodel import Session
 from lightgbm import LGBMClassifier
 from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import classification_report, accuracy_score
 
-from app.models.inspection import Inspection
-from app.models.defect import Defect
-from app.models.diagnostic import MLLabel
+from app.core.config import settings
+from app.core.events import event_bus
 from app.models.ml_metrics import MLMetrics
+from app.services.data_version import ML_METRICS_TAG, bump_data_versions
+from app.services.feature_store import (
+    LABELS,
+    METHODS,
+    NUMERIC_FIELDS,
+    QUALITY_GRADES,
+)
+from app.services.model_registry import ModelVersion, model_registry
 
 logger = logging.getLogger(__name__)
 
+# Column order of the feature matrix
+FEATURE_COLUMNS = [
+    'method_encoded',
+    'temperature',
+    'humidity',
+    'illumination',
+    'param1',
+    'param2',
+    'param3',
+    'defect_found_int',
+    'quality_grade_encoded',
+]
+
+
+def fit_categories(codes: np.ndarray, vocabulary: Sequence[str]) -> List[str]:
+    """Sorted distinct values present in `codes` (the codes LabelEncoder would assign)"""
+    return sorted(vocabulary[c] for c in np.unique(codes[codes >= 0]))
+
+
+def category_lookup(categories: Sequence[str], vocabulary: Sequence[str]) -> np.ndarray:
+    """
+    Model code of each vocabulary index. The extra last entry is -1, so
+    indexing with a store code of -1 (missing) yields -1, as do values the
+    model has not seen.
+    """
+    index = {value: i for i, value in enumerate(categories)}
+    lookup = np.array([index.get(value, -1) for value in vocabulary] + [-1], dtype=np.float32)
+    lookup.flags.writeable = False
+    return lookup
+
+
+def build_feature_matrix(records: np.ndarray, method_lookup: np.ndarray, quality_grade_lookup: np.ndarray) -> np.ndarray:
+    """Feature matrix (float32, rows x FEATURE_COLUMNS) from feature store records"""
+    X = np.empty((len(records), len(FEATURE_COLUMNS)), dtype=np.float32)
+    X[:, 0] = method_lookup[records['method']]
+    for i, col in enumerate(NUMERIC_FIELDS, start=1):
+        X[:, i] = records[col]
+    X[:, 7] = records['defect_found']
+    X[:, 8] = quality_grade_lookup[records['quality_grade']]
+    return X
+
+
+def new_classifier(num_classes: int) -> LGBMClassifier:
+    return LGBMClassifier(
+        objective='multiclass',
+        num_class=num_classes,
+        n_estimators=100,
+        learning_rate=0.1,
+        max_depth=5,
+        random_state=42,
+        verbose=-1,
+    )
+
+
+class ModelBundle(NamedTuple):
+    """
+    A trained model with everything needed to predict with it. Never
+    changed once built: training builds a new bundle and MLService swaps it
+    in, so a reader holding a bundle always sees one consistent model.
+    """
+    model: LGBMClassifier
+    # Category lists fitted on the first training; a value's code is its index
+    method_classes: Tuple[str, ...]
+    quality_grade_classes: Tuple[str, ...]
+    # LabelEncoder classes (sorted label values)
+    label_classes: Tuple[str, ...]
+    method_lookup: np.ndarray
+    quality_grade_lookup: np.ndarray
+    # Label of each predict_proba column
+    class_names: Tuple[str, ...]
+    # Registry version the model was loaded from or saved as; None until saved
+    version: Optional[int] = None
+
+    @classmethod
+    def create(cls, model: LGBMClassifier, method_classes: Sequence[str], quality_grade_classes: Sequence[str],
+               label_classes: Sequence[str], version: Optional[int] = None) -> "ModelBundle":
+        label_classes = tuple(str(c) for c in label_classes)
+        return cls(
+            model=model,
+            method_classes=tuple(method_classes),
+            quality_grade_classes=tuple(quality_grade_classes),
+            label_classes=label_classes,
+            method_lookup=category_lookup(method_classes, METHODS),
+            quality_grade_lookup=category_lookup(quality_grade_classes, QUALITY_GRADES),
+            class_names=tuple(label_classes[c] for c in model.classes_),
+            version=version,
+        )
+
+    def feature_matrix(self, records: np.ndarray) -> np.ndarray:
+        """Feature matrix of the records; values the model has not seen become -1"""
+        return build_feature_matrix(records, self.method_lookup, self.quality_grade_lookup)
+
+    def label_encoder(self) -> LabelEncoder:
+        encoder = LabelEncoder()
+        encoder.classes_ = np.array(self.label_classes, dtype=object)
+        return encoder
+
+    def predict_records(self, records: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """
+        Predicted label of each feature store record, the probability of
+        every label (rows x classes) and the class names of its columns
+        """
+        probabilities = self.model.predict_proba(self.feature_matrix(records))
+        labels = np.array(self.class_names, dtype=object)[probabilities.argmax(axis=1)]
+        return labels, probabilities, list(self.class_names)
+
 
 class MLService:
-    """Machine Learning service for diagnostic data classification"""
+    """
+    Machine Learning service for diagnostic data classification.
+
+    The served model is one ModelBundle attribute. Readers take it once
+    (`bundle`) and predict without locks; training, loading and activation
+    build a new bundle and replace the attribute in a single assignment, so
+    a prediction never sees half of a retrain. Writers are serialized by
+    `_lock`, which readers never wait for.
+    """
     
     def __init__(self):
-        self.model: Optional[LGBMClassifier] = None
-        self.method_encoder: Optional[LabelEncoder] = None
-        self.quality_grade_encoder: Optional[LabelEncoder] = None
-        self.label_encoder: Optional[LabelEncoder] = None
-        self.is_trained = False
+        self._bundle: Optional[ModelBundle] = None
+        self._lock = threading.RLock()
     
-    def prepare_features(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Prepare features from diagnostic data"""
-        features = df.copy()
-        
-        # Encode method
-        if self.method_encoder is None:
-            self.method_encoder = LabelEncoder()
-            features['method_encoded'] = self.method_encoder.fit_transform(features['method'].astype(str))
-        else:
-            # Handle unseen methods
-            known_methods = set(self.method_encoder.classes_)
-            features['method_encoded'] = features['method'].apply(
-                lambda x: self.method_encoder.transform([x])[0] if x in known_methods else -1
-            )
-        
-        # Encode quality_grade
-        if self.quality_grade_encoder is None:
-            self.quality_grade_encoder = LabelEncoder()
-            quality_grades = features['quality_grade'].dropna().astype(str)
-            if len(quality_grades) > 0:
-                self.quality_grade_encoder.fit(quality_grades)
-                features['quality_grade_encoded'] = features['quality_grade'].apply(
-                    lambda x: self.quality_grade_encoder.transform([str(x)])[0] if pd.notna(x) else -1
-                )
-            else:
-                features['quality_grade_encoded'] = -1
-        else:
-            known_grades = set(self.quality_grade_encoder.classes_)
-            features['quality_grade_encoded'] = features['quality_grade'].apply(
-                lambda x: self.quality_grade_encoder.transform([str(x)])[0] 
-                if pd.notna(x) and str(x) in known_grades else -1
-            )
-        features['defect_found_int'] = features['defect_found'].astype(int)
-        feature_cols = [
-            'method_encoded',
-            'temperature',
-            'humidity',
-            'illumination',
-            'param1',
-            'param2',
-            'param3',
-            'defect_found_int',
-            'quality_grade_encoded',
-        ]
-        return features[feature_cols]
+    @property
+    def bundle(self) -> Optional[ModelBundle]:
+        """The model being served (None before the first training or load)"""
+        return self._bundle
     
-    def train(self, labeled_data: pd.DataFrame, db: Session = None) -> Tuple[dict, dict]:
+    @property
+    def is_trained(self) -> bool:
+        return self._bundle is not None
+    
+    @property
+    def version(self) -> Optional[int]:
+        bundle = self._bundle
+        return bundle.version if bundle else None
+    
+    def train(self, records: np.ndarray) -> Tuple[dict, dict]:
         """
-        Train or continue training LightGBM model on labeled inspection data
+        Train or continue training LightGBM model on the labeled records of
+        the feature store. The served model keeps answering until the new
+        one replaces it.
         
         Args:
-            labeled_data: DataFrame with labeled inspection data (must have ml_label column)
-            db: Optional database session for incremental learning from existing data
+            records: Feature store records; those without a label are ignored
         
         Returns:
             Tuple of (training_metrics, test_metrics)
         """
-        # Filter only labeled data
-        labeled_df = labeled_data[labeled_data['ml_label'].notna()].copy()
-        
-        if len(labeled_df) < 10:
-            logger.warning(f"Not enough labeled data for training: {len(labeled_df)} samples. Need at least 10.")
-            return {}, {}
-        
-        # If model exists and we have existing data, load it for incremental learning
-        if self.is_trained and self.model is not None and db is not None:
-            # Load existing labeled data from DB for incremental learning
-            existing_inspections = db.exec(
-                select(Inspection).where(Inspection.ml_label.isnot(None))
-            ).all()
+        with self._lock:
+            self.sync_with_registry()
+            base = self._bundle
             
-            if existing_inspections:
-                # Get all defect IDs at once
-                existing_inspection_ids = [i.inspection_id for i in existing_inspections if i.inspection_id]
-                existing_defects_map = {}
-                if existing_inspection_ids:
-                    all_defects = db.exec(
-                        select(Defect).where(Defect.inspection_id.in_(existing_inspection_ids))
-                    ).all()
-                    # Group defects by inspection_id
-                    for defect in all_defects:
-                        if defect.inspection_id not in existing_defects_map:
-                            existing_defects_map[defect.inspection_id] = []
-                        existing_defects_map[defect.inspection_id].append(defect)
-                
-                # Build DataFrame from existing data
-                existing_data = []
-                for insp in existing_inspections:
-                    defects = existing_defects_map.get(insp.inspection_id, [])
-                    defect_found = len(defects) > 0
-                    max_depth = max([d.depth for d in defects if d.depth is not None], default=None) if defects else None
-                    max_length = max([d.length for d in defects if d.length is not None], default=None) if defects else None
-                    max_width = max([d.width for d in defects if d.width is not None], default=None) if defects else None
-                    
-                    existing_data.append({
-                        'method': insp.method.value if insp.method else None,
-                        'temperature': insp.temperature,
-                        'humidity': insp.humidity,
-                        'illumination': insp.illumination,
-                        'param1': max_depth,
-                        'param2': max_length,
-                        'param3': max_width,
-                        'defect_found': defect_found,
-                        'quality_grade': insp.quality_grade.value if insp.quality_grade else None,
-                        'date': insp.date,
-                        'ml_label': insp.ml_label.value if insp.ml_label else None,
-                    })
-                
-                existing_df = pd.DataFrame(existing_data)
-                # Combine with new data
-                labeled_df = pd.concat([existing_df, labeled_df], ignore_index=True)
-        
-        X = self.prepare_features(labeled_df)
-        y = labeled_df['ml_label'].values
-        
-        # Encode labels
-        if self.label_encoder is None:
-            self.label_encoder = LabelEncoder()
-            y_encoded = self.label_encoder.fit_transform(y)
-        else:
-            y_encoded = self.label_encoder.transform(y)
-        
-        # Split data (80% train, 20% test)
-        split_idx = int(len(X) * 0.8)
-        X_train, X_test = X.iloc[:split_idx], X.iloc[split_idx:]
-        y_train, y_test = y_encoded[:split_idx], y_encoded[split_idx:]
-        
-        # Train or continue training model
-        if self.model is None or not self.is_trained:
-            # Initial training
-            num_classes = len(np.unique(y_encoded))
-            self.model = LGBMClassifier(
-                objective='multiclass',
-                num_class=num_classes,
-                n_estimators=100,
-                learning_rate=0.1,
-                max_depth=5,
-                random_state=42,
-                verbose=-1,
-            )
-            self.model.fit(
-                X_train,
-                y_train,
-                eval_set=[(X_test, y_test)],
-                callbacks=[lambda _: None],  # Suppress output
+            labeled = records[records['label'] >= 0]
+            
+            if len(labeled) < 10:
+                logger.warning(f"Not enough labeled data for training: {len(labeled)} samples. Need at least 10.")
+                return {}, {}
+            
+            if base is not None:
+                method_classes = base.method_classes
+                quality_grade_classes = base.quality_grade_classes
+            else:
+                method_classes = fit_categories(labeled['method'], METHODS)
+                quality_grade_classes = fit_categories(labeled['quality_grade'], QUALITY_GRADES)
+            X = build_feature_matrix(
+                labeled,
+                category_lookup(method_classes, METHODS),
+                category_lookup(quality_grade_classes, QUALITY_GRADES),
             )
-        else:
-            # Incremental learning - continue training on new data
-            # LightGBM supports incremental learning by using the existing model as init_model
-            try:
-                self.model.fit(
-                    X_train,
-                    y_train,
-                    eval_set=[(X_test, y_test)],
-                    callbacks=[lambda _: None],
-                    init_model=self.model.booster_,
-                )
-            except Exception as e:
-                logger.warning(f"Incremental learning failed, retraining from scratch: {e}")
-                # Retrain from scratch if incremental fails
-                num_classes = len(np.unique(y_encoded))
-                self.model = LGBMClassifier(
-                    objective='multiclass',
-                    num_class=num_classes,
-                    n_estimators=100,
-                    learning_rate=0.1,
-                    max_depth=5,
-                    random_state=42,
-                    verbose=-1,
-                )
-                self.model.fit(
+            y = np.array(LABELS, dtype=object)[labeled['label']]
+            
+            # Encode labels
+            if base is None:
+                label_encoder = LabelEncoder()
+                y_encoded = label_encoder.fit_transform(y)
+            else:
+                label_encoder = base.label_encoder()
+                y_encoded = label_encoder.transform(y)
+            
+            # Split data (80% train, 20% test)
+            split_idx = int(len(X) * 0.8)
+            X_train, X_test = X[:split_idx], X[split_idx:]
+            y_train, y_test = y_encoded[:split_idx], y_encoded[split_idx:]
+            
+            # Always a new estimator: the served one is not touched while fitting
+            num_classes = len(np.unique(y_encoded))
+            model = new_classifier(num_classes)
+            if base is None:
+                # Initial training
+                model.fit(
                     X_train,
                     y_train,
                     eval_set=[(X_test, y_test)],
-                    callbacks=[lambda _: None],
+                    callbacks=[lambda _: None],  # Suppress output
                 )
-        
-        # Evaluate on test set
-        y_pred = self.model.predict(X_test)
-        test_accuracy = accuracy_score(y_test, y_pred)
-        
-        # Get class names
-        class_names = self.label_encoder.classes_
-        test_report = classification_report(
-            y_test, y_pred, 
-            target_names=class_names, 
-            output_dict=True,
-            zero_division=0
-        )
-        
-        # Evaluate on training set
-        y_train_pred = self.model.predict(X_train)
-        train_accuracy = accuracy_score(y_train, y_train_pred)
-        train_report = classification_report(
-            y_train, y_train_pred,
-            target_names=class_names,
-            output_dict=True,
-            zero_division=0
-        )
-        
-        self.is_trained = True
+            else:
+                # Incremental learning - continue from the trees of the served model
+                try:
+                    model.fit(
+                        X_train,
+                        y_train,
+                        eval_set=[(X_test, y_test)],
+                        callbacks=[lambda _: None],
+                        init_model=base.model.booster_,
+                    )
+                except Exception as e:
+                    logger.warning(f"Incremental learning failed, retraining from scratch: {e}")
+                    # Retrain from scratch if incremental fails
+                    model = new_classifier(num_classes)
+                    model.fit(
+                        X_train,
+                        y_train,
+                        eval_set=[(X_test, y_test)],
+                        callbacks=[lambda _: None],
+                    )
+            
+            # Evaluate on test set
+            y_pred = model.predict(X_test)
+            test_accuracy = accuracy_score(y_test, y_pred)
+            
+            # Get class names
+            class_names = label_encoder.classes_
+            test_report = classification_report(
+                y_test, y_pred, 
+                target_names=class_names, 
+                output_dict=True,
+                zero_division=0
+            )
+            
+            # Evaluate on training set
+            y_train_pred = model.predict(X_train)
+            train_accuracy = accuracy_score(y_train, y_train_pred)
+            train_report = classification_report(
+                y_train, y_train_pred,
+                target_names=class_names,
+                output_dict=True,
+                zero_division=0
+            )
+            
+            # Swap in the new model (unsaved until save_version)
+            self._bundle = ModelBundle.create(model, method_classes, quality_grade_classes, class_names)
         
         training_metrics = {
             'accuracy': train_accuracy,
@@ -240,6 +277,12 @@ class MLService:
         }
         
         logger.info(f"Model trained: Train accuracy={train_accuracy:.4f}, Test accuracy={test_accuracy:.4f}")
+        event_bus.publish("ml.trained", {
+            'train_accuracy': train_accuracy,
+            'test_accuracy': test_accuracy,
+            'train_samples': len(X_train),
+            'test_samples': len(X_test),
+        })
         
         return training_metrics, test_metrics
     
@@ -262,93 +305,106 @@ class MLService:
             predicted_count=prediction_results.get('predicted', 0) if prediction_results else 0,
         )
         db.add(metrics)
+        db.flush()
+        if self.is_trained:
+            # Saved before the commit, so /ml/metrics never caches the row without its model_version
+            try:
+                self.save_version(metrics)
+            except Exception as e:
+                # The model keeps serving from memory; it is just not persisted
+                logger.error(f"Failed to save ML model version: {e}", exc_info=True)
+        bump_data_versions(db, tags=[ML_METRICS_TAG])
+        db.commit()
+        db.refresh(metrics)
+        event_bus.publish("ml.metrics_saved", {
+            'metric_id': metrics.metric_id,
+            'test_accuracy': metrics.test_accuracy,
+            'model_version': self.version,
+        })
+        return metrics
+
+    def record_predictions(self, db: Session, metrics: MLMetrics, prediction_results: dict) -> MLMetrics:
+        """Store the scoring run that followed a training on its metrics row"""
+        metrics.predicted_count = prediction_results.get('predicted', 0)
+        metrics.label_distribution = prediction_results.get('label_distribution', {})
+        db.add(metrics)
+        bump_data_versions(db, tags=[ML_METRICS_TAG])
         db.commit()
         db.refresh(metrics)
         return metrics
     
-    def predict_unlabeled(self, unlabeled_data: pd.DataFrame, db: Session) -> dict:
+    def save_version(self, metrics: MLMetrics) -> Optional[ModelVersion]:
+        """Persist the trained (unsaved) model to the registry, linked to its metrics row"""
+        with self._lock:
+            bundle = self._bundle
+            if bundle is None or bundle.version is not None:
+                return None
+            entry = model_registry.save(bundle.model, {
+                'metric_id': metrics.metric_id,
+                'feature_columns': FEATURE_COLUMNS,
+                'method_classes': list(bundle.method_classes),
+                'quality_grade_classes': list(bundle.quality_grade_classes),
+                'label_classes': list(bundle.label_classes),
+                'train_samples': metrics.train_samples,
+                'test_accuracy': metrics.test_accuracy,
+            })
+            self._bundle = bundle._replace(version=entry.version)
+        event_bus.publish("ml.model_saved", entry.model_dump(mode="json"))
+        return entry
+    
+    def load_version(self, version: int) -> ModelVersion:
+        """Serve a registry version instead of the current model"""
+        model, entry = model_registry.load(version)
+        if entry.feature_columns != FEATURE_COLUMNS:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Model version {version} was trained on different features: {entry.feature_columns}",
+            )
+        bundle = ModelBundle.create(
+            model, entry.method_classes, entry.quality_grade_classes, entry.label_classes, entry.version
+        )
+        with self._lock:
+            self._bundle = bundle
+        logger.info(f"Loaded ML model version {entry.version}")
+        return entry
+    
+    def sync_with_registry(self) -> None:
         """
-        Predict labels for unlabeled inspection data
-        
-        Args:
-            unlabeled_data: DataFrame with unlabeled inspection data (ml_label should be None)
-            db: Database session for updating predictions
-        
-        Returns:
-            Dictionary with prediction statistics
+        Load the active version if another process saved or activated a
+        different one. Skipped while this process trains (the caller keeps
+        the served model) and while its own training is not saved yet.
         """
-        if not self.is_trained or self.model is None:
-            return {'predicted': 0, 'error': 'Model not trained'}
-        
-        # Filter unlabeled data
-        unlabeled_df = unlabeled_data[unlabeled_data['ml_label'].isna()].copy()
-        
-        if len(unlabeled_df) == 0:
-            return {'predicted': 0, 'message': 'No unlabeled data found'}
-        
-        # Prepare features
-        X = self.prepare_features(unlabeled_df)
-        
-        # Get inspection IDs from the dataframe first
-        if 'inspection_id' not in unlabeled_df.columns:
-            logger.warning("inspection_id column not found in unlabeled data")
-            return {
-                'predicted': 0,
-                'total_unlabeled': len(unlabeled_df),
-                'error': 'inspection_id column missing',
-            }
-        
-        inspection_ids = unlabeled_df['inspection_id'].dropna().astype(int).tolist()
-        
-        if len(inspection_ids) == 0:
-            return {'predicted': 0, 'total_unlabeled': len(unlabeled_df), 'message': 'No valid inspection IDs'}
-        
-        if len(inspection_ids) != len(X):
-            logger.warning(f"Mismatch: {len(inspection_ids)} inspection IDs but {len(X)} feature rows")
-            # Align them
-            unlabeled_df_aligned = unlabeled_df[unlabeled_df['inspection_id'].notna()].copy()
-            inspection_ids = unlabeled_df_aligned['inspection_id'].astype(int).tolist()
-            X = self.prepare_features(unlabeled_df_aligned)
-        
-        # Predict
-        predictions_encoded = self.model.predict(X)
-        predictions = self.label_encoder.inverse_transform(predictions_encoded)
-        
-        # Batch update inspections - get all at once
-        predicted_count = 0
-        label_counts = {}
-        
-        # Get all inspections at once
-        inspections_to_update = db.exec(
-            select(Inspection).where(Inspection.inspection_id.in_(inspection_ids))
-        ).all()
-        
-        inspection_map = {insp.inspection_id: insp for insp in inspections_to_update}
-        
-        # Update predictions
-        for inspection_id, prediction in zip(inspection_ids, predictions):
-            if inspection_id not in inspection_map:
-                continue
-            
-            insp = inspection_map[inspection_id]
-            try:
-                ml_label = MLLabel(prediction)
-                insp.ml_label = ml_label
-                predicted_count += 1
-                label_counts[prediction] = label_counts.get(prediction, 0) + 1
-            except ValueError:
-                logger.warning(f"Invalid prediction: {prediction}")
-        
-        if predicted_count > 0:
-            db.commit()
-        
-        return {
-            'predicted': predicted_count,
-            'total_unlabeled': len(unlabeled_df),
-            'label_distribution': label_counts,
-        }
+        current = model_registry.current()
+        bundle = self._bundle
+        if current is None or (bundle is not None and bundle.version in (current, None)):
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._bundle is bundle:
+                self.load_version(current)
+        except Exception as e:
+            logger.error(f"Failed to load ML model version {current}: {e}")
+        finally:
+            self._lock.release()
+    
+    def activate_version(self, version: int) -> ModelVersion:
+        """Roll back (or forward) to a saved version in every process"""
+        with self._lock:
+            self.load_version(version)
+            entry = model_registry.activate(version)
+        event_bus.publish("ml.model_activated", entry.model_dump(mode="json"))
+        return entry
+    
+    def load_at_startup(self) -> Optional[ModelVersion]:
+        """Warm load ML_MODEL_VERSION if pinned, else the active version"""
+        if settings.ML_MODEL_VERSION is not None:
+            return self.activate_version(settings.ML_MODEL_VERSION)
+        current = model_registry.current()
+        if current is None:
+            return None
+        return self.load_version(current)
 
 
 # Global instance
 ml_service = MLService()
-
@@ -0,0 +1,156 @@
+"""
+Versioned store of trained ML models on local disk.
+
+Every training that is saved with metrics becomes a numbered version in
+ML_MODEL_DIR: `v0007/model.joblib` holds the fitted LightGBM classifier and
+`v0007/manifest.json` the feature schema, the category lists of the encoders,
+the label classes and the id of the MLMetrics row of that training. The file
+`CURRENT` names the active version, the one every API process serves; it is
+replaced atomically on save and rollback, so processes can compare it with
+the version they have loaded and reload when another process moved it.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import joblib
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the files of a version change shape; older versions are not loaded.
+# 2: categories are the normalized enum values of the feature store
+MODEL_FORMAT_VERSION = 2
+CURRENT_FILE = "CURRENT"
+MODEL_FILE = "model.joblib"
+MANIFEST_FILE = "manifest.json"
+
+
+class ModelVersion(BaseModel):
+    version: int
+    metric_id: Optional[int] = Field(None, description="MLMetrics row of the training")
+    created_at: datetime
+    format_version: int = MODEL_FORMAT_VERSION
+    feature_columns: List[str]
+    method_classes: List[str]
+    quality_grade_classes: List[str]
+    label_classes: List[str]
+    train_samples: int = 0
+    test_accuracy: float = 0.0
+    active: bool = False
+
+
+class ModelRegistry:
+    def __init__(self, directory: str, keep_versions: int):
+        self.directory = directory
+        self.keep_versions = keep_versions
+
+    def _version_dir(self, version: int) -> str:
+        return os.path.join(self.directory, f"v{version:04d}")
+
+    def _write_atomic(self, name: str, text: str) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+
+    def versions(self) -> List[int]:
+        """Numbers of the saved versions, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith("v") and name[1:].isdigit() and os.path.exists(
+                os.path.join(self.directory, name, MANIFEST_FILE)
+            ):
+                found.append(int(name[1:]))
+        return sorted(found)
+
+    def current(self) -> Optional[int]:
+        """The active version, or None before the first save"""
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def manifest(self, version: int) -> ModelVersion:
+        try:
+            with open(os.path.join(self._version_dir(version), MANIFEST_FILE)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail=f"Model version {version} not found")
+        return ModelVersion(**data, active=version == self.current())
+
+    def list(self) -> List[ModelVersion]:
+        """Saved versions, newest first"""
+        return [self.manifest(v) for v in reversed(self.versions())]
+
+    def save(self, model: Any, manifest: Dict[str, Any]) -> ModelVersion:
+        """
+        Store a fitted model with its manifest fields as the next version
+        and make it the active one.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+        try:
+            joblib.dump(model, os.path.join(staging, MODEL_FILE))
+            while True:
+                version = (self.versions() or [0])[-1] + 1
+                entry = ModelVersion(version=version, created_at=datetime.utcnow(), **manifest)
+                with open(os.path.join(staging, MANIFEST_FILE), "w") as f:
+                    f.write(entry.model_dump_json(exclude={"active"}, indent=2))
+                try:
+                    # Another process may have taken the number; renaming onto an existing directory fails
+                    os.rename(staging, self._version_dir(version))
+                    break
+                except OSError:
+                    if not os.path.exists(self._version_dir(version)):
+                        raise
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self._write_atomic(CURRENT_FILE, str(version))
+        self._prune()
+        logger.info(f"Saved ML model version {version}")
+        return entry.model_copy(update={"active": True})
+
+    def load(self, version: int):
+        """(fitted model, manifest) of a version"""
+        entry = self.manifest(version)
+        if entry.format_version != MODEL_FORMAT_VERSION:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Model version {version} has format {entry.format_version}, expected {MODEL_FORMAT_VERSION}",
+            )
+        model = joblib.load(os.path.join(self._version_dir(version), MODEL_FILE))
+        return model, entry
+
+    def activate(self, version: int) -> ModelVersion:
+        """Make a saved version the active one (rollback or pin)"""
+        self.manifest(version)
+        self._write_atomic(CURRENT_FILE, str(version))
+        return self.manifest(version)
+
+    def metric_versions(self) -> Dict[int, int]:
+        """MLMetrics id -> model version"""
+        return {m.metric_id: m.version for m in self.list() if m.metric_id is not None}
+
+    def _prune(self) -> None:
+        if self.keep_versions <= 0:
+            return
+        current = self.current()
+        # Keep the newest keep_versions besides the active one
+        old = [v for v in self.versions() if v != current]
+        for version in old[:max(0, len(old) - self.keep_versions)]:
+            shutil.rmtree(self._version_dir(version), ignore_errors=True)
+
+
+model_registry = ModelRegistry(settings.ML_MODEL_DIR, settings.ML_MODEL_KEEP_VERSIONS)
@@ -0,0 +1,156 @@
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional
+
+from sqlalchemy import and_, func
+from sqlmodel import select
+
+from app.models.object import Object
+from app.models.inspection import Inspection
+from app.models.defect import Defect
+
+
+def latest_inspections_subquery(
+    method=None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    object_ids: Optional[Iterable[int]] = None,
+):
+    """
+    Latest inspection per object as a subquery (one row per inspected object).
+
+    Optional filters are applied before ranking, so "latest" means the latest
+    inspection among the ones matching the filters.
+    """
+    ranked = select(
+        Inspection.inspection_id,
+        Inspection.object_id,
+        Inspection.date,
+        Inspection.method,
+        Inspection.quality_grade,
+        Inspection.ml_label,
+        func.row_number()
+        .over(
+            partition_by=Inspection.object_id,
+            order_by=(Inspection.date.desc(), Inspection.inspection_id.desc()),
+        )
+        .label("rn"),
+    )
+    if method is not None:
+        ranked = ranked.where(Inspection.method == method)
+    if date_from is not None:
+        ranked = ranked.where(Inspection.date >= date_from)
+    if date_to is not None:
+        ranked = ranked.where(Inspection.date <= date_to)
+    if object_ids is not None:
+        ranked = ranked.where(Inspection.object_id.in_(list(object_ids)))
+    ranked = ranked.subquery("ranked_inspections")
+
+    return (
+        select(
+            ranked.c.inspection_id,
+            ranked.c.object_id,
+            ranked.c.date,
+            ranked.c.method,
+            ranked.c.quality_grade,
+            ranked.c.ml_label,
+        )
+        .where(ranked.c.rn == 1)
+        .subquery("latest_inspections")
+    )
+
+
+def object_summary_stmt(
+    search: Optional[str] = None,
+    pipeline_id: Optional[str] = None,
+    latest=None,
+    depth_min: Optional[float] = None,
+    depth_max: Optional[float] = None,
+):
+    """
+    One row per (object, defect of its latest inspection), ordered by object.
+
+    Objects without inspections or without defects still produce one row with
+    NULLs, so consecutive rows can be folded with `iter_object_summaries`.
+    The depth range only narrows the joined defects, not the objects.
+    """
+    if latest is None:
+        latest = latest_inspections_subquery()
+
+    defect_join = Defect.inspection_id == latest.c.inspection_id
+    if depth_min is not None:
+        defect_join = and_(defect_join, Defect.depth >= depth_min)
+    if depth_max is not None:
+        defect_join = and_(defect_join, Defect.depth <= depth_max)
+
+    stmt = (
+        select(
+            Object.object_id,
+            Object.object_name,
+            Object.object_type,
+            Object.pipeline_id,
+            Object.lat,
+            Object.lon,
+            Object.year,
+            Object.material,
+            latest.c.inspection_id,
+            latest.c.date,
+            latest.c.method,
+            latest.c.quality_grade,
+            latest.c.ml_label,
+            Defect.defect_id,
+            Defect.defect_type,
+            Defect.depth,
+        )
+        .outerjoin(latest, latest.c.object_id == Object.object_id)
+        .outerjoin(Defect, defect_join)
+    )
+    if pipeline_id:
+        stmt = stmt.where(Object.pipeline_id == pipeline_id)
+    if search:
+        stmt = stmt.where(func.lower(Object.object_name).ilike(f"%{search.lower()}%"))
+    return stmt.order_by(Object.object_id, Defect.defect_id)
+
+
+def iter_object_summaries(rows: Iterable) -> Iterator[Dict]:
+    """Fold consecutive rows of `object_summary_stmt` into one dict per object."""
+    current = None
+    for row in rows:
+        if current is None or current["object_id"] != row.object_id:
+            if current is not None:
+                yield current
+            current = {
+                "object_id": row.object_id,
+                "object_name": row.object_name,
+                "object_type": row.object_type,
+                "pipeline_id": row.pipeline_id,
+                "lat": row.lat,
+                "lon": row.lon,
+                "year": row.year,
+                "material": row.material,
+                "inspection_id": row.inspection_id,
+                "date": row.date,
+                "method": row.method.value if row.method else None,
+                "quality_grade": row.quality_grade.value if row.quality_grade else None,
+                "ml_label": row.ml_label.value if row.ml_label else None,
+                "defects": [],
+            }
+        if row.defect_id is not None:
+            current["defects"].append(
+                {"defect_id": row.defect_id, "defect_type": row.defect_type, "depth": row.depth}
+            )
+    if current is not None:
+        yield current
+
+
+def match_defect_type(defects: list, defect_type: Optional[str]) -> list:
+    """Defects whose type contains `defect_type` (case-insensitive), all defects without a filter."""
+    if not defect_type:
+        return defects
+    needle = defect_type.lower()
+    return [d for d in defects if d["defect_type"] and needle in d["defect_type"].lower()]
+
+
+def object_status(summary: Dict, matched_defects: list) -> str:
+    if summary["inspection_id"] is None:
+        return "unknown"
+    return "defect" if matched_defects else "clean"
@@ -7,6 +7,7 @@ from sqlmodel import Session
 
 from app.models.object import Object
 from app.models.pipeline import Pipeline
+from app.services.data_version import OBJECTS_TAG, bump_data_versions
 from app.services.import_helpers import normalize_object_type
 
 
@@ -30,6 +31,7 @@ def import_objects(df: pd.DataFrame, db: Session, errors: list) -> tuple[int, in
         created_objects.append(Object(**i))
 
     db.add_all(created_objects)
+    bump_data_versions(db, pipelines, tags=[OBJECTS_TAG])
     try:
         db.commit()
     except Exception as exc:
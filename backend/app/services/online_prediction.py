@@ -0,0 +1,214 @@
+"""
+Online ML predictions with request micro-batching.
+
+POST /ml/predict scores feature records straight from the request, without
+an import. A LightGBM call costs about the same for one row as for a few
+hundred, so concurrent requests are not predicted one by one: each one
+queues its records and awaits a future. A worker task on the event loop
+takes the first waiting request, collects whatever else arrives within
+ML_PREDICT_BATCH_WINDOW_MS (up to ML_PREDICT_MAX_BATCH records), predicts
+the whole batch in the threadpool and hands every request its rows. While a
+batch is being predicted, the next one collects in the queue.
+
+Latency (queue wait plus prediction) of the last LATENCY_WINDOW requests is
+kept for /ml/predict/stats. Batcher and statistics are per process.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from app.core.config import settings
+from app.models.diagnostic import DiagnosticMethod, MLLabel, QualityGrade
+from app.services.feature_store import METHODS, NUMERIC_FIELDS, QUALITY_GRADES, empty_records
+from app.services.ml_service import MLService, ml_service
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 1000
+
+
+class PredictionInput(BaseModel):
+    method: DiagnosticMethod
+    temperature: Optional[float] = None
+    humidity: Optional[float] = None
+    illumination: Optional[float] = None
+    param1: Optional[float] = Field(None, description="Method-specific measurement, e.g. defect depth")
+    param2: Optional[float] = None
+    param3: Optional[float] = None
+    defect_found: bool = False
+    quality_grade: Optional[QualityGrade] = None
+
+
+class PredictRequest(BaseModel):
+    records: List[PredictionInput] = Field(..., min_length=1, max_length=10000)
+
+
+class PredictionOutput(BaseModel):
+    label: MLLabel
+    confidence: float = Field(..., description="Probability of the predicted label")
+    probabilities: Dict[str, float]
+
+
+class PredictResponse(BaseModel):
+    model_version: Optional[int] = Field(None, description="Model registry version that predicted")
+    predictions: List[PredictionOutput]
+
+
+class PredictionStats(BaseModel):
+    requests: int = 0
+    records: int = 0
+    batches: int = 0
+    failed: int = 0
+    mean_batch_records: float = 0.0
+    latency_p50_ms: Optional[float] = Field(None, description="Over the last LATENCY_WINDOW requests")
+    latency_p99_ms: Optional[float] = None
+    window_ms: float
+    max_batch: int
+
+
+_METHOD_CODES = {value: code for code, value in enumerate(METHODS)}
+_QUALITY_GRADE_CODES = {value: code for code, value in enumerate(QUALITY_GRADES)}
+
+
+def records_from_inputs(inputs: List[PredictionInput]) -> np.ndarray:
+    """Feature records of the inputs (built directly: a DataFrame costs more than predicting small batches)"""
+    records = empty_records(len(inputs))
+    records['method'] = [_METHOD_CODES[item.method.value] for item in inputs]
+    records['quality_grade'] = [
+        _QUALITY_GRADE_CODES[item.quality_grade.value] if item.quality_grade else -1 for item in inputs
+    ]
+    records['defect_found'] = [item.defect_found for item in inputs]
+    for name in NUMERIC_FIELDS:
+        records[name] = [np.nan if getattr(item, name) is None else getattr(item, name) for item in inputs]
+    return records
+
+
+class PredictionBatcher:
+    def __init__(self, service: MLService, window_seconds: float, max_batch: int):
+        self.service = service
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stats_lock = threading.Lock()
+        self._latencies: "deque[float]" = deque(maxlen=LATENCY_WINDOW)
+        self._requests = self._records = self._batches = self._failed = 0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # First request, or a new event loop (the queue belongs to the old one)
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        return self._queue
+
+    async def predict(self, records: np.ndarray) -> Tuple[PredictResponse, float]:
+        """Predictions for the records, and how long the request waited for them (seconds)"""
+        queue = self._ensure_worker()
+        started = time.perf_counter()
+        future = self._loop.create_future()
+        await queue.put((records, future))
+        try:
+            response = await future
+        except Exception:
+            with self._stats_lock:
+                self._failed += 1
+            raise
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self._requests += 1
+            self._records += len(records)
+            self._latencies.append(elapsed)
+        return response, elapsed
+
+    async def _collect(self, queue: asyncio.Queue) -> List[Tuple[np.ndarray, asyncio.Future]]:
+        """The next request plus whatever arrives within the batch window"""
+        batch = [await queue.get()]
+        size = len(batch[0][0])
+        deadline = self._loop.time() + self.window_seconds
+        while size < self.max_batch:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = await self._collect(queue)
+            records = np.concatenate([item[0] for item in batch])
+            try:
+                labels, probabilities, classes, version = await self._loop.run_in_executor(
+                    None, self._predict_batch, records
+                )
+                outputs = [
+                    PredictionOutput(
+                        label=MLLabel(label),
+                        confidence=round(float(row.max()), 6),
+                        probabilities={name: round(float(p), 6) for name, p in zip(classes, row)},
+                    )
+                    for label, row in zip(labels, probabilities)
+                ]
+            except Exception as e:
+                if not isinstance(e, HTTPException):
+                    logger.error(f"Online prediction failed: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            with self._stats_lock:
+                self._batches += 1
+
+            offset = 0
+            for item_records, future in batch:
+                stop = offset + len(item_records)
+                if not future.done():
+                    future.set_result(PredictResponse(model_version=version, predictions=outputs[offset:stop]))
+                offset = stop
+
+    def _predict_batch(self, records: np.ndarray):
+        self.service.sync_with_registry()
+        bundle = self.service.bundle
+        if bundle is None:
+            raise HTTPException(status_code=503, detail="Model not trained")
+        labels, probabilities, classes = bundle.predict_records(records)
+        return labels, probabilities, classes, bundle.version
+
+    def stats(self) -> PredictionStats:
+        with self._stats_lock:
+            latencies = np.array(self._latencies) * 1000
+            stats = PredictionStats(
+                requests=self._requests,
+                records=self._records,
+                batches=self._batches,
+                failed=self._failed,
+                mean_batch_records=round(self._records / self._batches, 2) if self._batches else 0.0,
+                window_ms=self.window_seconds * 1000,
+                max_batch=self.max_batch,
+            )
+        if len(latencies):
+            stats.latency_p50_ms = round(float(np.percentile(latencies, 50)), 3)
+            stats.latency_p99_ms = round(float(np.percentile(latencies, 99)), 3)
+        return stats
+
+
+prediction_batcher = PredictionBatcher(
+    ml_service,
+    settings.ML_PREDICT_BATCH_WINDOW_MS / 1000,
+    settings.ML_PREDICT_MAX_BATCH,
+)
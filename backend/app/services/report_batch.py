@@ -0,0 +1,130 @@
+"""
+PDF reports for many pipelines in one ZIP archive.
+
+Reports are rendered by report_jobs on the process pool with one job per
+worker in flight, and added to the archive in the order they finish, so
+cached reports go out first and slow ones do not hold up the rest. The
+archive is streamed: entries are stored uncompressed (PDF pages are already
+compressed) and sent while they are written, so neither the archive nor a
+whole PDF is held in memory. Pipelines whose report failed are listed in
+errors.txt at the end of the archive.
+"""
+import io
+import re
+import time
+import zipfile
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlmodel import Session, select
+
+from app.models.object import Object
+from app.services.report_jobs import pipeline_report_key, report_jobs
+
+ARCHIVE_CHUNK = 64 * 1024
+# Wait this long before retrying when other clients' jobs fill the queue
+BUSY_RETRY_SECONDS = 1.0
+
+# progress(pipeline_id, status, finished, total); status is "done" or "failed"
+BatchProgressCallback = Callable[[str, str, int, int], None]
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only stream that hands what zipfile wrote so far to the response"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def archive_name(pipeline_id: str) -> str:
+    return "Report_" + re.sub(r"[^\w.-]+", "_", pipeline_id.strip()) + ".pdf"
+
+
+def plan_report_batch(db: Session, pipeline_ids: Optional[List[str]] = None,
+                      registry_mode: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    (pipeline_id, report cache key) for the requested pipelines, or for all
+    of them. Unknown pipelines are a 404, so a typo does not cost a render.
+    """
+    if pipeline_ids:
+        seen: Dict[str, str] = {}
+        for pipeline_id in pipeline_ids:
+            seen.setdefault(pipeline_id.strip().lower(), pipeline_id.strip())
+        requested = list(seen.values())
+    else:
+        requested = sorted(
+            p for p in db.exec(select(Object.pipeline_id).distinct()).all() if p
+        )
+    if not requested:
+        raise HTTPException(status_code=404, detail="No pipelines to report on")
+    return [(p, pipeline_report_key(db, p, registry_mode=registry_mode)) for p in requested]
+
+
+def iter_report_archive(
+    plan: List[Tuple[str, str]],
+    registry_mode: Optional[str] = None,
+    progress: Optional[BatchProgressCallback] = None,
+) -> Iterator[bytes]:
+    """ZIP archive of the planned reports, as chunks of bytes"""
+    report = progress or (lambda pipeline_id, status, finished, total: None)
+    window = report_jobs.max_workers
+    queue = deque(plan)
+    in_flight: Dict[str, str] = {}
+    errors: List[str] = []
+    finished = 0
+    sink = _ZipSink()
+
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        while queue or in_flight:
+            while queue and len(in_flight) < window:
+                pipeline_id, key = queue[0]
+                try:
+                    job = report_jobs.submit(pipeline_id, key, registry_mode=registry_mode)
+                except HTTPException as e:
+                    if e.status_code != 429:
+                        raise
+                    if not in_flight:
+                        time.sleep(BUSY_RETRY_SECONDS)
+                    break
+                queue.popleft()
+                in_flight[job.job_id] = pipeline_id
+            if not in_flight:
+                continue
+
+            for job_id in report_jobs.wait_any(list(in_flight)):
+                pipeline_id = in_flight.pop(job_id)
+                finished += 1
+                try:
+                    pdf = report_jobs.open(job_id)
+                except HTTPException as e:
+                    errors.append(f"{pipeline_id}: {e.detail}")
+                    report(pipeline_id, "failed", finished, len(plan))
+                    continue
+                report_jobs.release(job_id)
+                info = zipfile.ZipInfo(archive_name(pipeline_id), date_time=time.localtime()[:6])
+                with pdf, archive.open(info, "w") as entry:
+                    while True:
+                        chunk = pdf.read(ARCHIVE_CHUNK)
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+                        yield sink.drain()
+                report(pipeline_id, "done", finished, len(plan))
+                yield sink.drain()
+
+        if errors:
+            archive.writestr("errors.txt", "\n".join(errors) + "\n")
+    yield sink.drain()
@@ -0,0 +1,138 @@
+"""
+On-disk cache of generated PDF reports.
+
+A report is identified by its content key: the pipeline, that pipeline's
+data version, a hash of the submitted map image, the template version and
+the registry settings. The same key always means the same bytes, so the key
+doubles as the ETag. Files live in REPORT_CACHE_DIR. When the directory
+grows past REPORT_CACHE_MAX_BYTES, the least recently served reports are
+evicted (every hit refreshes the file's mtime).
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Dict, Iterable, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".pdf"
+
+
+def report_cache_key(
+    pipeline_id: str,
+    pipeline_versions: Dict[str, int],
+    map_image_hash: Optional[str],
+    template_version: str,
+    registry: str,
+) -> str:
+    versions = ",".join(f"{scope}={pipeline_versions[scope]}" for scope in sorted(pipeline_versions))
+    raw = f"{pipeline_id}|{versions}|{map_image_hash or '-'}|{template_version}|{registry}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ReportCache:
+    def __init__(self, directory: str, max_bytes: int, suffix: str = SUFFIX):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _count(self, field: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[field] += n
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """Open the cached report for reading, or None on a miss"""
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return f
+
+    def store(self, key: str, render: Callable[[BinaryIO], None]) -> BinaryIO:
+        """
+        Render into a temp file next to the cache and publish it atomically,
+        then return the stored report opened for reading.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                render(tmp)
+            path = self.path(key)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        # Open before evicting so our own file stays readable even if it is evicted
+        f = open(path, "rb")
+        self.evict()
+        return f
+
+    def _entries(self) -> Iterable[os.DirEntry]:
+        try:
+            return [e for e in os.scandir(self.directory) if e.name.endswith(self.suffix)]
+        except FileNotFoundError:
+            return []
+
+    def evict(self) -> int:
+        """Drop least recently used reports until the cache fits in max_bytes"""
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            self._count("evictions", evicted)
+            logger.info(f"Cache in {self.directory} evicted {evicted} files")
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        entries = self._entries()
+        with self._lock:
+            stats = dict(self._stats)
+        stats["entries"] = len(entries)
+        stats["bytes"] = sum(e.stat().st_size for e in entries)
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+report_cache = ReportCache(
+    settings.REPORT_CACHE_DIR or os.path.join(tempfile.gettempdir(), "promtech-reports"),
+    settings.REPORT_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,190 @@
+"""
+Data layer for pipeline reports.
+
+Defects come from a single Defect-Inspection-Object join ordered by
+defect_id. They are streamed in chunks, and severity is binned one chunk at
+a time with numpy, so memory does not grow with the size of the registry.
+The summary KPIs are one SQL aggregate that uses the same depth thresholds.
+"""
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import case, func
+from sqlmodel import Session, select
+
+from app.core.database import stream_rows
+from app.models.defect import Defect
+from app.models.inspection import Inspection
+from app.models.object import Object
+
+# Depth at which severity 2, 3, 4 and 5 start; shallower or unknown depth is 1
+SEVERITY_DEPTH_THRESHOLDS = (1.0, 2.0, 3.0, 5.0)
+CRITICAL_SEVERITY = 4
+# Mock kilometre mark: defects are laid out every KM_STEP along the registry
+KM_STEP = 0.5
+DEFECT_CHUNK_SIZE = 5000
+
+
+class ReportSummary(BaseModel):
+    total_defects: int
+    avg_severity: float
+    critical: int
+    by_severity: Dict[int, int]
+
+
+def _pipeline_filter(pipeline_id: str):
+    return func.lower(Object.pipeline_id) == pipeline_id.strip().lower()
+
+
+def severity_from_depth(depths: np.ndarray) -> np.ndarray:
+    """Severity 1-5 for an array of depths (NaN for unknown)"""
+    return np.digitize(np.nan_to_num(depths, nan=0.0), SEVERITY_DEPTH_THRESHOLDS) + 1
+
+
+def _severity_expr():
+    depth = func.coalesce(Defect.depth, 0)
+    thresholds = list(enumerate(SEVERITY_DEPTH_THRESHOLDS, start=2))
+    return case(*[(depth >= limit, severity) for severity, limit in reversed(thresholds)], else_=1)
+
+
+def resolve_pipeline_ids(db: Session, pipeline_id: str) -> List[str]:
+    """Stored pipeline IDs matching `pipeline_id` case-insensitively (404 when none)"""
+    ids = db.exec(select(Object.pipeline_id).where(_pipeline_filter(pipeline_id)).distinct()).all()
+    if not ids:
+        raise HTTPException(status_code=404, detail=f"No objects found for pipeline '{pipeline_id}'")
+    return sorted(ids)
+
+
+def load_report_objects(db: Session, pipeline_id: str) -> List[Object]:
+    objects = db.exec(select(Object).where(_pipeline_filter(pipeline_id)).order_by(Object.object_id)).all()
+    if not objects:
+        raise HTTPException(status_code=404, detail=f"No objects found for pipeline '{pipeline_id}'")
+    return list(objects)
+
+
+def count_report_objects(db: Session, pipeline_id: str) -> int:
+    count = db.exec(select(func.count(Object.object_id)).where(_pipeline_filter(pipeline_id))).one()
+    if not count:
+        raise HTTPException(status_code=404, detail=f"No objects found for pipeline '{pipeline_id}'")
+    return count
+
+
+def report_summary(db: Session, pipeline_id: str) -> ReportSummary:
+    severity = _severity_expr().label("severity")
+    rows = db.exec(
+        select(severity, func.count(Defect.defect_id))
+        .join(Inspection, Inspection.inspection_id == Defect.inspection_id)
+        .join(Object, Object.object_id == Inspection.object_id)
+        .where(_pipeline_filter(pipeline_id))
+        .group_by(severity)
+    ).all()
+    by_severity = {level: 0 for level in range(1, len(SEVERITY_DEPTH_THRESHOLDS) + 2)}
+    by_severity.update({int(level): count for level, count in rows})
+    total = sum(by_severity.values())
+    return ReportSummary(
+        total_defects=total,
+        avg_severity=sum(level * count for level, count in by_severity.items()) / total if total else 0.0,
+        critical=sum(count for level, count in by_severity.items() if level >= CRITICAL_SEVERITY),
+        by_severity=by_severity,
+    )
+
+
+def report_type_breakdown(db: Session, pipeline_id: str) -> List[Dict]:
+    """Defect counts per type and severity, most frequent type first"""
+    severity = _severity_expr().label("severity")
+    defect_type = func.coalesce(Defect.defect_type, "General").label("defect_type")
+    rows = db.exec(
+        select(defect_type, severity, func.count(Defect.defect_id))
+        .join(Inspection, Inspection.inspection_id == Defect.inspection_id)
+        .join(Object, Object.object_id == Inspection.object_id)
+        .where(_pipeline_filter(pipeline_id))
+        .group_by(defect_type, severity)
+    ).all()
+    by_type: Dict[str, Dict[int, int]] = {}
+    for name, level, count in rows:
+        by_type.setdefault(name, {})[int(level)] = count
+    return [
+        {"type": name, "by_severity": counts}
+        for name, counts in sorted(by_type.items(), key=lambda item: (-sum(item[1].values()), item[0]))
+    ]
+
+
+def object_defect_severity(db: Session, pipeline_id: str) -> Dict[int, Tuple[int, int]]:
+    """Defect count and worst severity per object of the pipeline (objects with defects only)"""
+    rows = db.exec(
+        select(Object.object_id, func.count(Defect.defect_id), func.max(_severity_expr()))
+        .join(Inspection, Inspection.object_id == Object.object_id)
+        .join(Defect, Defect.inspection_id == Inspection.inspection_id)
+        .where(_pipeline_filter(pipeline_id))
+        .group_by(Object.object_id)
+    ).all()
+    return {object_id: (count, int(severity)) for object_id, count, severity in rows}
+
+
+def report_defects_stmt(pipeline_id: str):
+    return (
+        select(
+            Defect.defect_id,
+            Defect.defect_type,
+            Defect.depth,
+            Defect.length,
+            Defect.width,
+            Inspection.date,
+            Inspection.method,
+            Object.object_id,
+            Object.object_name,
+            Object.lat,
+            Object.lon,
+        )
+        .join(Inspection, Inspection.inspection_id == Defect.inspection_id)
+        .join(Object, Object.object_id == Inspection.object_id)
+        .where(_pipeline_filter(pipeline_id))
+        .order_by(Defect.defect_id)
+    )
+
+
+def _defect_chunk(rows: list, start: int) -> List[Dict]:
+    depths = np.array([row.depth for row in rows], dtype=float)
+    severities = severity_from_depth(depths)
+    return [
+        {
+            "id": f"D-{row.defect_id:03d}",
+            "km_mark": (start + i) * KM_STEP,
+            "type": row.defect_type or "General",
+            "severity": int(severity),
+            "coords": (float(row.lat or 0.0), float(row.lon or 0.0)),
+            "depth": row.depth,
+            "length": row.length,
+            "width": row.width,
+            "inspection_date": row.date,
+            "method": row.method.value,
+            "object_id": row.object_id,
+            "object_name": row.object_name,
+        }
+        for i, (row, severity) in enumerate(zip(rows, severities))
+    ]
+
+
+def iter_report_defect_chunks(pipeline_id: str, chunk_size: int = DEFECT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """
+    Defect rows of the pipeline in defect_id order, `chunk_size` at a time.
+
+    Reads through `stream_rows`, so it can outlive the request session.
+    """
+    chunk = []
+    position = 1
+    for row in stream_rows(report_defects_stmt(pipeline_id), chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield _defect_chunk(chunk, position)
+            position += len(chunk)
+            chunk = []
+    if chunk:
+        yield _defect_chunk(chunk, position)
+
+
+def iter_report_defects(pipeline_id: str, chunk_size: int = DEFECT_CHUNK_SIZE) -> Iterator[Dict]:
+    for chunk in iter_report_defect_chunks(pipeline_id, chunk_size):
+        yield from chunk
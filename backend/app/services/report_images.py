@@ -0,0 +1,146 @@
+"""
+Map screenshots submitted with report requests.
+
+Images are stored by the SHA-256 of the uploaded bytes, so the same
+screenshot sent twice (as multipart upload or base64 JSON) is prepared once
+and yields the same report cache key. Preparing means fitting the image into
+the map area of the page: JPEGs are decoded at reduced scale with
+`draft`, large images are shrunk by whole factors with `reduce` before the
+final LANCZOS pass, and images that already fit are stored as uploaded,
+without re-encoding.
+
+The cache may evict an image at any time (right away when
+REPORT_MAP_CACHE_MAX_BYTES is 0), so a request holds its own link to the
+prepared file (`MapImage.path`) and a report job pins another one for as
+long as it is queued or rendering; workers read that pinned file.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from typing import BinaryIO, Optional
+from uuid import uuid4
+
+from PIL import Image as PILImage
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.services.report_cache import ReportCache, report_cache
+
+logger = logging.getLogger(__name__)
+
+# 170 x 200 mm map area at 150 dpi, the resolution of report_map
+MAX_IMAGE_SIZE = (1004, 1181)
+PASSTHROUGH_FORMATS = ("PNG", "JPEG")
+READ_CHUNK = 64 * 1024
+HELD_DIR = os.path.join(tempfile.gettempdir(), "promtech-map-images")
+
+map_images = ReportCache(
+    os.path.join(report_cache.directory, "maps"),
+    settings.REPORT_MAP_CACHE_MAX_BYTES,
+    suffix=".img",
+)
+
+
+class MapImage(BaseModel):
+    digest: str
+    # Link to the prepared image owned by the request; see release_map_image
+    path: str
+
+
+def _digest(src: BinaryIO) -> str:
+    sha = hashlib.sha256()
+    while True:
+        chunk = src.read(READ_CHUNK)
+        if not chunk:
+            break
+        sha.update(chunk)
+    src.seek(0)
+    return sha.hexdigest()
+
+
+def _prepare(src: BinaryIO, out: BinaryIO) -> None:
+    with PILImage.open(src) as img:
+        if img.width <= MAX_IMAGE_SIZE[0] and img.height <= MAX_IMAGE_SIZE[1] and img.format in PASSTHROUGH_FORMATS:
+            src.seek(0)
+            shutil.copyfileobj(src, out, READ_CHUNK)
+            return
+        source_format = img.format
+        # JPEG only: let the decoder scale by 1/2, 1/4 or 1/8 while decoding
+        img.draft("RGB", MAX_IMAGE_SIZE)
+        factor = min(img.width // MAX_IMAGE_SIZE[0], img.height // MAX_IMAGE_SIZE[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+        img.thumbnail(MAX_IMAGE_SIZE, PILImage.Resampling.LANCZOS)
+        if source_format == "JPEG":
+            img.save(out, format="JPEG", quality=90)
+        else:
+            img.save(out, format="PNG")
+
+
+def _hold(f: BinaryIO, name: str) -> str:
+    """Link the file open in `f` into HELD_DIR as `name`, or copy it if the link fails (e.g. evicted meanwhile)"""
+    os.makedirs(HELD_DIR, exist_ok=True)
+    held = os.path.join(HELD_DIR, name)
+    try:
+        os.link(f.name, held)
+    except OSError:
+        f.seek(0)
+        with open(held, "wb") as out:
+            shutil.copyfileobj(f, out, READ_CHUNK)
+    return held
+
+
+def store_map_image(src: BinaryIO) -> Optional[MapImage]:
+    """
+    Prepare the image in the binary file `src` and return it, or None if it
+    is not an image PIL can read. The caller releases it with
+    release_map_image once the report is served or its job submitted.
+    """
+    digest = _digest(src)
+    cached = map_images.open(digest)
+    if cached is None:
+        try:
+            cached = map_images.store(digest, lambda out: _prepare(src, out))
+        except (OSError, SyntaxError, ValueError, PILImage.DecompressionBombError) as e:
+            logger.warning(f"Ignoring map image that could not be read: {e}")
+            return None
+    # The open handle stays readable even if the cache has evicted the file
+    with cached:
+        return MapImage(digest=digest, path=_hold(cached, f"{uuid4().hex}.img"))
+
+
+def store_map_image_base64(map_image: Optional[str]) -> Optional[MapImage]:
+    """`store_map_image` for the base64 string of the JSON request body"""
+    if not map_image:
+        return None
+    # Добавляем padding если нужно (base64 должен быть кратен 4)
+    map_image += "=" * (-len(map_image) % 4)
+    try:
+        data = base64.b64decode(map_image, validate=True)
+    except binascii.Error as e:
+        logger.warning(f"Ignoring map image that is not valid base64: {e}")
+        return None
+    return store_map_image(BytesIO(data))
+
+
+def pin_map_image(image: Optional[MapImage], job_id: str) -> Optional[str]:
+    """A link to the image owned by a report job, removed with unpin_map_image when the job ends"""
+    if image is None:
+        return None
+    with open(image.path, "rb") as f:
+        return _hold(f, f"job-{job_id}.img")
+
+
+def unpin_map_image(path: Optional[str]) -> None:
+    if path is not None and os.path.exists(path):
+        os.unlink(path)
+
+
+def release_map_image(image: Optional[MapImage]) -> None:
+    if image is not None:
+        unpin_map_image(image.path)
@@ -0,0 +1,338 @@
+"""
+PDF report jobs on a process pool.
+
+ReportLab layout and image resizing are CPU-bound. Rendering runs in worker
+processes, so it neither holds the GIL of the API process nor occupies more
+than REPORT_WORKERS cores. At most REPORT_MAX_PENDING_JOBS jobs can be queued
+or running; beyond that, submit answers 429. A finished report lands in the
+report cache (or, with the cache disabled, in a per-job file) and is served
+from there. Job state lives in the API process and is kept for
+REPORT_JOB_TTL_SECONDS after a job finishes.
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.events import event_bus
+from app.services.data_version import get_data_versions, pipeline_scope
+from app.services.report_cache import report_cache, report_cache_key
+from app.services.report_data import resolve_pipeline_ids
+from app.services.report_images import MapImage, pin_map_image, unpin_map_image
+from app.services.report_pdf import (
+    REPORT_TEMPLATE_VERSION,
+    get_custom_styles,
+    registry_cache_tag,
+    render_pipeline_report,
+)
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.path.join(tempfile.gettempdir(), "promtech-report-jobs")
+FINISHED = ("done", "failed")
+
+
+class ReportJob(BaseModel):
+    job_id: str
+    pipeline_id: str
+    status: str = Field(..., description="queued, running, done or failed")
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    size: Optional[int] = Field(None, description="Size of the finished PDF in bytes")
+    error: Optional[str] = None
+
+
+def pipeline_report_key(db: Session, pipeline_id: str, map_image_hash: Optional[str] = None,
+                        registry_mode: Optional[str] = None) -> str:
+    """
+    Report cache key of the pipeline's current data (404 for unknown
+    pipelines). `map_image_hash` is the digest from report_images.
+    """
+    pipeline_ids = resolve_pipeline_ids(db, pipeline_id)
+    versions = get_data_versions(db, [pipeline_scope(p) for p in pipeline_ids])
+    return report_cache_key(
+        pipeline_id.strip(),
+        versions,
+        map_image_hash,
+        REPORT_TEMPLATE_VERSION,
+        registry_cache_tag(registry_mode),
+    )
+
+
+class ReportJobError(Exception):
+    """Error raised in a worker, reduced to what survives pickling back to the API process"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+    def __str__(self) -> str:
+        return self.detail
+
+
+def _render_job(pipeline_id: str, map_path: Optional[str], registry_mode: Optional[str],
+                key: Optional[str], path: str) -> int:
+    """Runs in a worker process: render the report to `path` and return its size"""
+    try:
+        return _render_to(pipeline_id, map_path, registry_mode, key, path)
+    except HTTPException as e:
+        raise ReportJobError(e.status_code, str(e.detail)) from None
+    except Exception as e:
+        logger.exception(f"Report rendering failed for {pipeline_id}")
+        raise ReportJobError(500, f"{type(e).__name__}: {e}") from None
+
+
+def _warm_worker() -> None:
+    # Styles are shared by every report the worker renders; build them before the first job
+    get_custom_styles()
+
+
+def _render_to(pipeline_id: str, map_path: Optional[str], registry_mode: Optional[str],
+               key: Optional[str], path: str) -> int:
+    with Session(engine) as db:
+        def render(out):
+            render_pipeline_report(db, pipeline_id, out, map_path, registry_mode)
+
+        if key is not None:
+            with report_cache.store(key, render) as f:
+                return os.fstat(f.fileno()).st_size
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as out:
+                render(out)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return os.path.getsize(path)
+
+
+class ReportJobManager:
+    def __init__(self, max_workers: Optional[int], max_pending: int, ttl_seconds: int):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        # Re-entrant: a done callback runs inline if the future already finished
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, ReportJob] = {}
+        self._futures: Dict[str, Future] = {}
+        self._paths: Dict[str, str] = {}
+        # Map images pinned for the jobs still queued or rendering
+        self._map_paths: Dict[str, str] = {}
+        # Cache key -> job still rendering it, so identical requests share one render
+        self._active_keys: Dict[str, str] = {}
+        self._finished_at: Dict[str, float] = {}
+        self._done: Dict[str, threading.Event] = {}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process with running threads is unsafe, and Windows has nothing else
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+        return self._executor
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.ttl_seconds
+        for job_id, finished in list(self._finished_at.items()):
+            if finished < cutoff:
+                self._forget(job_id)
+
+    def _forget(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        self._futures.pop(job_id, None)
+        self._finished_at.pop(job_id, None)
+        self._done.pop(job_id, None)
+        unpin_map_image(self._map_paths.pop(job_id, None))
+        path = self._paths.pop(job_id, None)
+        # Cached reports belong to the cache and are evicted there
+        if path and path.startswith(JOBS_DIR) and os.path.exists(path):
+            os.unlink(path)
+
+    def _pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status not in FINISHED)
+
+    def submit(self, pipeline_id: str, key: str, map_image: Optional[MapImage] = None,
+               registry_mode: Optional[str] = None) -> ReportJob:
+        """
+        Queue a report for rendering. `key` is the report cache key: a report
+        that is already cached finishes immediately, and one that is being
+        rendered is shared with the job already rendering it. The map image
+        is pinned for the job; the caller still releases its own.
+        """
+        with self._lock:
+            self._prune()
+            use_cache = report_cache.enabled
+            if use_cache and key in self._active_keys:
+                return self._status(self._active_keys[key])
+
+            job_id = uuid4().hex
+            job = ReportJob(job_id=job_id, pipeline_id=pipeline_id, status="queued", created_at=datetime.utcnow())
+            path = report_cache.path(key) if use_cache else os.path.join(JOBS_DIR, job_id + ".pdf")
+            self._jobs[job_id] = job
+            self._paths[job_id] = path
+
+            if use_cache and os.path.exists(path):
+                job.status = "done"
+                job.size = os.path.getsize(path)
+                job.finished_at = datetime.utcnow()
+                self._finished_at[job_id] = time.monotonic()
+                return job.model_copy()
+
+            if self._pending() > self.max_pending:
+                self._forget(job_id)
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Too many report jobs in progress ({self.max_pending}), retry later",
+                    headers={"Retry-After": "5"},
+                )
+
+            map_path = pin_map_image(map_image, job_id)
+            if map_path is not None:
+                self._map_paths[job_id] = map_path
+            args = (_render_job, pipeline_id, map_path, registry_mode, key if use_cache else None, path)
+            try:
+                future = self._pool().submit(*args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool
+                logger.warning("Report worker pool is broken, restarting it")
+                self._executor = None
+                future = self._pool().submit(*args)
+            self._futures[job_id] = future
+            self._done[job_id] = threading.Event()
+            if use_cache:
+                self._active_keys[key] = job_id
+            future.add_done_callback(lambda f: self._finish(job_id, key, f))
+            return job.model_copy()
+
+    def _finish(self, job_id: str, key: str, future: Future) -> None:
+        with self._lock:
+            if self._active_keys.get(key) == job_id:
+                del self._active_keys[key]
+            unpin_map_image(self._map_paths.pop(job_id, None))
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.finished_at = datetime.utcnow()
+            self._finished_at[job_id] = time.monotonic()
+            exc = None if future.cancelled() else future.exception()
+            if future.cancelled() or exc is not None:
+                job.status = "failed"
+                job.error = "Cancelled" if exc is None else str(exc) or type(exc).__name__
+                logger.error(f"Report job {job_id} for {job.pipeline_id} failed: {job.error}")
+            else:
+                job.status = "done"
+                job.size = future.result()
+            event = job.model_dump(mode="json")
+            self._done[job_id].set()
+            self._changed.notify_all()
+        event_bus.publish(f"report.{'finished' if event['status'] == 'done' else 'failed'}", event)
+
+    def _status(self, job_id: str) -> ReportJob:
+        job = self._jobs[job_id]
+        future = self._futures.get(job_id)
+        if job.status == "queued" and future is not None and future.running():
+            job.status = "running"
+        return job.model_copy()
+
+    def get(self, job_id: str) -> ReportJob:
+        with self._lock:
+            if job_id not in self._jobs:
+                raise HTTPException(status_code=404, detail="Report job not found")
+            return self._status(job_id)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> ReportJob:
+        """Block until the job finishes (re-raises the worker's error)"""
+        with self._lock:
+            future = self._futures.get(job_id)
+            done = self._done.get(job_id)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except ReportJobError as e:
+                raise HTTPException(status_code=e.status_code, detail=e.detail)
+            finally:
+                # Job state is updated by the done callback, which may still be running
+                done.wait(timeout)
+        return self.get(job_id)
+
+    def wait_any(self, job_ids: List[str], timeout: Optional[float] = None) -> List[str]:
+        """Block until at least one of the jobs has finished; return the finished ones"""
+        def finished() -> List[str]:
+            return [j for j in job_ids if j not in self._jobs or self._jobs[j].status in FINISHED]
+
+        with self._changed:
+            self._changed.wait_for(finished, timeout)
+            return finished()
+
+    def open(self, job_id: str) -> BinaryIO:
+        """The finished report of the job, opened for reading"""
+        job = self.get(job_id)
+        if job.status == "failed":
+            raise HTTPException(status_code=500, detail=f"Report job failed: {job.error}")
+        if job.status != "done":
+            raise HTTPException(status_code=409, detail=f"Report job is {job.status}")
+        with self._lock:
+            path = self._paths[job_id]
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            raise HTTPException(status_code=410, detail="Report expired from the cache, submit the job again")
+
+    def run(self, pipeline_id: str, key: str, map_image: Optional[MapImage] = None,
+            registry_mode: Optional[str] = None) -> BinaryIO:
+        """Render on the pool and wait: the blocking form of submit + open"""
+        job = self.submit(pipeline_id, key, map_image, registry_mode)
+        self.wait(job.job_id)
+        report = self.open(job.job_id)
+        self.release(job.job_id)
+        return report
+
+    def release(self, job_id: str) -> None:
+        """
+        Drop a job whose report has been opened and will not be downloaded
+        again. Open handles keep the file readable; cached reports stay cached.
+        """
+        if not report_cache.enabled:
+            with self._lock:
+                self._forget(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job_id in self._jobs:
+                counts[self._status(job_id).status] += 1
+        return {"workers": self.max_workers, "max_pending": self.max_pending, **counts}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+report_jobs = ReportJobManager(
+    settings.REPORT_WORKERS,
+    settings.REPORT_MAX_PENDING_JOBS,
+    settings.REPORT_JOB_TTL_SECONDS,
+)
@@ -0,0 +1,226 @@
+"""
+Offline map for pipeline reports.
+
+Object coordinates are projected with Web Mercator and drawn straight into a
+PIL image at report resolution: a lat/lon grid, the pipeline polyline, one
+marker per object (coloured by its worst defect severity, sized by defect
+count), a legend and a scale bar. No tiles, browser or network are needed.
+Rendered maps are cached per pipeline and data version.
+"""
+import io
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from sqlmodel import Session
+
+from app.core.cache import TTLCache
+from app.models.object import Object
+from app.services.data_version import get_data_versions, pipeline_scope
+from app.services.report_data import CRITICAL_SEVERITY, object_defect_severity
+
+MAP_RENDER_VERSION = "1"
+# Printed at A4 text width (170 mm) and 120 mm high, 150 dpi
+MAP_SIZE = (1004, 709)
+# Drawn this many times larger and downsampled, since ImageDraw does not antialias
+SUPERSAMPLE = 2
+PADDING = 60
+
+EARTH_CIRCUMFERENCE_M = 40075016.686
+MAX_LATITUDE = 85.05112878
+# Span shown around a single object (or objects at one point)
+MIN_SPAN_M = 1000.0
+
+BACKGROUND = "#F4F6F7"
+GRID = "#D5DBDB"
+GRID_LABEL = "#95A5A6"
+PIPELINE = "#2C3E50"
+TEXT = "#2C3E50"
+NO_DEFECTS = "#3498DB"
+# Same grouping and colours as the severity cells of the defects registry
+SEVERITY_LEGEND = [
+    ("Severity 1-2", "#F1C40F"),
+    ("Severity 3", "#E67E22"),
+    (f"Severity {CRITICAL_SEVERITY}+", "#E74C3C"),
+]
+
+_map_cache = TTLCache(maxsize=32, ttl=24 * 3600)
+
+
+def mercator(lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Web Mercator world coordinates in [0, 1], y growing southwards"""
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    x = (lon + 180.0) / 360.0
+    sin_lat = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def inverse_mercator(x: float, y: float) -> Tuple[float, float]:
+    lon = x * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return lat, lon
+
+
+def nice_step(span: float, target: int = 5) -> float:
+    """1, 2 or 5 times a power of ten, giving about `target` steps over `span`"""
+    raw = span / target
+    power = 10 ** math.floor(math.log10(raw))
+    for multiple in (1, 2, 5, 10):
+        if raw <= multiple * power:
+            return multiple * power
+    return 10 * power
+
+
+def _severity_color(severity: int) -> str:
+    if severity >= CRITICAL_SEVERITY:
+        return SEVERITY_LEGEND[2][1]
+    if severity == 3:
+        return SEVERITY_LEGEND[1][1]
+    return SEVERITY_LEGEND[0][1]
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1: fixed-size bitmap font only
+        return ImageFont.load_default()
+
+
+class _Viewport:
+    """Maps world coordinates onto the image, fitting the points with a uniform scale"""
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, width: int, height: int, padding: int):
+        center_lat, _ = inverse_mercator(0.0, float((y.min() + y.max()) / 2))
+        min_span = MIN_SPAN_M / (EARTH_CIRCUMFERENCE_M * math.cos(math.radians(center_lat)))
+        span_x = max(float(x.max() - x.min()), min_span)
+        span_y = max(float(y.max() - y.min()), min_span)
+        self.scale = min((width - 2 * padding) / span_x, (height - 2 * padding) / span_y)
+        self.cx = float(x.min() + x.max()) / 2
+        self.cy = float(y.min() + y.max()) / 2
+        self.width = width
+        self.height = height
+        self.center_lat = center_lat
+
+    def to_pixels(self, x, y):
+        return (x - self.cx) * self.scale + self.width / 2, (y - self.cy) * self.scale + self.height / 2
+
+    def to_world(self, px: float, py: float) -> Tuple[float, float]:
+        return (px - self.width / 2) / self.scale + self.cx, (py - self.height / 2) / self.scale + self.cy
+
+    def metres_per_pixel(self) -> float:
+        return EARTH_CIRCUMFERENCE_M * math.cos(math.radians(self.center_lat)) / self.scale
+
+
+def _draw_grid(draw: ImageDraw.ImageDraw, view: _Viewport, k: int, font) -> None:
+    north, west = inverse_mercator(*view.to_world(0, 0))
+    south, east = inverse_mercator(*view.to_world(view.width, view.height))
+    step = nice_step(max(east - west, north - south), target=8)
+    decimals = max(0, -math.floor(math.log10(step)))
+    for i in range(math.ceil(west / step), math.floor(east / step) + 1):
+        lon = i * step
+        px, _ = view.to_pixels(*mercator(np.array(0.0), np.array(lon)))
+        draw.line([(px, 0), (px, view.height)], fill=GRID, width=k)
+        draw.text((px + 3 * k, 3 * k), f"{lon:.{decimals}f}°", fill=GRID_LABEL, font=font)
+    for i in range(math.ceil(south / step), math.floor(north / step) + 1):
+        lat = i * step
+        _, py = view.to_pixels(*mercator(np.array(lat), np.array(0.0)))
+        draw.line([(0, py), (view.width, py)], fill=GRID, width=k)
+        draw.text((3 * k, py + 2 * k), f"{lat:.{decimals}f}°", fill=GRID_LABEL, font=font)
+
+
+def _draw_scale_bar(draw: ImageDraw.ImageDraw, view: _Viewport, k: int, font) -> None:
+    # Longest 1, 2 or 5 times a power of ten that fits in a quarter of the width
+    available = view.metres_per_pixel() * view.width / 4
+    power = 10 ** math.floor(math.log10(available))
+    metres = max(m * power for m in (1, 2, 5) if m * power <= available)
+    length = metres / view.metres_per_pixel()
+    x0 = view.width - 20 * k - length
+    y0 = view.height - 20 * k
+    draw.line([(x0, y0), (x0 + length, y0)], fill=TEXT, width=3 * k)
+    for x in (x0, x0 + length):
+        draw.line([(x, y0 - 5 * k), (x, y0 + 1 * k)], fill=TEXT, width=2 * k)
+    label = f"{metres / 1000:g} km" if metres >= 1000 else f"{metres:g} m"
+    draw.text((x0 + length / 2, y0 - 8 * k), label, fill=TEXT, font=font, anchor="ms")
+
+
+def _draw_legend(draw: ImageDraw.ImageDraw, view_height: int, k: int, font) -> None:
+    entries = [("No defects", NO_DEFECTS)] + SEVERITY_LEGEND
+    row = 18 * k
+    x0, y0 = 12 * k, view_height - 12 * k - row * len(entries) - 8 * k
+    draw.rectangle([x0, y0, x0 + 130 * k, y0 + row * len(entries) + 8 * k], fill="white", outline=GRID, width=k)
+    for i, (label, color) in enumerate(entries):
+        cy = y0 + 4 * k + row * i + row / 2
+        draw.ellipse([x0 + 8 * k, cy - 5 * k, x0 + 18 * k, cy + 5 * k], fill=color, outline="white")
+        draw.text((x0 + 26 * k, cy), label, fill=TEXT, font=font, anchor="lm")
+
+
+def draw_pipeline_map(
+    points: Sequence[Tuple[float, float]],
+    markers: Sequence[Tuple[int, int]],
+    size: Tuple[int, int] = MAP_SIZE,
+) -> bytes:
+    """
+    PNG of the pipeline. `points` are (lat, lon) in pipeline order and
+    `markers` the matching (defect count, worst severity) per point.
+    """
+    k = SUPERSAMPLE
+    width, height = size[0] * k, size[1] * k
+    lat = np.array([p[0] for p in points], dtype=float)
+    lon = np.array([p[1] for p in points], dtype=float)
+    x, y = mercator(lat, lon)
+    view = _Viewport(x, y, width, height, PADDING * k)
+    px, py = view.to_pixels(x, y)
+
+    img = Image.new("RGB", (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(img)
+    small = _font(11 * k)
+    _draw_grid(draw, view, k, small)
+
+    if len(points) > 1:
+        draw.line(list(zip(px.tolist(), py.tolist())), fill=PIPELINE, width=3 * k, joint="curve")
+
+    # Defect-free objects first, then by severity, so the worst end up on top
+    order = sorted(range(len(points)), key=lambda i: (markers[i][0] > 0, markers[i][1]))
+    for i in order:
+        count, severity = markers[i]
+        if count:
+            radius = min(5 + 2 * math.log2(1 + count), 14) * k
+            color = _severity_color(severity)
+        else:
+            radius = 4 * k
+            color = NO_DEFECTS
+        draw.ellipse([px[i] - radius, py[i] - radius, px[i] + radius, py[i] + radius],
+                     fill=color, outline="white", width=k)
+
+    font = _font(12 * k)
+    _draw_legend(draw, height, k, font)
+    _draw_scale_bar(draw, view, k, font)
+
+    img = img.resize(size, Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+
+def render_pipeline_map(db: Session, pipeline_id: str, objects: List[Object]) -> Optional[io.BytesIO]:
+    """Map of the pipeline's objects as PNG, or None when none has coordinates"""
+    # 0/0 is how missing coordinates end up in imported data
+    located = [obj for obj in objects if obj.lat and obj.lon]
+    if not located:
+        return None
+
+    pipeline_ids = sorted({obj.pipeline_id for obj in objects})
+    versions = get_data_versions(db, [pipeline_scope(p) for p in pipeline_ids])
+    key = (tuple(pipeline_ids), tuple(sorted(versions.items())), MAP_RENDER_VERSION)
+    png = _map_cache.get(key)
+    if png is None:
+        severity: Dict[int, Tuple[int, int]] = object_defect_severity(db, pipeline_id)
+        png = draw_pipeline_map(
+            [(float(obj.lat), float(obj.lon)) for obj in located],
+            [severity.get(obj.object_id, (0, 0)) for obj in located],
+        )
+        _map_cache.set(key, png)
+    return io.BytesIO(png)
@@ -0,0 +1,428 @@
+"""
+PDF rendering for pipeline reports.
+
+The defect registry is laid out as page-sized tables with fixed row heights
+and fed to ReportLab one chunk at a time, so flowables and table layout
+never hold more than a page of rows. The document is written straight to a
+file (see report_jobs, which renders on a process pool). ReportLab still
+keeps each finished page's content until the document is saved, so a "full"
+registry grows by roughly 20 KB per page. Registries above
+REPORT_MAX_REGISTRY_ROWS are therefore capped or summarised by default
+(REPORT_REGISTRY_MODE). Without a map screenshot from the client, the site
+map is drawn offline by report_map.
+"""
+from contextlib import closing
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.enums import TA_CENTER
+from reportlab.pdfgen import canvas as pdf_canvas
+from reportlab.platypus import (
+    BaseDocTemplate,
+    Paragraph,
+    Spacer,
+    Table,
+    TableStyle,
+    PageBreak,
+    Frame,
+    PageTemplate,
+    NextPageTemplate,
+    Image
+)
+from reportlab.graphics.shapes import Drawing, Rect, String
+from PIL import Image as PILImage
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.models.object import Object
+from app.services.report_data import (
+    ReportSummary,
+    iter_report_defects,
+    load_report_objects,
+    report_summary,
+    report_type_breakdown,
+)
+from app.services.report_map import render_pipeline_map
+
+
+class ReportTheme:
+    PRIMARY = colors.HexColor("#2C3E50")  
+    ACCENT = colors.HexColor("#3498DB")     
+    LIGHT_BG = colors.HexColor("#ECF0F1")  
+    DANGER = colors.HexColor("#E74C3C")     
+    WARNING = colors.HexColor("#F1C40F")  
+    TEXT_MAIN = colors.HexColor("#2C3E50")
+    TEXT_LIGHT = colors.white
+
+def draw_header_footer(canvas, doc):
+    """Рисует шапку и подвал на каждой странице"""
+    canvas.saveState()
+    
+    canvas.setFillColor(ReportTheme.PRIMARY)
+    canvas.rect(0, A4[1] - 20*mm, A4[0], 20*mm, fill=1, stroke=0)
+    
+    canvas.setFont("Helvetica-Bold", 10)
+    canvas.setFillColor(colors.white)
+    canvas.drawString(20*mm, A4[1] - 13*mm, "PIPELINE INSPECTION SYSTEM")
+    
+    canvas.setFont("Helvetica", 9)
+    canvas.drawRightString(A4[0] - 20*mm, A4[1] - 13*mm, f"Generated: {datetime.now().strftime('%Y-%m-%d')}")
+
+    canvas.setStrokeColor(ReportTheme.ACCENT)
+    canvas.setLineWidth(1)
+    canvas.line(20*mm, 15*mm, A4[0]-20*mm, 15*mm)
+    
+    canvas.setFont("Helvetica", 8)
+    canvas.setFillColor(colors.gray)
+    page_num = canvas.getPageNumber()
+    canvas.drawCentredString(A4[0]/2, 10*mm, f"Page {page_num}")
+    
+    canvas.restoreState()
+
+def draw_cover_page(canvas, doc):
+    """Специальный дизайн для первой страницы (Титульник)"""
+    canvas.saveState()
+    
+    canvas.setFillColor(ReportTheme.PRIMARY)
+    canvas.rect(0, 0, A4[0], A4[1], fill=1, stroke=0)
+    
+    canvas.setFillColor(ReportTheme.ACCENT)
+    canvas.rect(0, 0, A4[0], 60*mm, fill=1, stroke=0)
+    
+    canvas.restoreState()
+
+
+@lru_cache(maxsize=1)
+def get_custom_styles():
+    """Built once per process and shared by every report it renders"""
+    styles = getSampleStyleSheet()
+    
+    styles.add(ParagraphStyle(
+        name='SectionHeader',
+        parent=styles['Heading2'],
+        fontSize=14,
+        leading=18,
+        textColor=ReportTheme.PRIMARY,
+        spaceBefore=15,
+        spaceAfter=10,
+        borderPadding=(0, 0, 5, 0), 
+        borderWidth=1,
+        borderColor=colors.white, 
+        fontName="Helvetica-Bold"
+    ))
+    
+    styles.add(ParagraphStyle(
+        name='NormalText',
+        parent=styles['Normal'],
+        fontSize=10,
+        leading=14,
+        textColor=colors.HexColor("#444444")
+    ))
+    
+    styles.add(ParagraphStyle(
+        name='CoverTitle',
+        fontName="Helvetica-Bold",
+        fontSize=32,
+        leading=40,
+        textColor=colors.white,
+        alignment=TA_CENTER,
+        spaceBefore=100*mm
+    ))
+    
+    styles.add(ParagraphStyle(
+        name='CoverSubTitle',
+        fontName="Helvetica",
+        fontSize=16,
+        leading=20,
+        textColor=colors.lightgrey,
+        alignment=TA_CENTER,
+        spaceBefore=10
+    ))
+
+    return styles
+
+def build_cover(meta: Dict, styles) -> List:
+    story = []
+    pipeline_name = meta.get('pipeline_id', 'Unknown Pipeline')
+    
+    story.append(Paragraph("INSPECTION REPORT", styles["CoverTitle"]))
+    story.append(Paragraph(f"Pipeline Object: {pipeline_name}", styles["CoverSubTitle"]))
+    story.append(Spacer(1, 20*mm))
+    story.append(Paragraph("Confidential Document", styles["CoverSubTitle"]))
+    
+    story.append(NextPageTemplate('NormalPage'))
+    story.append(PageBreak())
+    return story
+
+def build_general_stats(summary: ReportSummary, styles) -> List:
+    story = []
+    total = summary.total_defects
+    avg_severity = summary.avg_severity
+    critical = summary.critical
+
+    story.append(Paragraph("Executive Summary", styles["SectionHeader"]))
+    
+    kpi_data = [[
+        f"{total}\nTotal Defects",
+        f"{avg_severity:.1f}\nAvg Severity",
+        f"{critical}\nCRITICAL"
+    ]]
+    
+    kpi_table = Table(kpi_data, colWidths=[50*mm, 50*mm, 50*mm])
+    kpi_table.setStyle(TableStyle([
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('FONTNAME', (0,0), (-1,-1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0,0), (-1,-1), 12),
+        ('TEXTCOLOR', (0,0), (1,0), ReportTheme.PRIMARY), 
+        ('TEXTCOLOR', (2,0), (2,0), ReportTheme.DANGER), 
+        ('BOX', (0,0), (0,0), 1, ReportTheme.LIGHT_BG),
+        ('BOX', (1,0), (1,0), 1, ReportTheme.LIGHT_BG),
+        ('BOX', (2,0), (2,0), 2, ReportTheme.DANGER),    
+        ('TOPPADDING', (0,0), (-1,-1), 10),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 10),
+        ('BACKGROUND', (0,0), (-1,-1), colors.white),
+    ]))
+    
+    story.append(kpi_table)
+    story.append(Spacer(1, 10*mm))
+    return story
+
+# Bump when the layout changes so cached reports are rebuilt
+REPORT_TEMPLATE_VERSION = "3"
+
+REGISTRY_HEADER = ["ID", "KM Mark", "Type", "Severity", "Coordinates"]
+REGISTRY_COL_WIDTHS = [30*mm, 30*mm, 40*mm, 20*mm, 50*mm]
+REGISTRY_ROW_HEIGHT = 20
+# Usable frame height of a normal page, minus frame padding
+_FRAME_HEIGHT = A4[1] - 40*mm - 20*mm - 12
+ROWS_PER_PAGE = int(_FRAME_HEIGHT // REGISTRY_ROW_HEIGHT) - 1
+# The registry's first page also holds the section header
+FIRST_PAGE_ROWS = ROWS_PER_PAGE - 3
+
+REGISTRY_TABLE_STYLE = [
+    ('BACKGROUND', (0, 0), (-1, 0), ReportTheme.PRIMARY),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor("#e0e0e0")),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, ReportTheme.LIGHT_BG]),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+]
+
+
+def _registry_table(defects: List[Dict]) -> Table:
+    data = [REGISTRY_HEADER]
+    style_cmds = list(REGISTRY_TABLE_STYLE)
+    for i, d in enumerate(defects, start=1):
+        coords = f"{d['coords'][0]:.4f}, {d['coords'][1]:.4f}"
+        data.append([d["id"], f"{d['km_mark']:.2f}", d["type"], str(d["severity"]), coords])
+
+        if d["severity"] >= 4:
+            style_cmds.append(('BACKGROUND', (3, i), (3, i), ReportTheme.DANGER))
+            style_cmds.append(('TEXTCOLOR', (3, i), (3, i), colors.white))
+            style_cmds.append(('FONTNAME', (3, i), (3, i), 'Helvetica-Bold'))
+        elif d["severity"] == 3:
+            style_cmds.append(('BACKGROUND', (3, i), (3, i), ReportTheme.WARNING))
+
+    t = Table(data, colWidths=REGISTRY_COL_WIDTHS, rowHeights=REGISTRY_ROW_HEIGHT, repeatRows=1)
+    t.setStyle(TableStyle(style_cmds))
+    return t
+
+
+def build_defects_table(defects: Iterable[Dict], styles, note: Optional[str] = None) -> Iterator[List]:
+    """
+    Defects registry as batches of flowables, one page-sized table each.
+
+    Rows are pulled from `defects` lazily, so only one page of them is
+    held at a time.
+    """
+    header = [PageBreak(), Paragraph("Defects Registry", styles["SectionHeader"])]
+    if note:
+        header.append(Paragraph(note, styles["NormalText"]))
+        header.append(Spacer(1, 5))
+
+    page_rows = FIRST_PAGE_ROWS - (2 if note else 0)
+    page: List[Dict] = []
+    for d in defects:
+        page.append(d)
+        if len(page) == page_rows:
+            yield header + [_registry_table(page)]
+            # Every chunk fills its page, so each table starts a fresh one
+            header = [PageBreak()]
+            page = []
+            page_rows = ROWS_PER_PAGE
+    if page:
+        yield header + [_registry_table(page)]
+    elif len(header) > 1:
+        yield header
+
+
+def build_defects_summary(breakdown: List[Dict], summary: ReportSummary, styles) -> List:
+    """Defect counts by type and severity, used instead of the registry for huge pipelines"""
+    story = [PageBreak(), Paragraph("Defects by Type and Severity", styles["SectionHeader"])]
+    story.append(Paragraph(
+        f"The registry has {summary.total_defects} defects, above the limit of "
+        f"{settings.REPORT_MAX_REGISTRY_ROWS} rows for a full listing.",
+        styles["NormalText"],
+    ))
+    story.append(Spacer(1, 5))
+
+    levels = sorted(summary.by_severity)
+    data = [["Type"] + [f"S{level}" for level in levels] + ["Total"]]
+    for row in breakdown:
+        counts = [row["by_severity"].get(level, 0) for level in levels]
+        data.append([row["type"]] + [str(c) for c in counts] + [str(sum(counts))])
+    data.append(["Total"] + [str(summary.by_severity[level]) for level in levels] + [str(summary.total_defects)])
+
+    t = Table(data, colWidths=[50*mm] + [18*mm] * len(levels) + [25*mm], repeatRows=1)
+    t.setStyle(TableStyle(REGISTRY_TABLE_STYLE + [
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    story.append(t)
+    return story
+
+
+def build_site_map(objects: List[Object], pipeline_id: str, styles, map_image: Union[str, BinaryIO, None] = None) -> List:
+    """Секция карты: присланный снимок (путь или файл), карта из report_map или placeholder"""
+    story = []
+    story.append(Paragraph("Visual Inspection Map", styles["SectionHeader"]))
+    
+    if map_image:
+        # Сохраняем пропорции изображения в пределах 170 x 200 мм
+        with PILImage.open(map_image) as probe:
+            img_width, img_height = probe.size
+        if hasattr(map_image, "seek"):
+            map_image.seek(0)
+        width = A4[0] - 40*mm
+        height = width * img_height / img_width
+        if height > 200*mm:
+            width, height = width * 200*mm / height, 200*mm
+        img = Image(map_image, width=width, height=height)
+        story.append(img)
+        story.append(Spacer(1, 5))
+        story.append(Paragraph("Map showing pipeline objects and detected defects.", styles["NormalText"]))
+    else:
+        # Fallback на placeholder (нет координат)
+        drawing = Drawing(400, 150)
+        rect = Rect(0, 0, 450, 150)
+        rect.strokeColor = colors.gray
+        rect.strokeDashArray = [4, 2]
+        rect.fillColor = colors.HexColor("#f9f9f9")
+        drawing.add(rect)
+        
+        text = String(225, 75, "MAP VISUALIZATION AREA", textAnchor="middle")
+        text.fontName = "Helvetica-Bold"
+        text.fillColor = colors.gray
+        drawing.add(text)
+        
+        story.append(drawing)
+        story.append(Spacer(1, 10))
+        story.append(Paragraph("Note: Map data is generated based on sensor telemetry.", styles["NormalText"]))
+    
+    story.append(Spacer(1, 10*mm))
+    return story
+
+
+class StreamingDocTemplate(BaseDocTemplate):
+    """
+    Document template that lays out batches of flowables as they are produced.
+
+    `build` needs the whole story as one list. `build_batches` pulls one batch
+    at a time from an iterator and frees it once it is placed. Single pass
+    only: no table of contents or other multi-build flowables. Unlike
+    SimpleDocTemplate, it keeps the current page template (NormalPage with
+    header and footer) on every page after the cover.
+    """
+
+    def build_batches(self, batches: Iterable[List], canvasmaker=pdf_canvas.Canvas):
+        self._startBuild(None, canvasmaker)
+        canv = self.canv
+        self._savedInfo = canv._doc.info
+        try:
+            canv._doctemplate = self
+            for flowables in batches:
+                flowables = list(flowables)
+                while flowables:
+                    self.clean_hanging()
+                    self.handle_flowable(flowables)
+        finally:
+            del canv._doctemplate
+        canv._doc.info = self._savedInfo
+        self._endBuild()
+
+
+def registry_cache_tag(mode: Optional[str] = None) -> str:
+    """Registry settings that change the rendered output, for cache keys"""
+    return f"{mode or settings.REPORT_REGISTRY_MODE}:{settings.REPORT_MAX_REGISTRY_ROWS}"
+
+
+def resolve_registry_mode(total_defects: int, mode: Optional[str] = None) -> str:
+    """"full", "capped" or "summary" for a registry of this size"""
+    mode = mode or settings.REPORT_REGISTRY_MODE
+    if mode == "full" or total_defects <= settings.REPORT_MAX_REGISTRY_ROWS:
+        return "full"
+    return mode
+
+
+def render_pipeline_report(
+    db: Session,
+    pipeline_id: str,
+    out,
+    map_image: Union[str, BinaryIO, None] = None,
+    registry_mode: Optional[str] = None,
+) -> None:
+    """
+    Write the PDF report of the pipeline to the binary file object `out`.
+    `map_image` is a prepared screenshot (see report_images).
+    """
+    objects = load_report_objects(db, pipeline_id)
+    summary = report_summary(db, pipeline_id)
+    meta = {"pipeline_id": pipeline_id, "object_count": len(objects)}
+
+    doc = StreamingDocTemplate(out, pagesize=A4,
+                               rightMargin=20*mm, leftMargin=20*mm,
+                               topMargin=20*mm, bottomMargin=20*mm,
+                               pageCompression=1)
+    frame_normal = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height - 20*mm, id='normal')
+    frame_cover = Frame(0, 0, A4[0], A4[1], id='cover') # На весь лист
+
+    template_cover = PageTemplate(id='CoverPage', frames=frame_cover, onPage=draw_cover_page)
+    template_normal = PageTemplate(id='NormalPage', frames=frame_normal, onPage=draw_header_footer)
+
+    doc.addPageTemplates([template_cover, template_normal])
+
+    styles = get_custom_styles()
+
+    def batches():
+        story = []
+        story += build_cover(meta, styles)
+        story += build_general_stats(summary, styles)
+        # Без присланного снимка рисуем карту сами
+        story += build_site_map(objects, pipeline_id, styles, map_image or render_pipeline_map(db, pipeline_id, objects))
+        yield story
+
+        mode = resolve_registry_mode(summary.total_defects, registry_mode)
+        if mode == "summary":
+            yield build_defects_summary(report_type_breakdown(db, pipeline_id), summary, styles)
+            return
+
+        # islice stops short of the end, so the cursor is closed here rather than when the generator is collected
+        with closing(iter_report_defects(pipeline_id)) as rows:
+            defects, note = rows, None
+            if mode == "capped":
+                limit = settings.REPORT_MAX_REGISTRY_ROWS
+                defects = islice(rows, limit)
+                note = f"Showing the first {limit} of {summary.total_defects} defects."
+            yield from build_defects_table(defects, styles, note)
+
+    doc.build_batches(batches())
@@ -0,0 +1,166 @@
+"""
+Risk ranking of objects with defects.
+
+An object's risk is the criticality of its latest inspection, its defect
+count and its deepest defect. With the default weights the ranking is
+lexicographic over those three. Other weights blend them into one score,
+and the three criteria then only break ties on that score.
+
+Unfiltered rankings read `object_risk_rollups`. When a method or date range
+is set, the same columns are computed live, with a window function picking
+the latest matching inspection. Either way the database sorts and pages, so
+only one page of rows leaves it.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, literal
+from sqlmodel import Session, select
+from pydantic import BaseModel
+
+from app.models.dashboard_rollup import ObjectRiskRollup
+from app.models.defect import Defect
+from app.models.inspection import Inspection
+from app.models.object import Object
+from app.services.dashboard_rollups import CRITICALITY_SCORE, criticality_score_expr
+from app.services.object_queries import latest_inspections_subquery
+
+CRITICALITY_BY_SCORE = {score: label for label, score in CRITICALITY_SCORE.items()}
+
+
+class RiskWeights(BaseModel):
+    criticality: float = 1.0
+    defect_count: float = 0.0
+    max_depth: float = 0.0
+
+
+DEFAULT_WEIGHTS = RiskWeights()
+
+
+class RiskEntry(BaseModel):
+    rank: int
+    object_id: int
+    object_name: str
+    pipeline_id: Optional[str]
+    criticality: Optional[str]
+    defect_count: int
+    max_depth: Optional[float]
+    score: float
+
+
+def _rollup_source(pipeline_id: Optional[str]):
+    stmt = select(
+        ObjectRiskRollup.object_id,
+        Object.object_name,
+        ObjectRiskRollup.pipeline_id,
+        ObjectRiskRollup.crit_score,
+        ObjectRiskRollup.defect_count,
+        ObjectRiskRollup.max_depth,
+    ).join(Object, Object.object_id == ObjectRiskRollup.object_id)
+    if pipeline_id:
+        stmt = stmt.where(ObjectRiskRollup.pipeline_id == pipeline_id)
+    return stmt.subquery("risks")
+
+
+def _live_source(
+    pipeline_id: Optional[str],
+    method=None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    defects = (
+        select(
+            Inspection.object_id,
+            func.count(Defect.defect_id).label("defect_count"),
+            func.max(Defect.depth).label("max_depth"),
+        )
+        .join(Defect, Defect.inspection_id == Inspection.inspection_id)
+        .group_by(Inspection.object_id)
+    )
+    if method is not None:
+        defects = defects.where(Inspection.method == method)
+    if date_from is not None:
+        defects = defects.where(Inspection.date >= date_from)
+    if date_to is not None:
+        defects = defects.where(Inspection.date <= date_to)
+    defects = defects.subquery("object_defects")
+    latest = latest_inspections_subquery(method=method, date_from=date_from, date_to=date_to)
+
+    stmt = (
+        select(
+            defects.c.object_id,
+            Object.object_name,
+            Object.pipeline_id,
+            criticality_score_expr(latest.c.ml_label).label("crit_score"),
+            defects.c.defect_count,
+            defects.c.max_depth,
+        )
+        .join(Object, Object.object_id == defects.c.object_id)
+        .join(latest, latest.c.object_id == defects.c.object_id)
+    )
+    if pipeline_id:
+        stmt = stmt.where(Object.pipeline_id == pipeline_id)
+    return stmt.subquery("risks")
+
+
+def rank_risks(
+    db: Session,
+    page: int = 1,
+    size: int = 5,
+    pipeline_id: Optional[str] = None,
+    weights: RiskWeights = DEFAULT_WEIGHTS,
+    method=None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    with_total: bool = True,
+) -> Tuple[List[RiskEntry], Optional[int]]:
+    """
+    One page of objects ranked by risk, highest first, and the number of
+    ranked objects (None when `with_total` is False).
+
+    `date_to` is inclusive. The top K is page 1 with size K.
+    """
+    if method is None and date_from is None and date_to is None:
+        risks = _rollup_source(pipeline_id)
+    else:
+        risks = _live_source(pipeline_id, method, date_from, date_to)
+
+    depth = func.coalesce(risks.c.max_depth, 0)
+    score = (
+        literal(weights.criticality) * risks.c.crit_score
+        + literal(weights.defect_count) * risks.c.defect_count
+        + literal(weights.max_depth) * depth
+    ).label("score")
+
+    offset = (page - 1) * size
+    rows = db.exec(
+        select(risks, score)
+        .order_by(
+            score.desc(),
+            risks.c.crit_score.desc(),
+            risks.c.defect_count.desc(),
+            depth.desc(),
+            risks.c.object_id,
+        )
+        .offset(offset)
+        .limit(size)
+    ).all()
+
+    total = None
+    if with_total:
+        total = db.exec(select(func.count()).select_from(risks)).one()
+
+    entries = [
+        RiskEntry(
+            rank=offset + i + 1,
+            object_id=row.object_id,
+            object_name=row.object_name,
+            pipeline_id=row.pipeline_id,
+            criticality=CRITICALITY_BY_SCORE.get(row.crit_score),
+            defect_count=row.defect_count,
+            max_depth=row.max_depth,
+            score=float(row.score),
+        )
+        for i, row in enumerate(rows)
+    ]
+    return entries, total
@@ -0,0 +1,113 @@
+import csv
+import io
+import tempfile
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Sequence
+
+from fastapi.responses import StreamingResponse
+from openpyxl import Workbook
+
+CSV_FLUSH_ROWS = 1000
+XLSX_READ_CHUNK = 64 * 1024
+# Keep up to this many bytes of the finished workbook in memory before spilling to disk
+XLSX_SPOOL_LIMIT = 8 * 1024 * 1024
+# Excel's row limit per sheet, minus the header row
+XLSX_MAX_ROWS = 1_048_575
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def iter_csv(header: Sequence[str], rows: Iterable[Sequence]) -> Iterator[bytes]:
+    """Encode rows as CSV, flushing every CSV_FLUSH_ROWS rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens Cyrillic text as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(header)
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate(0)
+
+    pending = 0
+    for row in rows:
+        writer.writerow(["" if v is None else v for v in row])
+        pending += 1
+        if pending >= CSV_FLUSH_ROWS:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode("utf-8")
+
+
+def split_sheets(title: str, header: Sequence[str], rows: Iterable[Sequence],
+                 max_rows: int = XLSX_MAX_ROWS) -> Iterator[tuple]:
+    """
+    (title, header, rows) sheets of at most `max_rows` rows each, for
+    `iter_xlsx`. Continuation sheets are titled "<title> (2)", "(3)", ...
+    Rows are consumed lazily, one sheet after the other; no rows still give
+    one sheet with the header.
+    """
+    it = iter(rows)
+    first = next(it, None)
+    part = 1
+    while True:
+        chunk = [] if first is None else chain([first], islice(it, max_rows - 1))
+        yield (title if part == 1 else f"{title} ({part})", header, chunk)
+        first = next(it, None)
+        if first is None:
+            return
+        part += 1
+
+
+def iter_xlsx(sheets: Iterable[tuple]) -> Iterator[bytes]:
+    """
+    Build an XLSX with openpyxl write-only mode and stream it back.
+
+    `sheets` is an iterable of (title, header, rows), consumed in order.
+    Write-only worksheets keep rows in temp files, and the finished workbook
+    goes into a spooled file, so memory stays flat however many rows there
+    are. XLSX is a zip archive, so the first bytes go out only once the
+    workbook is complete.
+    """
+    workbook = Workbook(write_only=True)
+    for title, header, rows in sheets:
+        sheet = workbook.create_sheet(title=title[:31])
+        sheet.append(list(header))
+        for row in rows:
+            sheet.append(list(row))
+
+    with tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_LIMIT) as spooled:
+        workbook.save(spooled)
+        spooled.seek(0)
+        while True:
+            chunk = spooled.read(XLSX_READ_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+
+def tabular_response(
+    file_format: str,
+    filename: str,
+    header: List[str],
+    rows: Iterable[Sequence],
+    sheet_title: str = "Data",
+) -> StreamingResponse:
+    """StreamingResponse with `rows` as CSV, or as XLSX split into sheets at Excel's row limit."""
+    if file_format == "xlsx":
+        body = iter_xlsx(split_sheets(sheet_title, header, rows))
+    else:
+        body = iter_csv(header, rows)
+
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{file_format}"'},
+    )
@@ -0,0 +1,63 @@
+"""
+Calendar buckets for time-series aggregates.
+
+`bucket_start_expr` truncates a timestamp column to the start of its day,
+ISO week (Monday), month or year in SQL, so grouping happens in the
+database. Postgres uses `date_trunc`; SQLite gets an equivalent `date()`
+expression. Buckets are numbered consecutively by `bucket_index` so that
+adjacent buckets can be merged when a series has too many points.
+"""
+from datetime import date, datetime, timedelta
+from typing import Union
+
+from sqlalchemy import func
+
+BUCKETS = ("day", "week", "month", "year")
+
+# 1970-01-05 is a Monday, so week indexes count ISO weeks
+_EPOCH = date(1970, 1, 1)
+_WEEK_EPOCH = date(1970, 1, 5)
+
+
+def bucket_start_expr(column, bucket: str, dialect: str):
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket: {bucket}")
+    if dialect == "sqlite":
+        if bucket == "day":
+            return func.date(column)
+        if bucket == "week":
+            # Next Sunday (or the same day), then back to that week's Monday
+            return func.date(column, "weekday 0", "-6 days")
+        if bucket == "month":
+            return func.date(column, "start of month")
+        return func.date(column, "start of year")
+    return func.date_trunc(bucket, column)
+
+
+def to_date(value: Union[str, date, datetime]) -> date:
+    """Bucket start as returned by the driver (timestamp or ISO string) to a date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def bucket_index(start: date, bucket: str) -> int:
+    if bucket == "day":
+        return (start - _EPOCH).days
+    if bucket == "week":
+        return (start - _WEEK_EPOCH).days // 7
+    if bucket == "month":
+        return start.year * 12 + start.month - 1
+    return start.year
+
+
+def bucket_start(index: int, bucket: str) -> date:
+    if bucket == "day":
+        return _EPOCH + timedelta(days=index)
+    if bucket == "week":
+        return _WEEK_EPOCH + timedelta(weeks=index)
+    if bucket == "month":
+        return date(index // 12, index % 12 + 1, 1)
+    return date(index, 1, 1)
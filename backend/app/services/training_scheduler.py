@@ -0,0 +1,258 @@
+"""
+Background ML training after imports.
+
+Imports append their rows to the feature store, hand the positions to the
+scheduler and return; a worker thread trains later. Imports arriving in a
+burst are coalesced into one training: the worker waits
+ML_TRAIN_DEBOUNCE_SECONDS after the last import (but no longer than
+ML_TRAIN_MAX_DELAY_SECONDS after the first), and starts right away once
+ML_TRAIN_MIN_NEW_SAMPLES labeled rows are pending. A run is skipped when the
+pending rows carry no labels; with a model loaded, the unlabeled
+inspections are still scored then. Training reads every labeled row of the
+feature store; every inspection without an imported label is then scored
+with the new model (see batch_scoring). request_scoring() queues just the
+scoring, e.g. after another model version was activated.
+Pending positions are kept in memory only, so a restart drops them; their
+rows stay in the store and are trained on next time.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.events import event_bus
+from app.services.batch_scoring import score_unlabeled
+from app.services.feature_store import feature_store
+from app.services.ml_service import ml_service
+
+logger = logging.getLogger(__name__)
+
+
+class TrainingState(BaseModel):
+    status: str = Field(..., description="idle, waiting, training or scoring")
+    pending_imports: int = 0
+    pending_labeled: int = 0
+    pending_unlabeled: int = 0
+    store_records: int = Field(0, description="Rows in the feature store")
+    due_at: Optional[datetime] = Field(None, description="When the pending rows will be trained on")
+    runs: int = 0
+    skipped: int = 0
+    failed: int = 0
+    last_started_at: Optional[datetime] = None
+    last_finished_at: Optional[datetime] = None
+    last_result: Optional[str] = Field(None, description="trained, scored, skipped or failed")
+    last_detail: Optional[str] = None
+    scoring_requested: bool = False
+    last_scoring: Optional[Dict] = Field(None, description="Statistics of the last scoring run")
+
+
+class TrainingScheduler:
+    def __init__(self, debounce_seconds: float, max_delay_seconds: float, min_new_samples: int):
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.min_new_samples = min_new_samples
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        # (start, stop) feature store positions of the pending imports
+        self._ranges: List[Tuple[int, int]] = []
+        self._pending_rows = 0
+        self._pending_labeled = 0
+        self._first_at: Optional[float] = None
+        self._last_at: Optional[float] = None
+        self._training = False
+        self._scoring_requested = False
+        self._scoring = False
+        self._state = TrainingState(status="idle")
+
+    def notify(self, start: int, stop: int) -> None:
+        """Queue the feature store rows [start, stop) of an import for the next training"""
+        if start >= stop:
+            return
+        labeled = int((feature_store.read(start, stop)['label'] >= 0).sum())
+        with self._lock:
+            now = time.monotonic()
+            self._ranges.append((start, stop))
+            self._pending_rows += stop - start
+            self._pending_labeled += labeled
+            self._first_at = self._first_at or now
+            self._last_at = now
+            self._start_worker()
+
+    def request_scoring(self) -> None:
+        """Queue a scoring run of unlabeled inspections (e.g. after activating another model version)"""
+        with self._lock:
+            self._scoring_requested = True
+            self._start_worker()
+
+    def _start_worker(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="ml-training", daemon=True)
+            self._thread.start()
+        self._wake.notify_all()
+
+    def _due(self) -> float:
+        if self._pending_labeled >= self.min_new_samples:
+            return self._first_at
+        return min(self._last_at + self.debounce_seconds, self._first_at + self.max_delay_seconds)
+
+    def _take_due(self) -> Optional[List[Tuple[int, int]]]:
+        """
+        Wait until pending rows are due and take them, or until scoring is
+        requested (an empty list); None when shutting down
+        """
+        with self._lock:
+            while not self._stopping:
+                if not self._ranges:
+                    if self._scoring_requested:
+                        self._scoring_requested = False
+                        self._scoring = True
+                        return []
+                    self._wake.wait()
+                    continue
+                remaining = self._due() - time.monotonic()
+                if remaining > 0:
+                    self._wake.wait(remaining)
+                    continue
+                # Training scores afterwards anyway
+                self._scoring_requested = False
+                ranges = self._ranges
+                self._ranges = []
+                self._pending_rows = self._pending_labeled = 0
+                self._first_at = self._last_at = None
+                self._training = True
+                return ranges
+            return None
+
+    def _run(self) -> None:
+        while True:
+            ranges = self._take_due()
+            if ranges is None:
+                return
+            try:
+                if ranges:
+                    self.train_now(ranges)
+                else:
+                    self.score_now()
+            finally:
+                with self._lock:
+                    self._training = self._scoring = False
+
+    def _record(self, result: str, detail: Optional[str] = None) -> None:
+        with self._lock:
+            self._state.last_finished_at = datetime.utcnow()
+            self._state.last_result = result
+            self._state.last_detail = detail
+            if result == "skipped":
+                self._state.skipped += 1
+            elif result == "failed":
+                self._state.failed += 1
+        event_bus.publish("ml.training.finished", {"result": result, "detail": detail})
+
+    def train_now(self, ranges: List[Tuple[int, int]]) -> None:
+        """Train on the feature store and score the unlabeled inspections (what the worker runs)"""
+        records = feature_store.read()
+        positions = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+        positions = positions[positions < len(records)]
+        pending = records[positions]
+        unlabeled = positions[pending['label'] < 0]
+        labeled = len(positions) - len(unlabeled)
+        if not labeled:
+            self._skip_training("No labeled rows in the pending imports")
+            return
+
+        with Session(engine) as db:
+            with self._lock:
+                self._state.runs += 1
+                self._state.last_started_at = datetime.utcnow()
+            event_bus.publish("ml.training.started", {
+                'imports': len(ranges),
+                'labeled': labeled,
+                'unlabeled': len(unlabeled),
+                'store_records': len(records),
+            })
+            try:
+                logger.info(f"Training ML model after {len(ranges)} imports ({labeled} new labeled samples)")
+                train_metrics, test_metrics = ml_service.train(records)
+                if not train_metrics:
+                    self._record("skipped", "Not enough labeled data for training")
+                    return
+                metrics = ml_service.save_metrics(db, train_metrics, test_metrics)
+                # After the save, so the predictions carry the new model version
+                prediction_results = score_unlabeled(db, ml_service)
+                ml_service.record_predictions(db, metrics, prediction_results)
+                with self._lock:
+                    self._state.last_scoring = prediction_results
+            except Exception as e:
+                db.rollback()
+                logger.error(f"ML training failed: {e}", exc_info=True)
+                self._record("failed", f"{type(e).__name__}: {e}")
+                return
+        self._record("trained", f"Test accuracy {test_metrics.get('accuracy', 0):.4f}")
+
+    def _skip_training(self, reason: str) -> None:
+        """Nothing to train on: score the pending inspections with the model already loaded, if any"""
+        ml_service.sync_with_registry()
+        if ml_service.bundle is None:
+            self._record("skipped", reason)
+            return
+        results = self.score_now()
+        if 'error' in results:
+            self._record("failed", f"{reason}; scoring failed: {results['error']}")
+        else:
+            self._record("scored", f"{reason}; scored {results['predicted']} inspections")
+
+    def score_now(self) -> dict:
+        """Score unlabeled inspections with the current model, without training"""
+        with Session(engine) as db:
+            try:
+                ml_service.sync_with_registry()
+                results = score_unlabeled(db, ml_service)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"ML scoring failed: {e}", exc_info=True)
+                results = {'predicted': 0, 'error': f"{type(e).__name__}: {e}"}
+        with self._lock:
+            self._state.last_scoring = results
+        return results
+
+    def state(self) -> TrainingState:
+        with self._lock:
+            state = self._state.model_copy()
+            state.pending_imports = len(self._ranges)
+            state.pending_labeled = self._pending_labeled
+            state.pending_unlabeled = self._pending_rows - self._pending_labeled
+            state.store_records = len(feature_store)
+            if self._ranges:
+                state.due_at = datetime.utcnow() + timedelta(seconds=max(0.0, self._due() - time.monotonic()))
+            state.scoring_requested = self._scoring_requested
+            if self._training:
+                state.status = "training"
+            elif self._scoring:
+                state.status = "scoring"
+            elif self._ranges:
+                state.status = "waiting"
+            else:
+                state.status = "idle"
+        return state
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._stopping = True
+            self._wake.notify_all()
+
+
+training_scheduler = TrainingScheduler(
+    settings.ML_TRAIN_DEBOUNCE_SECONDS,
+    settings.ML_TRAIN_MAX_DELAY_SECONDS,
+    settings.ML_TRAIN_MIN_NEW_SAMPLES,
+)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Render PDF reports for all pipelines (or the given ones) into one ZIP archive.
+
+Month-end run:
+    python batch_reports.py -o reports.zip
+    python batch_reports.py -o reports.zip --mode summary MT-01 MT-02
+"""
+import argparse
+import sys
+
+from fastapi import HTTPException
+from sqlmodel import Session
+
+from app.core.database import engine
+from app.services.report_batch import iter_report_archive, plan_report_batch
+from app.services.report_jobs import report_jobs
+
+
+def print_progress(pipeline_id: str, status: str, finished: int, total: int):
+    print(f"[{finished}/{total}] {pipeline_id}: {status}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pipelines", nargs="*", help="Pipeline IDs (default: all)")
+    parser.add_argument("-o", "--output", default="reports.zip")
+    parser.add_argument("--mode", choices=["full", "capped", "summary"], default=None,
+                        help="Registry mode for large pipelines (default from settings)")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        try:
+            plan = plan_report_batch(session, args.pipelines or None, args.mode)
+        except HTTPException as e:
+            sys.exit(e.detail)
+    try:
+        with open(args.output, "wb") as out:
+            for chunk in iter_report_archive(plan, args.mode, print_progress):
+                out.write(chunk)
+    finally:
+        report_jobs.shutdown()
+    print(f"Wrote {len(plan)} reports to {args.output}")
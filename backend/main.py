@@ -1,8 +1,18 @@
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlmodel import Session
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import engine, init_db
 from app.api import api_router
+from app.services.dashboard_rollups import rebuild_rollups_if_empty
+from app.services.feature_store import feature_store
+from app.services.ml_service import ml_service
+from app.services.report_jobs import report_jobs
+from app.services.training_scheduler import training_scheduler
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="PromTech API",
@@ -26,8 +36,23 @@ app.include_router(api_router, prefix=settings.API_V1_PREFIX)
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database on startup"""
+    """Initialize database, ML feature store and the active ML model on startup"""
     init_db()
+    with Session(engine) as session:
+        rebuild_rollups_if_empty(session)
+        feature_store.sync_with_database(session)
+    try:
+        ml_service.load_at_startup()
+    except Exception as e:
+        # Without a model predictions wait for the next training, as before
+        logger.error(f"Could not load ML model: {e}")
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Stop report worker processes and the training worker"""
+    report_jobs.shutdown()
+    training_scheduler.shutdown()
 
 
 @app.get("/")
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Rebuild dashboard rollup tables from inspections and defects.
+
+Run after backfills or manual data fixes:
+    python rebuild_rollups.py
+"""
+from sqlmodel import Session
+
+from app.core.database import engine, init_db
+from app.services.dashboard_rollups import rebuild_rollups
+
+if __name__ == "__main__":
+    init_db()
+    with Session(engine) as session:
+        result = rebuild_rollups(session)
+    print(f"Rebuilt {result['rollup_cells']} rollup cells and {result['risk_entries']} risk entries")
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Settings are read at import time: point the app at a throwaway database and model directory first
+_workdir = tempfile.mkdtemp(prefix="promtech-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ["ML_MODEL_DIR"] = os.path.join(_workdir, "ml_models")
+os.environ["ML_TRAIN_DEBOUNCE_SECONDS"] = "0.2"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
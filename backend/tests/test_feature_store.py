@@ -0,0 +1,85 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+from sqlmodel import Session, delete, select
+
+from app.core.database import engine, init_db
+from app.models import DiagnosticMethod, Inspection, MLLabel
+from app.services.data_version import get_database_id
+from app.services.feature_store import FeatureStore, database_records
+
+
+@pytest.fixture
+def db():
+    init_db()
+    with Session(engine) as session:
+        inspections = [
+            Inspection(object_id=1, date=datetime(2024, 1, day), method=DiagnosticMethod.VIK,
+                       temperature=float(day), ml_label=MLLabel.NORMAL)
+            for day in range(1, 11)
+        ]
+        session.add_all(inspections)
+        session.commit()
+        ids = [inspection.inspection_id for inspection in inspections]
+        yield session
+        session.exec(delete(Inspection).where(Inspection.inspection_id.in_(ids)))
+        session.commit()
+
+
+def database_ids(db: Session) -> list:
+    return sorted(db.exec(select(Inspection.inspection_id)).all())
+
+
+def assert_matches_database(store: FeatureStore, db: Session):
+    assert np.asarray(store.read()).tobytes() == database_records(db, database_ids(db)).tobytes()
+
+
+def test_sync_builds_missing_store(db, tmp_path):
+    store = FeatureStore(str(tmp_path))
+    assert store.sync_with_database(db) == len(database_ids(db))
+    assert_matches_database(store, db)
+    assert store.sync_with_database(db) is None
+
+
+def test_sync_appends_missing_records_and_keeps_the_others(db, tmp_path):
+    store = FeatureStore(str(tmp_path))
+    ids = database_ids(db)
+    imported = database_records(db, ids[:-3])
+    imported['param1'] = 42.0  # raw value the database does not keep
+    store.append(imported)
+
+    assert store.sync_with_database(db) == 3
+    records = np.asarray(store.read())
+    assert records[:-3].tobytes() == imported.tobytes()
+    assert sorted(records['inspection_id'].tolist()) == ids
+
+
+def test_sync_rebuilds_store_of_another_database(db, tmp_path):
+    store = FeatureStore(str(tmp_path))
+    # Same ids, other contents: what a reset database leaves behind when ML_MODEL_DIR is kept
+    stale = database_records(db, database_ids(db))
+    stale['label'] = 0
+    stale['temperature'] = -1.0
+    store.append(stale)
+    header = json.loads(open(store.header_path).read())
+    with open(store.header_path, 'w') as f:
+        json.dump({**header, 'database_id': get_database_id(db) + 1}, f)
+
+    assert store.sync_with_database(db) == len(database_ids(db))
+    assert_matches_database(store, db)
+
+
+def test_sync_rebuilds_store_with_unknown_or_duplicate_ids(db, tmp_path):
+    store = FeatureStore(str(tmp_path))
+    ids = database_ids(db)
+    stale = database_records(db, ids)
+    store.append(stale)
+    store.append(stale[:2])
+    extra = stale[:1].copy()
+    extra['inspection_id'] = max(ids) + 1000
+    store.append(extra)
+
+    assert store.sync_with_database(db) == len(ids)
+    assert_matches_database(store, db)
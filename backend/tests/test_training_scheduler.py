@@ -0,0 +1,67 @@
+import io
+import os
+import time
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, func, select
+
+from app.core.database import engine
+from app.models import Inspection, InspectionPrediction
+from app.services.ml_service import ml_service
+from app.services.training_scheduler import training_scheduler
+from main import app
+
+MISC_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "misc")
+
+
+def upload(client: TestClient, name: str, data: bytes) -> dict:
+    response = client.post("/api/v1/csv/import/", files={"file": (name, io.BytesIO(data), "text/csv")})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def wait_idle(timeout: float = 120.0) -> dict:
+    deadline = time.monotonic() + timeout
+    time.sleep(0.3)
+    while time.monotonic() < deadline:
+        state = training_scheduler.state()
+        if state.status == "idle" and not state.pending_imports:
+            return state.model_dump()
+        time.sleep(0.1)
+    pytest.fail("Background training did not finish")
+
+
+def null_labels() -> int:
+    with Session(engine) as db:
+        return db.exec(select(func.count()).select_from(Inspection).where(Inspection.ml_label.is_(None))).one()
+
+
+def test_unlabeled_only_import_is_scored_with_loaded_model():
+    diagnostics = pd.read_csv(os.path.join(MISC_DIR, "diagnostic_data.csv"))
+    labeled = diagnostics.iloc[:1500]
+    unlabeled = diagnostics.iloc[1500:1550].copy()
+    unlabeled["diag_id"] += 100000
+    unlabeled["ml_label"] = None
+
+    with TestClient(app) as client:
+        with open(os.path.join(MISC_DIR, "objects.csv"), "rb") as f:
+            upload(client, "objects.csv", f.read())
+        upload(client, "labeled.csv", labeled.to_csv(index=False).encode())
+        state = wait_idle()
+        assert state["last_result"] == "trained"
+        assert ml_service.bundle is not None
+
+        created = upload(client, "unlabeled.csv", unlabeled.to_csv(index=False).encode())["created"]
+        assert created
+        state = wait_idle()
+
+    assert state["last_result"] == "scored"
+    assert null_labels() == 0
+    with Session(engine) as db:
+        scored = db.exec(
+            select(func.count()).select_from(InspectionPrediction)
+            .where(InspectionPrediction.model_version == ml_service.version)
+        ).one()
+    assert scored >= len(unlabeled)
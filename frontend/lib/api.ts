@@ -240,18 +240,18 @@ export async function captureMapImage(): Promise<string | null> {
 }
 
 export async function downloadPipelineReport(pipelineId: string, mapImage?: string | null): Promise<void> {
-  const url = `${API_BASE_URL}/reports/${pipelineId}/pdf`;
+  const url = `${API_BASE_URL}/reports/${pipelineId}/pdf/upload`;
   
-  const base64Data = mapImage ? mapImage.replace(/^data:image\/png;base64,/, '') : null;
+  // Скриншот уходит бинарным файлом, а не base64 в JSON
+  const formData = new FormData();
+  if (mapImage) {
+    const imageBlob = await (await fetch(mapImage)).blob();
+    formData.append('map_image', imageBlob, 'map.png');
+  }
   
   const response = await fetch(url, {
     method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-    },
-    body: JSON.stringify({
-      map_image: base64Data
-    })
+    body: formData
   });
   
   if (!response.ok) {